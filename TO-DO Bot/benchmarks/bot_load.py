@@ -0,0 +1,271 @@
+"""End-to-end load test: drives the real router with synthetic updates.
+
+Seeds a temporary database with --users users of --tasks tasks each, then
+every user runs the main flows (add, list, paginate, done, edit, stats,
+export) --rounds times, --concurrency users at a time. Updates go through
+Dispatcher.feed_raw_update and the bot answers through FakeSession, so
+nothing leaves the machine. A deadline sweep of check_deadlines follows.
+Importing handlers still opens the bot's tasks.db, but nothing is written
+to it.
+
+Latency is per flow, from its first update to the end of its last handler.
+With --output the results are also written as JSON; --compare prints the
+change against such a file from an earlier commit.
+
+    python benchmarks/bot_load.py --users 200 --tasks 50 --rounds 3 --output before.json
+    python benchmarks/bot_load.py --users 200 --tasks 50 --rounds 3 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Dispatcher
+
+import handlers
+from benchmarks.fake_bot import create_fake_bot
+from cache import UserCache
+from callbacks import (CategoryCallback, DayCallback, DoneTaskCallback, EditFieldCallback, EditTaskCallback, ExportCallback,
+                       ListCallback, PageCallback, TimeCallback)
+from database import TaskManager
+from metrics import handler_seconds
+from outbound import OutboundQueue
+from scheduler import SchedulerManager
+
+CATEGORIES = ('Работа', 'Дом', 'Учёба')
+FLOWS = ('add', 'list', 'paginate', 'done', 'edit', 'stats', 'export')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+def summarize(latencies, elapsed=None):
+    summary = {
+        'count': len(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000,
+    }
+    if elapsed:
+        summary['per_second'] = len(latencies) / elapsed
+    return summary
+
+
+class UpdateFactory:
+    """Builds raw Update dicts the way Telegram would send them."""
+
+    def __init__(self):
+        self.update_id = 0
+
+    def next_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    def chat(self, user_id):
+        return {'id': user_id, 'type': 'private'}, {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+    def message(self, user_id, text):
+        chat, user = self.chat(user_id)
+        update_id = self.next_id()
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        chat, user = self.chat(user_id)
+        update_id = self.next_id()
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'text': '...'}
+        return {'update_id': update_id, 'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                                                           'message': message, 'data': data}}
+
+
+class LoadTest:
+    def __init__(self, task_manager, dp, bot, factory):
+        self.task_manager = task_manager
+        self.dp = dp
+        self.bot = bot
+        self.factory = factory
+        self.latencies = {flow: [] for flow in FLOWS}
+        self.updates = 0
+        # Per user: task ids still open, and the cursor that opens page two.
+        self.open_tasks = {}
+        self.second_page = {}
+
+    async def seed(self, users, tasks):
+        for user_id in range(1, users + 1):
+            for index, category in enumerate(CATEGORIES):
+                count = tasks // len(CATEGORIES) + (1 if index < tasks % len(CATEGORIES) else 0)
+                await self.task_manager.add_tasks(user_id, [f'Задача {n} в {category}' for n in range(count)], category)
+                await self.task_manager.add_category(user_id, category)
+            rows = await self.task_manager.get_tasks(user_id, completed=0)
+            self.open_tasks[user_id] = [task.id for task in rows]
+            first_page = await self.task_manager.get_tasks(user_id, completed=0, limit=handlers.TASKS_PER_PAGE)
+            self.second_page[user_id] = first_page[-1].id if len(first_page) == handlers.TASKS_PER_PAGE else 0
+
+    async def feed(self, updates):
+        for update in updates:
+            await self.dp.feed_raw_update(self.bot, update)
+        self.updates += len(updates)
+
+    def flow_updates(self, flow, user_id, round_no):
+        make_message, make_callback = self.factory.message, self.factory.callback
+        if flow == 'add':
+            tomorrow = datetime.now() + timedelta(days=1)
+            return [make_callback(user_id, 'cmd_add'),
+                    make_callback(user_id, CategoryCallback(name=CATEGORIES[round_no % len(CATEGORIES)]).pack()),
+                    make_message(user_id, f'Новая задача {round_no}'),
+                    make_callback(user_id, DayCallback(year=tomorrow.year, month=tomorrow.month, day=tomorrow.day).pack()),
+                    make_callback(user_id, TimeCallback(hour=12, minute=0).pack())]
+        if flow == 'list':
+            return [make_callback(user_id, 'cmd_list'), make_callback(user_id, ListCallback().pack())]
+        if flow == 'paginate':
+            return [make_callback(user_id, PageCallback(direction='n', cursor=self.second_page[user_id], action='view').pack())]
+        if flow == 'done':
+            task_ids = self.open_tasks[user_id]
+            return [make_callback(user_id, 'cmd_done')] + ([make_callback(user_id, DoneTaskCallback(task_id=task_ids.pop()).pack())] if task_ids else [])
+        if flow == 'edit':
+            task_id = self.open_tasks[user_id][0] if self.open_tasks[user_id] else 0
+            return [make_callback(user_id, 'cmd_edit'), make_callback(user_id, EditTaskCallback(task_id=task_id).pack()),
+                    make_callback(user_id, EditFieldCallback(field='text', task_id=task_id).pack()),
+                    make_message(user_id, f'Переименовано {round_no}')]
+        if flow == 'stats':
+            return [make_callback(user_id, 'cmd_stats')]
+        return [make_callback(user_id, 'cmd_export'), make_callback(user_id, ExportCallback(fmt='csv', compressed=False).pack())]
+
+    async def run_user(self, user_id, rounds, semaphore):
+        async with semaphore:
+            for round_no in range(rounds):
+                for flow in FLOWS:
+                    updates = self.flow_updates(flow, user_id, round_no)
+                    start = time.perf_counter()
+                    await self.feed(updates)
+                    self.latencies[flow].append(time.perf_counter() - start)
+
+
+async def deadline_sweep(task_manager, bot, users, sweeps):
+    # One due task per user inside the reminder window, so the first sweep
+    # claims and sends them all and the rest measure an idle sweep.
+    deadline = int((datetime.now() + timedelta(minutes=5)).timestamp())
+    for user_id in range(1, users + 1):
+        await task_manager.add_task(user_id, 'Срочная задача', CATEGORIES[0], deadline)
+    outbound = OutboundQueue(bot)
+    outbound.start()
+    scheduler_manager = SchedulerManager(bot, outbound, task_manager)
+    timings = []
+    for _ in range(sweeps):
+        start = time.perf_counter()
+        await scheduler_manager.check_deadlines()
+        timings.append(time.perf_counter() - start)
+    await outbound.stop()
+    return {'due': users, 'first_ms': timings[0] * 1000, 'idle': summarize(timings[1:]) if len(timings) > 1 else None,
+            'sent': outbound.metrics['sent']}
+
+
+def handler_counts():
+    # Calls per handler from the router's metrics middleware, split by outcome,
+    # so a flow that silently stopped matching its handler shows up.
+    counts = {}
+    for (event, name, status), series in handler_seconds.series.items():
+        counts.setdefault(name, {}).setdefault(status, 0)
+        counts[name][status] += series[2]
+    return counts
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results, baseline):
+    print(f"\ncompared with {baseline.get('revision') or 'baseline'}:")
+    for flow, summary in results['flows'].items():
+        before = baseline.get('flows', {}).get(flow)
+        if before:
+            change = (summary['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+            print(f"  {flow:<9} p95 {before['p95_ms']:8.2f} -> {summary['p95_ms']:8.2f} ms ({change:+.1f}%)")
+    before = baseline.get('updates_per_second')
+    if before:
+        print(f"  throughput {before:.0f} -> {results['updates_per_second']:.0f} updates/s")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(os.path.join(tmp, 'bench.db'), cache=UserCache())
+        # The handlers use the module-level manager; point it at the seeded database.
+        handlers.task_manager = task_manager
+        bot = create_fake_bot(args.latency)
+        dp = Dispatcher()
+        dp.include_router(handlers.router)
+        load = LoadTest(task_manager, dp, bot, UpdateFactory())
+        start = time.perf_counter()
+        await load.seed(args.users, args.tasks)
+        print(f"seeded {args.users} users x {args.tasks} tasks in {time.perf_counter() - start:.1f}s")
+        semaphore = asyncio.Semaphore(args.concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(load.run_user(user_id, args.rounds, semaphore) for user_id in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - start
+        sweep = await deadline_sweep(task_manager, bot, args.users, args.sweeps)
+        task_manager.close()
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'elapsed_s': elapsed,
+        'updates': load.updates,
+        'updates_per_second': load.updates / elapsed,
+        'flows': {flow: summarize(latencies, elapsed) for flow, latencies in load.latencies.items()},
+        'deadline_sweep': sweep,
+        'handlers': handler_counts(),
+    }
+    print(f"{load.updates} updates in {elapsed:.2f}s: {results['updates_per_second']:.0f} updates/s")
+    for flow, summary in results['flows'].items():
+        print(f"  {flow:<9} p50 {summary['p50_ms']:8.2f} ms  p95 {summary['p95_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms  "
+              f"{summary['per_second']:7.1f} flows/s")
+    errors = {name: counts['error'] for name, counts in results['handlers'].items() if counts.get('error')}
+    if errors:
+        print(f"handler errors: {errors}")
+    idle = sweep['idle']
+    print(f"deadline sweep: {sweep['due']} due in {sweep['first_ms']:.1f} ms, "
+          f"idle p50 {idle['p50_ms'] if idle else 0:.2f} ms, sent {sweep['sent']}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            print_comparison(results, json.load(file))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tasks', type=int, default=50, help='seeded tasks per user')
+    parser.add_argument('--rounds', type=int, default=3, help='times every user runs each flow')
+    parser.add_argument('--concurrency', type=int, default=50, help='users active at the same time')
+    parser.add_argument('--sweeps', type=int, default=20, help='check_deadlines runs after the flows')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated API round-trip in seconds')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
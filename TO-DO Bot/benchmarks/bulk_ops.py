@@ -0,0 +1,50 @@
+"""Per-row cost of the bulk TaskManager methods against one call per row.
+
+    python benchmarks/bulk_ops.py --rows 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import TaskManager
+
+
+async def timed(name, rows, coro):
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    print(f"{name:28} {elapsed / rows * 1e6:9.1f} µs/row")
+
+
+async def one_by_one(method, rows):
+    for row in rows:
+        await method(*row)
+
+
+async def run(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(os.path.join(tmp, 'bench.db'))
+        texts = [f'Задача {n}' for n in range(rows)]
+        await timed('add_task x N', rows, one_by_one(task_manager.add_task, [(1, text, 'Общее') for text in texts]))
+        await timed('add_tasks', rows, task_manager.add_tasks(2, texts, 'Общее'))
+        single = [task.id for task in await task_manager.get_tasks(1, completed=0)]
+        bulk = [task.id for task in await task_manager.get_tasks(2, completed=0)]
+        await timed('complete_task x N', rows, one_by_one(task_manager.complete_task, [(task_id, 1) for task_id in single]))
+        await timed('complete_tasks', rows, task_manager.complete_tasks(2, bulk))
+        await timed('delete_task x N', rows, one_by_one(task_manager.delete_task, [(task_id, 1) for task_id in single]))
+        await timed('delete_tasks', rows, task_manager.delete_tasks(2, bulk))
+        task_manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args.rows))
@@ -0,0 +1,68 @@
+"""DB round-trips saved by the per-user cache over a typical session.
+
+Replays the TaskManager calls the handlers make for an add / list / done
+session, once without the cache and once with it, and counts the SQL
+statements that actually reached sqlite.
+
+    python benchmarks/cache_roundtrips.py --users 200 --sessions 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import UserCache
+from database import TaskManager
+
+PAGE = 6
+
+
+async def session(task_manager, user_id, n):
+    # "Добавить задачу": category keyboard, then the task itself
+    await task_manager.get_categories(user_id)
+    await task_manager.add_task(user_id, f'Задача {n}', 'Общее', None)
+    # "Список задач": category list, "Все задачи", one page turn back and forth
+    await task_manager.get_categories(user_id)
+    tasks = await task_manager.get_tasks(user_id, completed=0, category=None, limit=PAGE)
+    await task_manager.count_tasks(user_id, completed=0, category=None)
+    await task_manager.get_categories(user_id)
+    await task_manager.get_tasks(user_id, completed=0, category=None, limit=PAGE)
+    await task_manager.count_tasks(user_id, completed=0, category=None)
+    # "Завершить задачу": task list, then complete one
+    await task_manager.get_tasks(user_id, completed=0, category=None, limit=PAGE)
+    await task_manager.complete_task(tasks[0].id, user_id)
+    await task_manager.get_tasks(user_id, completed=0, category=None, limit=PAGE)
+
+
+async def measure(cache, users, sessions):
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(os.path.join(tmp, 'bench.db'), cache=cache)
+        statements = []
+        task_manager.executor.submit(lambda: task_manager.connect().set_trace_callback(statements.append)).result()
+        for n in range(sessions):
+            await asyncio.gather(*(session(task_manager, user_id, n) for user_id in range(users)))
+        task_manager.close()
+    return sum(1 for sql in statements if not sql.startswith(('BEGIN', 'COMMIT')))
+
+
+async def run(users, sessions):
+    uncached = await measure(None, users, sessions)
+    cache = UserCache()
+    cached = await measure(cache, users, sessions)
+    total = users * sessions
+    print(f"sessions: {total}")
+    print(f"without cache: {uncached} queries ({uncached / total:.1f} per session)")
+    print(f"with cache:    {cached} queries ({cached / total:.1f} per session)")
+    print(f"saved: {uncached - cached} round-trips ({(uncached - cached) / uncached:.0%})")
+    print(f"cache stats: {cache.stats}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.sessions))
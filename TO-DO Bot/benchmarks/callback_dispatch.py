@@ -0,0 +1,75 @@
+"""Cost of routing one button press as the number of callback handlers grows.
+
+Compares a router with one lambda prefix filter per handler, as handlers.py
+used to register them, with a CallbackTable holding the same prefixes. The
+pressed button belongs to the last handler, which is the worst case for the
+filter chain and makes no difference to the table.
+
+    python benchmarks/callback_dispatch.py --handlers 5 25 100 400
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Dispatcher, Router
+
+from benchmarks.fake_bot import create_fake_bot
+from callbacks import CallbackTable
+
+
+async def noop(callback):
+    pass
+
+
+def chain_router(count):
+    router = Router()
+    for index in range(count):
+        prefix = f'action{index}_'
+        router.callback_query(lambda c, prefix=prefix: c.data.startswith(prefix))(noop)
+    return router
+
+
+def table_router(count):
+    router = Router()
+    table = CallbackTable()
+    for index in range(count):
+        table.register(f'action{index}')(noop)
+    router.callback_query()(table.dispatch)
+    return router
+
+
+def callback_update(n, data):
+    user = {'id': 1, 'is_bot': False, 'first_name': 'Bench'}
+    message = {'message_id': n, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': '...'}
+    return {'update_id': n, 'callback_query': {'id': str(n), 'from': user, 'chat_instance': '1', 'message': message, 'data': data}}
+
+
+async def measure(router, data, repeat):
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = create_fake_bot()
+    updates = [callback_update(n, data) for n in range(repeat)]
+    await dp.feed_raw_update(bot, updates[0])
+    start = time.perf_counter()
+    for update in updates:
+        await dp.feed_raw_update(bot, update)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def run(counts, repeat):
+    for count in counts:
+        chain = await measure(chain_router(count), f'action{count - 1}_1', repeat)
+        table = await measure(table_router(count), f'action{count - 1}', repeat)
+        print(f"{count:4d} handlers: lambda chain {chain:8.1f} us/update, dispatch table {table:8.1f} us/update")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--handlers', type=int, nargs='+', default=[5, 25, 100, 400])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.handlers, args.repeat))
@@ -0,0 +1,65 @@
+"""Handler latency under concurrent load against the async TaskManager.
+
+Every simulated user runs a typical handler sequence (add, list, complete)
+at the same time; the script reports per-handler latency percentiles and the
+worst event-loop stall observed while the queries were running.
+
+    python benchmarks/db_latency.py --users 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import TaskManager
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+async def simulated_handler(task_manager, user_id, latencies):
+    start = time.perf_counter()
+    await task_manager.add_task(user_id, f"Задача {user_id}", "Общее", None)
+    tasks = await task_manager.get_tasks(user_id, completed=0)
+    if tasks:
+        await task_manager.complete_task(tasks[0].id, user_id)
+    latencies.append(time.perf_counter() - start)
+
+
+async def measure_loop_lag(stop, lags, interval=0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(users):
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(os.path.join(tmp, 'bench.db'))
+        latencies, lags = [], []
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(measure_loop_lag(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(simulated_handler(task_manager, user_id, latencies) for user_id in range(users)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+        task_manager.close()
+    print(f"users: {users}, total: {elapsed:.3f}s")
+    for pct in (50, 95, 99):
+        print(f"p{pct} handler latency: {percentile(latencies, pct) * 1000:.2f} ms")
+    print(f"max event loop stall: {max(lags, default=0) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users))
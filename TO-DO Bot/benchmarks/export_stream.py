@@ -0,0 +1,59 @@
+"""Streaming export of a single very large user.
+
+Seeds one user with N tasks, then runs the CSV, JSONL and gzip exports and
+reports time, output size and how much the process RSS grew while exporting.
+
+    python benchmarks/export_stream.py --tasks 1000000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import TaskManager, add_search_function
+from export import build_export
+
+
+def seed(db_path, tasks):
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    add_search_function(conn)
+    with conn:
+        conn.executemany('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+                         ((1, f'Задача номер {n}', 'Работа', now + n if n % 3 else None, n % 2, now - n) for n in range(tasks)))
+    conn.close()
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(tasks):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'export.db')
+        task_manager = TaskManager(db_path)
+        seed(db_path, tasks)
+        for fmt, compress in (('csv', False), ('jsonl', False), ('csv', True)):
+            rss_before = max_rss_mb()
+            start = time.perf_counter()
+            spool, count = await asyncio.to_thread(build_export, task_manager, 1, fmt, compress)
+            elapsed = time.perf_counter() - start
+            size = spool.seek(0, os.SEEK_END)
+            spool.close()
+            print(f"{fmt}{'.gz' if compress else ''}: {count} rows in {elapsed:.2f}s "
+                  f"({count / elapsed:,.0f} rows/s), {size / 2**20:.1f} MiB, "
+                  f"peak RSS growth {max_rss_mb() - rss_before:.1f} MiB")
+        task_manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=1_000_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.tasks))
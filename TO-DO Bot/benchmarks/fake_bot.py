@@ -0,0 +1,30 @@
+"""Offline Bot session for benchmarks: answers every API call locally."""
+import asyncio
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+
+FAKE_TOKEN = '42:TEST'
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def create_fake_bot(latency: float = 0.0) -> Bot:
+    return Bot(token=FAKE_TOKEN, session=FakeSession(latency))
@@ -0,0 +1,58 @@
+"""Per-update FSM state overhead: SQLiteStorage against aiogram's MemoryStorage.
+
+Every simulated update reads the state and data of its chat and writes both
+back, which is what the AddTask/EditTask steps do.
+
+    python benchmarks/fsm_overhead.py --chats 1000 --updates 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+from states import AddTask
+
+
+async def drive(storage, chats, updates):
+    keys = [StorageKey(bot_id=42, chat_id=chat, user_id=chat) for chat in range(chats)]
+    start = time.perf_counter()
+    for n in range(updates):
+        key = random.choice(keys)
+        await storage.get_state(key)
+        data = await storage.get_data(key)
+        data['text'] = f'Задача {n}'
+        await storage.set_data(key, data)
+        await storage.set_state(key, AddTask.waiting_for_deadline_date)
+    elapsed = time.perf_counter() - start
+    close_start = time.perf_counter()
+    await storage.close()
+    return elapsed, time.perf_counter() - close_start
+
+
+async def run(chats, updates):
+    with tempfile.TemporaryDirectory() as tmp:
+        storages = {
+            'MemoryStorage': MemoryStorage(),
+            'SQLiteStorage (coalesced)': SQLiteStorage(os.path.join(tmp, 'coalesced.db')),
+            'SQLiteStorage (write-through)': SQLiteStorage(os.path.join(tmp, 'through.db'), flush_interval=0),
+        }
+        for name, storage in storages.items():
+            elapsed, closing = await drive(storage, chats, updates)
+            print(f"{name:30} {elapsed / updates * 1e6:8.1f} µs/update, final flush {closing * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.updates))
@@ -0,0 +1,70 @@
+"""Write throughput with and without group commit.
+
+Concurrent users each run a stream of mutations (add a task, add a subtask,
+complete the subtask, edit and complete the task). "Before" commits every
+write in a transaction of its own (a batch size of 1), "after" uses the
+default WriteQueue batching. Both run with synchronous=FULL, so every commit
+pays for a sync of the disk; run it on the disk the bot's database lives on.
+
+    python benchmarks/group_commit.py --users 200 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import WRITE_BATCH_DELAY, WRITE_BATCH_SIZE, TaskManager
+from benchmarks.db_latency import percentile
+
+WRITES_PER_ROUND = 6
+
+
+async def user_writes(task_manager, user_id, rounds, latencies):
+    for n in range(rounds):
+        start = time.perf_counter()
+        await task_manager.add_task(user_id, f"Задача {n}", "Общее", None)
+        task = (await task_manager.get_tasks(user_id, completed=0, limit=1))[0]
+        await task_manager.add_subtask(task.id, user_id, "Подзадача")
+        subtask_id = (await task_manager.get_subtasks(task.id))[0][0]
+        await task_manager.complete_subtask(subtask_id, task.id, user_id)
+        await task_manager.edit_task(task.id, user_id, text=f"Задача {n}!")
+        await task_manager.complete_task(task.id, user_id)
+        # Read-your-writes: the completed task must be gone from the list.
+        assert not await task_manager.get_tasks(user_id, completed=0), "write not visible to its own user"
+        latencies.append((time.perf_counter() - start) / WRITES_PER_ROUND)
+
+
+async def measure(directory, name, users, rounds, delay, batch_size):
+    task_manager = TaskManager(os.path.join(directory, f'{name}.db'), write_delay=delay, write_batch_size=batch_size)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(user_writes(task_manager, user_id, rounds, latencies) for user_id in range(users)))
+    elapsed = time.perf_counter() - start
+    stats = dict(task_manager.writes.stats)
+    task_manager.close()
+    writes = users * rounds * WRITES_PER_ROUND
+    print(f"{name:>6}: {writes / elapsed:8.0f} writes/s, {stats['batches']} commits, "
+          f"{stats['writes'] / max(stats['batches'], 1):.1f} writes/commit, "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms per write")
+    return writes / elapsed
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        before = await measure(directory, 'before', args.users, args.rounds, 0, 1)
+        after = await measure(directory, 'after', args.users, args.rounds, args.delay, args.batch_size)
+    print(f"group commit: {after / before:.1f}x the write throughput")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--delay', type=float, default=WRITE_BATCH_DELAY, help='seconds a write may wait for its batch')
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE)
+    parser.add_argument('--dir', help='where to create the temporary databases')
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,49 @@
+"""Streaming import of a large export file.
+
+Exports N seeded tasks of one user, imports the file into a second user and
+then imports it again, when every row is a duplicate. Reports rows/s and how
+much the process RSS grew while importing.
+
+    python benchmarks/import_stream.py --tasks 200000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.export_stream import max_rss_mb, seed
+from database import TaskManager
+from export import build_export
+from task_import import import_tasks
+
+
+async def run(tasks):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'import.db')
+        task_manager = TaskManager(db_path)
+        seed(db_path, tasks)
+        for fmt, compress in (('csv', False), ('jsonl', True)):
+            spool, count = await asyncio.to_thread(build_export, task_manager, 1, fmt, compress)
+            user_id = 2 if not compress else 3
+            for label in ('fresh', 'duplicates'):
+                rss_before = max_rss_mb()
+                start = time.perf_counter()
+                stats = await import_tasks(task_manager, user_id, spool)
+                elapsed = time.perf_counter() - start
+                print(f"{fmt}{'.gz' if compress else ''} {label}: {stats} in {elapsed:.2f}s "
+                      f"({count / elapsed:,.0f} rows/s), peak RSS growth {max_rss_mb() - rss_before:.1f} MiB")
+            spool.close()
+        task_manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=200_000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args.tasks))
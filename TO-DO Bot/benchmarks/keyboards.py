@@ -0,0 +1,51 @@
+"""Build time and allocations of the calendar and time-picker keyboards.
+
+"rebuilt" constructs the markup from scratch the way every tap used to;
+"cached" goes through Calendar, which reuses it until the date or the half
+hour changes.
+
+    python benchmarks/keyboards.py --repeat 2000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_calendar import Calendar, build_calendar, build_time_picker
+
+
+def measure(name, func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - start
+    # Keeps the results alive, as a reply awaiting delivery would.
+    tracemalloc.start()
+    results = [func() for _ in range(100)]
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    print(f"{name:24} {elapsed / repeat * 1e6:9.2f} µs/call, {allocated / 100 / 1024:7.2f} KiB retained/call")
+
+
+def run(repeat):
+    now = datetime.now()
+    today = now.date()
+    slot = now.hour * 2 + now.minute // 30
+    cached = Calendar()
+    measure('calendar rebuilt', lambda: build_calendar(now.year, now.month, today), repeat)
+    measure('calendar cached', lambda: cached.create_calendar(now.year, now.month), repeat)
+    measure('time picker rebuilt', lambda: build_time_picker(slot), repeat)
+    measure('time picker cached', cached.create_time_picker, repeat)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,57 @@
+"""Sustained throughput of the outbound queue against a fake Bot.
+
+Also reports the most messages completed within any one second, which has
+to stay at the global rate (one more counting both ends of the second) from
+the very first second on.
+
+    python benchmarks/outbound_throughput.py --messages 600 --chats 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.methods import SendMessage
+
+from benchmarks.fake_bot import create_fake_bot
+from outbound import GLOBAL_RATE, OutboundQueue, RateLimitMiddleware
+
+
+async def run(messages, chats, latency, global_rate):
+    bot = create_fake_bot(latency)
+    limiter = RateLimitMiddleware(global_rate=global_rate)
+    bot.session.middleware(limiter)
+    outbound = OutboundQueue(bot)
+    outbound.start()
+    start = time.perf_counter()
+    done = []
+    futures = []
+    for i in range(messages):
+        future = await outbound.submit(SendMessage(chat_id=i % chats, text='⏰'))
+        future.add_done_callback(lambda _: done.append(time.perf_counter()))
+        futures.append(future)
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    peak, first = 0, 0
+    for last, at in enumerate(done):
+        while done[first] <= at - 1:
+            first += 1
+        peak = max(peak, last - first + 1)
+    await outbound.stop()
+    print(f"messages: {messages}, chats: {chats}, elapsed: {elapsed:.2f}s, throughput: {messages / elapsed:.1f} msg/s")
+    print(f"peak: {peak} messages within one second (global rate {global_rate:g}/s)")
+    print(f"queue: {outbound.metrics}")
+    print(f"limiter: {limiter.metrics}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=600)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated API round-trip in seconds')
+    parser.add_argument('--global-rate', type=float, default=GLOBAL_RATE)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.chats, args.latency, args.global_rate))
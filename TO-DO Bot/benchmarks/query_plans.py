@@ -0,0 +1,154 @@
+"""Query-plan regression check for every TaskManager query.
+
+Builds a large synthetic database, calls each TaskManager method while
+recording the SQL it sends, then runs EXPLAIN QUERY PLAN on every recorded
+statement. Exits with status 1 if any of them falls back to a full table scan.
+
+    python benchmarks/query_plans.py --users 2000 --tasks-per-user 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import TaskManager, add_search_function
+
+CATEGORIES = ['Общее', 'Работа', 'Дом', 'Учёба', 'Спорт']
+
+
+def seed(db_path, users, tasks_per_user):
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    add_search_function(conn)
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO categories (user_id, category_name) VALUES (?, ?)',
+                         ((user_id, category) for user_id in range(users) for category in CATEGORIES))
+        conn.executemany(
+            'INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+            ((user_id, f'Задача {n}', random.choice(CATEGORIES), now + random.randint(-86400, 30 * 86400),
+              random.random() < 0.5, now - random.randint(0, 90 * 86400))
+             for user_id in range(users) for n in range(tasks_per_user)))
+        conn.executemany('INSERT INTO subtasks (task_id, text, completed) VALUES (?, ?, 0)',
+                         ((task_id, 'Подзадача') for task_id in range(1, users * tasks_per_user, 3)))
+        conn.execute('ANALYZE')
+    conn.close()
+
+
+async def exercise(task_manager):
+    """Calls every query method once; keep in sync with TaskManager."""
+    now = int(time.time())
+    tasks = await task_manager.get_tasks(1, completed=0, limit=6)
+    await task_manager.get_tasks(1, completed=0, category='Работа', limit=6, after_id=tasks[0].id)
+    await task_manager.get_tasks(1, completed=0, limit=6, before_id=tasks[-1].id)
+    await task_manager.count_tasks(1, completed=0)
+    await task_manager.count_tasks(1, completed=0, category='Дом')
+    await task_manager.get_task(tasks[0].id, 1)
+    await task_manager.get_categories(1)
+    await task_manager.search_tasks(1, 'Зад', limit=6, offset=5)
+    await task_manager.add_category(1, 'Новая')
+    await task_manager.get_stats(1, 30)
+    await task_manager.get_subtasks(tasks[0].id)
+    await task_manager.add_task(1, 'Скоро', 'Общее', int((datetime.now() + timedelta(minutes=10)).timestamp()))
+    await task_manager.set_reminder_leads(2, [3600, 900])
+    await task_manager.get_reminder_leads(2)
+    await task_manager.set_daily_agenda(2, True)
+    await task_manager.get_daily_agenda(2)
+    agenda = await task_manager.get_agenda(now, now + 86400)
+    await task_manager.claim_agenda(sorted({task.user_id for task in agenda}), 20260101)
+    await task_manager.release_agenda(2, 20260101)
+    due = [(task, lead) for task, lead, _ in await task_manager.get_upcoming_reminders(now - 86400, now + 3600, now)]
+    changes = await task_manager.get_deadline_changes(0, limit=100)
+    await task_manager.get_task_reminders({task_id for _, task_id, _ in changes if task_id}, {2}, now, now + 3600)
+    await task_manager.last_deadline_change()
+    await task_manager.prune_deadline_changes(now - 3600)
+    claimed = await task_manager.claim_reminders(due[:3], 'query-plans', claim_timeout=0)
+    await task_manager.claim_reminders(due[:3], 'query-plans', claim_timeout=0)
+    for task, lead in claimed[:1]:
+        await task_manager.mark_reminder_sent(task.id, task.deadline, lead, 'query-plans')
+    for task, lead in claimed[1:]:
+        await task_manager.release_reminder(task.id, task.deadline, lead, 'query-plans')
+    await task_manager.add_task(1, 'Новая задача', 'Общее', None)
+    await task_manager.edit_task(tasks[0].id, 1, text='Изменено', deadline=now + 3600)
+    await task_manager.complete_task(tasks[1].id, 1)
+    await task_manager.add_subtask(tasks[0].id, 1, 'Подзадача')
+    subtasks = await task_manager.get_subtasks(tasks[0].id)
+    await task_manager.complete_subtask(subtasks[0][0], tasks[0].id, 1)
+    await task_manager.delete_subtask(subtasks[0][0], tasks[0].id, 1)
+    await task_manager.delete_task(tasks[2].id, 1)
+    await task_manager.add_tasks(1, ['Пакет 1', 'Пакет 2'], 'Общее', None)
+    await task_manager.add_subtasks(tasks[0].id, 1, ['Шаг 1', 'Шаг 2'])
+    await task_manager.complete_tasks(1, [tasks[3].id, tasks[4].id])
+    await task_manager.complete_category(1, 'Дом')
+    await task_manager.delete_tasks(1, [tasks[3].id, tasks[4].id])
+    await task_manager.import_tasks(1, [('Импорт', 'Общее', None, 0, now), ('Изменено', 'Работа', now + 3600, 0, now)])
+    await asyncio.to_thread(lambda: list(task_manager.iter_export_rows(1)))
+
+
+def full_scans(conn, statements):
+    # Every SCAN counts, aliased tables ("SCAN t") included, except scans of a
+    # subquery or CTE the plan materialized or runs as a co-routine, of a
+    # virtual table (an FTS5 index lookup, json_each) or the shadow tables
+    # FTS5 reads its own settings from, and of a constant row.
+    virtual = [row[0] for row in conn.execute("SELECT name FROM sqlite_schema WHERE sql LIKE 'CREATE VIRTUAL%'")]
+    failures = []
+    for sql in statements:
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')):
+            continue
+        subqueries = set()
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'):
+            detail = row[3]
+            words = detail.split()
+            if words[0] in ('MATERIALIZE', 'CO-ROUTINE'):
+                subqueries.add(words[1])
+            elif words[0] == 'SCAN' and not (words[1] in subqueries or words[1].startswith('(')
+                                             or words[1].split('.')[-1].startswith(tuple(f'{name}_' for name in virtual))
+                                             or 'VIRTUAL TABLE' in detail or detail == 'SCAN CONSTANT ROW'):
+                failures.append((sql, detail))
+    return failures
+
+
+async def run(users, tasks_per_user):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'plans.db')
+        TaskManager(db_path).close()
+        start = time.perf_counter()
+        seed(db_path, users, tasks_per_user)
+        print(f"seeded {users * tasks_per_user} tasks in {time.perf_counter() - start:.1f}s")
+
+        task_manager = TaskManager(db_path)
+        statements = []
+        task_manager.executor.submit(lambda: task_manager.connect().set_trace_callback(statements.append)).result()
+        connect_readonly = task_manager.connect_readonly
+
+        def traced_readonly():
+            conn = connect_readonly()
+            conn.set_trace_callback(statements.append)
+            return conn
+
+        task_manager.connect_readonly = traced_readonly
+        await exercise(task_manager)
+        task_manager.close()
+
+        conn = sqlite3.connect(db_path)
+        add_search_function(conn)
+        failures = full_scans(conn, dict.fromkeys(statements))
+        conn.close()
+    print(f"checked {len(set(statements))} statements")
+    for sql, detail in failures:
+        print(f"FULL SCAN: {detail}\n    {sql}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--tasks-per-user', type=int, default=100)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.users, args.tasks_per_user)))
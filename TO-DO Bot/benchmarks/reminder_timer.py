@@ -0,0 +1,228 @@
+"""Deadline reminders over a large backlog, driven by a fake clock.
+
+Seeds --tasks tasks with deadlines spread over the next 30 days, --group
+tasks of a user sharing each deadline, gives a part of the users several
+lead times (1 day, 1 hour, 15 minutes), then runs the scheduler's timer
+through --hours of simulated time: every step jumps the clock straight to
+the time check_deadlines asked to be woken at. Deadlines of some upcoming
+tasks are moved along the way, as edit_task would.
+
+With --fail-rate, that share of the messages fails to send; their reminders,
+every one in a failed digest included, must be retried and go out late rather
+than never.
+
+Checks that every reminder went out at its time (or at most --digest-window
+seconds early, merged into a digest with another reminder of the same user),
+once, only for the current deadline of its task, and that none was missed;
+reports the number of wakeups and the time they took against the one-minute
+polling job, which woke up 60 times an hour and sent reminders up to a
+minute late, and how many messages the digests saved.
+
+    python benchmarks/reminder_timer.py --tasks 1000000 --hours 24
+    python benchmarks/reminder_timer.py --tasks 100000 --hours 24 --fail-rate 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DEFAULT_REMINDER_LEADS, TaskManager, add_search_function
+from scheduler import DIGEST_WINDOW, REMINDER_RETRY_MAX_DELAY, SchedulerManager
+from task_calendar import format_deadline
+
+MULTI_LEADS = (86400, 3600, 900)
+DEADLINE_SPREAD = 30 * 86400
+TASK_PATTERN = re.compile(r'"Задача (\d+)"')
+
+
+class RecordingOutbound:
+    # Stands in for OutboundQueue: every message is delivered at once and
+    # recorded with the fake time, except for the share fail_rate of them,
+    # which fail the way a network error would.
+    def __init__(self, clock, fail_rate=0.0):
+        self.clock = clock
+        self.fail_rate = fail_rate
+        self.failures = random.Random(2)
+        self.sent = []
+        self.failed = 0
+        self.failed_digests = 0
+
+    async def submit(self, method):
+        future = asyncio.get_running_loop().create_future()
+        if self.failures.random() < self.fail_rate:
+            self.failed += 1
+            self.failed_digests += len(TASK_PATTERN.findall(method.text)) > 1
+            future.set_exception(ConnectionError('simulated send failure'))
+            return future
+        self.sent.append((self.clock.now, method.chat_id, method.text))
+        future.set_result(True)
+        return future
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def seed(db_path, tasks, users, multi_share, group, start):
+    random.seed(1)
+    multi_users = set(random.sample(range(users), int(users * multi_share)))
+    deadlines = {}
+    conn = sqlite3.connect(db_path)
+    add_search_function(conn)
+    with conn:
+        conn.executemany('INSERT INTO reminder_leads (user_id, lead) VALUES (?, ?)',
+                         [(user_id, lead) for user_id in multi_users for lead in MULTI_LEADS])
+        rows = []
+        for n in range(tasks):
+            # Tasks come in groups of one user sharing a deadline, as a
+            # multi-line message adds them.
+            user_id = n // group % users
+            if n % group == 0:
+                deadline = start + random.randint(60, DEADLINE_SPREAD)
+            completed = random.random() < 0.3
+            rows.append((user_id, f'Задача {n}', 'Общее', deadline, completed, start))
+            if not completed:
+                deadlines[n + 1] = (user_id, deadline)
+        conn.executemany('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)', rows)
+        # Seeding is not a stream of edits the scheduler has to follow.
+        conn.execute('DELETE FROM deadline_changes')
+    conn.close()
+    return deadlines, multi_users
+
+
+def sent_reminders(sent):
+    # (sent_at, chat_id, task_id, line) for every task in every message; a
+    # digest lists several tasks, one per line.
+    for sent_at, chat_id, text in sent:
+        for line in text.splitlines():
+            match = TASK_PATTERN.search(line)
+            if match:
+                yield sent_at, chat_id, int(match.group(1)) + 1, line
+
+
+def check(sent, deadlines, multi_users, moved, start, end, window, late):
+    # Every reminder due in (start, end] must go out at its time, or up to
+    # window seconds early inside a digest, or up to late seconds after it
+    # when its message failed and was retried; for a moved task, those of the old
+    # deadline until the move and those of the new one after it. The only
+    # other ones allowed are catch-ups sent at the moment a task was armed
+    # (or a retry later), for a lead whose time had already passed.
+    expected = {}
+    for task_id, (user_id, deadline) in deadlines.items():
+        leads = MULTI_LEADS if user_id in multi_users else DEFAULT_REMINDER_LEADS
+        since = start
+        dues = expected.setdefault(task_id, [])
+        if task_id in moved:
+            since, old_deadline = moved[task_id]
+            dues.extend(old_deadline - lead for lead in leads if start < old_deadline - lead < since)
+        dues.extend(deadline - lead for lead in leads if since < deadline - lead <= end)
+    total = sum(len(dues) for dues in expected.values())
+    seen, stale, catch_up, unexpected, duplicates, retried = set(), 0, 0, 0, 0, 0
+    for sent_at, chat_id, task_id, line in sent_reminders(sent):
+        user_id, deadline = deadlines[task_id]
+        if task_id in moved and sent_at < moved[task_id][0]:
+            deadline = moved[task_id][1]
+        if chat_id != user_id or format_deadline(deadline) not in line:
+            stale += 1
+        if (task_id, sent_at) in seen:
+            duplicates += 1
+            continue
+        seen.add((task_id, sent_at))
+        # One line stands for every reminder of the task due in the window.
+        dues = expected.get(task_id, [])
+        matched = [due for due in dues if sent_at - late <= due <= sent_at + window]
+        for due in matched:
+            dues.remove(due)
+        if matched:
+            retried += any(due < sent_at for due in matched)
+            continue
+        if any(armed_at is not None and sent_at - late <= armed_at <= sent_at
+               for armed_at in (start, moved.get(task_id, (None,))[0])):
+            catch_up += 1
+        else:
+            unexpected += 1
+    return {'expected': total, 'missed': sum(len(dues) for dues in expected.values()), 'catch_up': catch_up,
+            'unexpected': unexpected, 'duplicates': duplicates, 'stale': stale, 'retried': retried}
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'reminders.db')
+        TaskManager(db_path).close()
+        start = int(time.time())
+        seed_start = time.perf_counter()
+        deadlines, multi_users = seed(db_path, args.tasks, args.users, args.multi_share, args.group, start)
+        print(f"seeded {args.tasks} tasks ({len(deadlines)} open) for {args.users} users in {time.perf_counter() - seed_start:.1f}s")
+
+        clock = FakeClock(start)
+        task_manager = TaskManager(db_path)
+        outbound = RecordingOutbound(clock, args.fail_rate)
+        scheduler = SchedulerManager(None, outbound, task_manager, clock=clock, change_poll_interval=None,
+                                     digest_window=args.digest_window)
+        end = start + args.hours * 3600
+        moved = {}
+        next_edit = start + 1800
+        wakeups, busy = 0, 0.0
+        while clock.now <= end:
+            step = time.perf_counter()
+            wake = await scheduler.check_deadlines(clock.now)
+            busy += time.perf_counter() - step
+            wakeups += 1
+            if next_edit <= wake and next_edit <= end:
+                # Move a few deadlines that are about to get a reminder; the
+                # write wakes the timer just like in the running bot.
+                clock.now = next_edit
+                soon = [task_id for task_id, (_, deadline) in deadlines.items()
+                        if clock.now + 600 < deadline <= clock.now + 3 * 3600 and task_id not in moved]
+                for task_id in random.sample(soon, min(args.edits, len(soon))):
+                    user_id, _ = deadlines[task_id]
+                    deadline = clock.now + random.randint(2 * 3600, 6 * 3600)
+                    await task_manager.edit_task(task_id, user_id, deadline=deadline)
+                    moved[task_id] = (clock.now, deadlines[task_id][1])
+                    deadlines[task_id] = (user_id, deadline)
+                next_edit += 3600
+                continue
+            clock.now = max(wake, clock.now + 1)
+        task_manager.close()
+
+    # A retried reminder can be as late as the backoffs of all its failures.
+    late = 8 * REMINDER_RETRY_MAX_DELAY if args.fail_rate else 0
+    result = check(outbound.sent, deadlines, multi_users, moved, start, end, args.digest_window, late)
+    polls = args.hours * 60
+    print(f"simulated {args.hours} h: {result['expected']} reminders due in the period, "
+          f"{result['missed']} missed or late, {result['unexpected']} unexpected, {result['duplicates']} duplicates, "
+          f"{result['stale']} for an old deadline; {result['catch_up']} sent at once for leads already past")
+    print(f"moved deadlines: {len(moved)}")
+    if args.fail_rate:
+        print(f"failed sends: {outbound.failed} messages ({outbound.failed_digests} digests); "
+              f"{result['retried']} reminders went out late on a retry")
+    metrics = scheduler.metrics
+    print(f"messages: {metrics['reminder_messages']} for {metrics['reminders']} reminders, "
+          f"{metrics['messages_saved']} saved by digests (window {args.digest_window:g} s)")
+    print(f"timer: {wakeups} wakeups, {busy:.2f}s busy ({busy / wakeups * 1000:.2f} ms per wakeup)")
+    print(f"one-minute polling: {polls} wakeups, reminders up to 60 s late")
+    return 1 if result['missed'] or result['unexpected'] or result['duplicates'] or result['stale'] else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--multi-share', type=float, default=0.2, help='share of users with 1 day, 1 hour and 15 minute reminders')
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--group', type=int, default=3, help='tasks added together with one deadline')
+    parser.add_argument('--edits', type=int, default=20, help='deadlines moved every simulated hour')
+    parser.add_argument('--digest-window', type=float, default=DIGEST_WINDOW, help='0 sends one message per reminder')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of messages that fail to send')
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,94 @@
+"""Latency of TaskManager.search_tasks on a large corpus.
+
+Seeds N tasks spread over many users plus one heavy user, built from a
+small vocabulary so that common prefixes match thousands of rows, then times
+first-page and deep-page searches with the per-user cache disabled. Before
+that, checks that words next to any punctuation are found, tokenized the same
+way in the index as in the query.
+
+    python benchmarks/search.py --tasks 1000000 --users 1000 --heavy 100000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import TaskManager, add_search_function
+
+WORDS = ['купить', 'молоко', 'позвонить', 'маме', 'отчёт', 'встреча', 'проект', 'оплатить', 'счёт', 'квартира',
+         'машина', 'ремонт', 'подарок', 'билеты', 'врач', 'спортзал', 'книга', 'письмо', 'клиент', 'презентация']
+QUERIES = ['куп мол', 'отчёт', 'пре', 'встреча клиент', 'ремонт машина', 'книга']
+# (task text, query that must find it)
+WORD_CASES = [('Купить «молоко»', 'молоко'), ('fix_bug в парсере', 'bug'), ('Позвонить #клиент', '#клиент'),
+              ('[покупки] хлеб', 'покупки'), ('Отчёт—черновик', 'черновик'), ('email: a@b.ru', 'b ru')]
+
+
+def seed(db_path, tasks, users, heavy):
+    rng = random.Random(1)
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    add_search_function(conn)
+    with conn:
+        conn.executemany('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+                         ((0 if n < heavy else n % users + 1, ' '.join(rng.sample(WORDS, 4)) + f' {n}', 'Общее', None, 0, now)
+                          for n in range(tasks)))
+    conn.close()
+
+
+async def check_words(task_manager, user_id):
+    missed = []
+    for text, query in WORD_CASES:
+        await task_manager.add_task(user_id, text, 'Общее')
+        if text not in [task.text for task in await task_manager.search_tasks(user_id, query)]:
+            missed.append((text, query))
+    return missed
+
+
+async def measure(task_manager, user_id, offset, repeat):
+    timings = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            await task_manager.search_tasks(user_id, query, limit=6, offset=offset)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+async def run(tasks, users, heavy, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'search.db')
+        TaskManager(db_path).close()
+        start = time.perf_counter()
+        seed(db_path, tasks, users, heavy)
+        print(f"seeded {tasks} tasks with the search index in {time.perf_counter() - start:.1f}s")
+        task_manager = TaskManager(db_path)
+        missed = await check_words(task_manager, users + 1)
+        for text, query in missed:
+            print(f"NOT FOUND: {text!r} by {query!r}")
+        print(f"word splitting: {len(WORD_CASES) - len(missed)} of {len(WORD_CASES)} cases found")
+        for label, user_id, offset in (('typical user, first page', 1, 0), ('heavy user, first page', 0, 0),
+                                       ('heavy user, page 20', 0, 100)):
+            median, p95 = await measure(task_manager, user_id, offset, repeat)
+            print(f"{label:28} median {median:7.2f} ms, p95 {p95:7.2f} ms")
+        task_manager.close()
+    return 1 if missed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--heavy', type=int, default=100_000, help='tasks of the single heavy user')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(run(args.tasks, args.users, args.heavy, args.repeat)))
@@ -0,0 +1,115 @@
+"""Cold start of the bot process, measured with python -X importtime.
+
+Imports everything main.py imports in fresh interpreters (main itself needs a
+real token), and reports the median wall time, the cumulative import time of
+the bot's own modules and whether matplotlib was loaded. The first stats plot,
+which now pays for matplotlib, is timed separately in another interpreter.
+Importing handlers opens the bot's tasks.db, as starting the bot would.
+
+With --history every run is appended to a JSON lines file together with the
+git revision, and compared with the previous entry, so the numbers can be
+tracked from commit to commit.
+
+    python benchmarks/startup.py --runs 5 --history startup_history.jsonl
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('handlers', 'scheduler', 'outbound', 'fsm_storage', 'metrics')
+FIRST_PLOT = ("import time; start = time.perf_counter(); import visualizer; "
+              "visualizer.render_stats_plot((('Работа', 1, 3), ('Работа', 0, 2), ('Дом', 0, 1))); "
+              "print(time.perf_counter() - start)")
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time: self [us] | cumulative | package", nested
+    # imports indented by two spaces per level. The modules imported at the
+    # top and their direct imports are kept, the first occurrence of each.
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.setdefault(name.strip(), int(cumulative) / 1000)
+    return modules
+
+
+def measure_imports(runs):
+    walls, imports, loaded = [], {}, set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                 f"import {', '.join(MODULES)}, sys; print(','.join(sys.modules))"],
+                                cwd=BOT_DIR, capture_output=True, text=True, check=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        loaded.update(result.stdout.strip().split(','))
+        for name, ms in parse_importtime(result.stderr).items():
+            imports.setdefault(name, []).append(ms)
+    return walls, {name: statistics.median(values) for name, values in imports.items()}, loaded
+
+
+def measure_first_plot():
+    result = subprocess.run([sys.executable, '-c', FIRST_PLOT], cwd=BOT_DIR, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip()) * 1000
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=BOT_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_entry(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            lines = [line for line in file if line.strip()]
+    except FileNotFoundError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def run(args):
+    walls, imports, loaded = measure_imports(args.runs)
+    heaviest = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'runs': args.runs,
+        'wall_ms': statistics.median(walls),
+        'modules_ms': {name: imports.get(name, 0.0) for name in MODULES},
+        'heaviest_ms': dict(heaviest),
+        'matplotlib_loaded': 'matplotlib' in loaded,
+        'first_plot_ms': measure_first_plot(),
+    }
+    print(f"cold start: median {result['wall_ms']:.0f} ms over {args.runs} runs, matplotlib loaded: {result['matplotlib_loaded']}")
+    for name, ms in heaviest:
+        print(f"  {name:<24} {ms:8.1f} ms")
+    print(f"first stats plot incl. matplotlib import: {result['first_plot_ms']:.0f} ms")
+    if args.history:
+        previous = last_entry(args.history)
+        if previous:
+            print(f"previous ({previous.get('revision')}): cold start {previous['wall_ms']:.0f} ms, "
+                  f"change {result['wall_ms'] - previous['wall_ms']:+.0f} ms")
+        with open(args.history, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='heaviest imports to show')
+    parser.add_argument('--history', help='JSON lines file to append the results to')
+    run(parser.parse_args())
@@ -0,0 +1,102 @@
+"""Load generator for the webhook entry point: posts synthetic Update JSON.
+
+Without --url a local server is started with a worker pool whose bots answer
+through FakeSession, so the numbers cover HTTP intake, routing to workers and
+the handlers themselves, but no Telegram round-trips. The outbound rate limit
+is lifted unless --global-rate is given. FSM state goes to a temporary
+database; the handlers still open the bot's tasks.db.
+
+    python benchmarks/webhook_load.py --updates 20000 --chats 500 --workers 4
+    python benchmarks/webhook_load.py --url http://127.0.0.1:8080/webhook --secret change-me
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.fake_bot import FAKE_TOKEN, FakeSession
+from webhook import WEBHOOK_PATH, WEBHOOK_SECRET, WorkerPool, create_app
+
+TEXTS = ('/start', 'Главное меню')
+
+
+def synthetic_update(n, chat_id):
+    text = TEXTS[n % len(TEXTS)]
+    message = {
+        'message_id': n,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': n, 'message': message}
+
+
+async def post_updates(url, secret, updates, chats, concurrency):
+    counter = iter(range(updates))
+    statuses = {}
+
+    async def client(session):
+        for n in counter:
+            while True:
+                async with session.post(url, json=synthetic_update(n, n % chats + 1),
+                                        headers={'X-Telegram-Bot-Api-Secret-Token': secret}) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                    # 503 means the worker queue is full; Telegram would retry too.
+                    if response.status != 503:
+                        break
+                await asyncio.sleep(0.01)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    return statuses
+
+
+async def run(args):
+    if args.url:
+        start = time.perf_counter()
+        statuses = await post_updates(args.url, args.secret, args.updates, args.chats, args.concurrency)
+        elapsed = time.perf_counter() - start
+        print(f"posted {args.updates} updates in {elapsed:.2f}s: {args.updates / elapsed:.0f} updates/s, statuses {statuses}")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = WorkerPool(FAKE_TOKEN, workers=args.workers, global_rate=args.global_rate, session_factory=FakeSession,
+                          fsm_path=os.path.join(tmp, 'fsm.db'), metrics_port=None)
+        runner = web.AppRunner(create_app(pool, WEBHOOK_SECRET))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', args.port)
+        await site.start()
+        # Let the workers finish importing before the clock starts.
+        await post_updates(f'http://127.0.0.1:{args.port}{WEBHOOK_PATH}', WEBHOOK_SECRET, args.workers * 10, args.chats, 1)
+        pool.metrics = {'accepted': 0, 'rejected': 0}
+        start = time.perf_counter()
+        statuses = await post_updates(f'http://127.0.0.1:{args.port}{WEBHOOK_PATH}', WEBHOOK_SECRET,
+                                      args.updates, args.chats, args.concurrency)
+        intake = time.perf_counter() - start
+        await runner.cleanup()
+        total = time.perf_counter() - start
+        print(f"workers: {args.workers}, updates: {args.updates}, chats: {args.chats}, statuses: {statuses}")
+        print(f"intake: {args.updates / intake:.0f} updates/s, processed incl. drain: {args.updates / total:.0f} updates/s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='post to a running webhook instead of a local one')
+    parser.add_argument('--secret', default=WEBHOOK_SECRET)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--global-rate', type=float, default=1e9, help='outbound messages/s shared by the workers')
+    args = parser.parse_args()
+    asyncio.run(run(args))
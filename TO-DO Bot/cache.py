@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+import time
+
+MISSING = object()
+
+class UserCacheEntry:
+    def __init__(self):
+        # LRU of the user's values, least recently used first.
+        self.values: OrderedDict = OrderedDict()
+        self.generation = 0
+
+class UserCache:
+    """Bounded LRU of per-user query results with a TTL on every value.
+
+    Both the number of users and the number of values per user are capped, so
+    page cursors and one-off queries cannot grow a user's entry without bound.
+
+    Reads take a token before querying and hand it back to set(); a write that
+    invalidated the user in between makes the token stale, so a result read
+    before the write can never be cached after it.
+    """
+
+    def __init__(self, max_users: int = 1024, ttl: float = 30.0, max_values: int = 64):
+        self.max_users = max_users
+        self.max_values = max_values
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0, 'value_evictions': 0, 'expirations': 0}
+
+    def get(self, user_id: int, key: Hashable) -> Any:
+        entry = self.entries.get(user_id)
+        if entry is not None:
+            cached = entry.values.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self.entries.move_to_end(user_id)
+                    entry.values.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return cached[1]
+                del entry.values[key]
+                self.stats['expirations'] += 1
+        self.stats['misses'] += 1
+        return MISSING
+
+    def token(self, user_id: int) -> Tuple[Optional[UserCacheEntry], int]:
+        entry = self.entries.get(user_id)
+        return entry, entry.generation if entry is not None else 0
+
+    def set(self, user_id: int, key: Hashable, value: Any, token: Tuple[Optional[UserCacheEntry], int]):
+        entry, generation = token
+        current = self.entries.get(user_id)
+        if current is not entry or (current is not None and current.generation != generation):
+            return
+        if current is None:
+            current = self.entries[user_id] = UserCacheEntry()
+            self.evict()
+        now = time.monotonic()
+        current.values[key] = (now + self.ttl, value)
+        current.values.move_to_end(key)
+        # The least recently used values go first: expired ones always, live
+        # ones while the user is over max_values.
+        while current.values:
+            expires_at = next(iter(current.values.values()))[0]
+            if expires_at > now and len(current.values) <= self.max_values:
+                break
+            current.values.popitem(last=False)
+            self.stats['expirations' if expires_at <= now else 'value_evictions'] += 1
+
+    def invalidate(self, user_id: int):
+        # Keeps an empty entry with a new generation instead of deleting it, so
+        # reads that started before this write notice it even for new users.
+        entry = self.entries.get(user_id)
+        if entry is None:
+            entry = self.entries[user_id] = UserCacheEntry()
+            self.evict()
+        else:
+            self.entries.move_to_end(user_id)
+        entry.values.clear()
+        entry.generation += 1
+        self.stats['invalidations'] += 1
+
+    def evict(self):
+        while len(self.entries) > self.max_users:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
@@ -0,0 +1,170 @@
+from aiogram.filters.callback_data import MAX_CALLBACK_LENGTH, CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+from metrics import handler_seconds
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Type, Union
+import inspect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ':'
+STALE_BUTTON_TEXT = "Кнопка устарела, открой меню заново."
+
+class TailFieldMixin:
+    # The last field is free text (a category name) and may contain the
+    # separator itself: it takes whatever follows the other fields.
+
+    def pack(self) -> str:
+        *head, tail = [self._encode_value(key, value) for key, value in self.model_dump(mode="json").items()]
+        if any(self.__separator__ in value for value in head):
+            raise ValueError(f"Separator {self.__separator__!r} in callback data fields: {head}")
+        data = self.__separator__.join([self.__prefix__, *head, tail])
+        if len(data.encode()) > MAX_CALLBACK_LENGTH:
+            raise ValueError(f"Callback data too long: {data!r}")
+        return data
+
+    @classmethod
+    def unpack(cls, value: str):
+        fields = cls.model_fields
+        prefix, *parts = value.split(cls.__separator__, len(fields))
+        if prefix != cls.__prefix__ or len(parts) != len(fields):
+            raise ValueError(f"Callback data {value!r} does not match {cls.__name__}")
+        return cls(**{name: None if part == "" and field.default is None else part for (name, field), part in zip(fields.items(), parts)})
+
+class ViewTaskCallback(CallbackData, prefix="view"):
+    task_id: int
+
+class DoneTaskCallback(CallbackData, prefix="done"):
+    task_id: int
+
+class EditTaskCallback(CallbackData, prefix="edit"):
+    task_id: int
+
+class EditFieldCallback(CallbackData, prefix="field"):
+    field: str
+    task_id: int
+
+class PageCallback(TailFieldMixin, CallbackData, prefix="page"):
+    # direction is "n" or "p", cursor the task id at the edge of the current
+    # page, action the prefix of the task buttons on it.
+    direction: str
+    cursor: int
+    action: str
+    category: Optional[str] = None
+
+class ListCallback(TailFieldMixin, CallbackData, prefix="list"):
+    category: Optional[str] = None
+
+class CategoryCallback(TailFieldMixin, CallbackData, prefix="cat"):
+    name: str
+
+class CompleteCategoryCallback(TailFieldMixin, CallbackData, prefix="alldone"):
+    category: str
+
+class SearchPageCallback(CallbackData, prefix="search"):
+    offset: int
+
+class AddSubtaskCallback(CallbackData, prefix="subadd"):
+    task_id: int
+
+class SubtaskDoneCallback(CallbackData, prefix="subdone"):
+    subtask_id: int
+    task_id: int
+
+class SubtaskDeleteCallback(CallbackData, prefix="subdel"):
+    subtask_id: int
+    task_id: int
+
+class DayCallback(CallbackData, prefix="day"):
+    year: int
+    month: int
+    day: int
+
+class MonthCallback(CallbackData, prefix="month"):
+    # The month to show, not the one the button was pressed on.
+    year: int
+    month: int
+
+class TimeCallback(CallbackData, prefix="time"):
+    hour: int
+    minute: int
+
+class ExportCallback(CallbackData, prefix="export"):
+    fmt: str
+    compressed: bool
+
+class ReminderLeadCallback(CallbackData, prefix="lead"):
+    # Toggles one reminder lead time, in seconds.
+    lead: int
+
+# Task list buttons by the action of the page they are on.
+TASK_ACTIONS: Dict[str, Type[CallbackData]] = {
+    factory.__prefix__: factory for factory in (ViewTaskCallback, DoneTaskCallback, EditTaskCallback)
+}
+
+class Route(NamedTuple):
+    handler: Callable[..., Awaitable[Any]]
+    factory: Optional[Type[CallbackData]]
+    states: Optional[frozenset]
+    params: frozenset
+
+class CallbackTable:
+    """Routes callback queries by the prefix of their data with one dict lookup.
+
+    Registered on the router as a single callback_query handler, so the cost
+    of a button press does not depend on how many kinds of buttons exist.
+    Keys are a CallbackData factory, whose data is unpacked and passed to the
+    handler as callback_data, or a constant string such as "cmd_add". Routes
+    restricted to FSM states read the state only when the key has such routes;
+    among several routes for one key the first matching one wins.
+    """
+
+    def __init__(self):
+        self.routes: Dict[str, List[Route]] = {}
+
+    def register(self, key: Union[str, Type[CallbackData]], *states: State):
+        factory = None if isinstance(key, str) else key
+        prefix = key if factory is None else factory.__prefix__
+
+        def decorator(handler):
+            params = frozenset(inspect.signature(handler).parameters) & {"callback_data", "state"}
+            state_names = frozenset(state.state for state in states) if states else None
+            self.routes.setdefault(prefix, []).append(Route(handler, factory, state_names, params))
+            return handler
+        return decorator
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext):
+        routes = self.routes.get((callback.data or "").split(SEPARATOR, 1)[0])
+        if routes is None:
+            # Buttons sent before the callback format changed, or junk.
+            await callback.answer(STALE_BUTTON_TEXT)
+            return
+        current = await state.get_state() if any(route.states for route in routes) else None
+        route = next((route for route in routes if route.states is None or current in route.states), None)
+        if route is None:
+            await callback.answer()
+            return
+        kwargs = {}
+        if "state" in route.params:
+            kwargs["state"] = state
+        if route.factory is not None:
+            try:
+                kwargs["callback_data"] = route.factory.unpack(callback.data)
+            except (TypeError, ValueError) as e:
+                logger.warning("Malformed callback data %r: %s", callback.data, e)
+                await callback.answer(STALE_BUTTON_TEXT)
+                return
+        start = time.perf_counter()
+        status = "error"
+        try:
+            await route.handler(callback, **kwargs)
+            status = "ok"
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, "callback_query", route.handler.__name__, status)
+
+    # The router's metrics middleware would only see the table; every handler
+    # is timed above under its own name instead.
+    dispatch.times_itself = True
@@ -1,251 +1,1211 @@
-import sqlite3
-from datetime import datetime, timedelta
-import logging
-import csv
-import os
-from typing import List, Optional, Tuple
-
-logger = logging.getLogger(__name__)
-
-DB_PATH = os.path.join(os.path.dirname(__file__), 'tasks.db')
-
-class Task:
-    def __init__(self, id: int, user_id: int, text: str, category: str, deadline: Optional[str], completed: int, created_at: str):
-        self.id = id
-        self.user_id = user_id
-        self.text = text
-        self.category = category
-        self.deadline = deadline
-        self.completed = completed
-        self.created_at = created_at
-
-class Category:
-    def __init__(self, user_id: int, name: str):
-        self.user_id = user_id
-        self.name = name
-
-class TaskManager:
-    def __init__(self, db_path=DB_PATH):
-        self.db_path = db_path
-        self.init_db()
-
-    def connect(self):
-        return sqlite3.connect(self.db_path, timeout=10)
-
-    def init_db(self):
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('''CREATE TABLE IF NOT EXISTS tasks
-                             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                              user_id INTEGER,
-                              task TEXT,
-                              category TEXT,
-                              deadline TEXT,
-                              completed INTEGER,
-                              created_at TEXT)''')
-                c.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON tasks (user_id)')
-                c.execute('''CREATE TABLE IF NOT EXISTS categories
-                             (user_id INTEGER, category_name TEXT, UNIQUE(user_id, category_name))''')
-                c.execute('''CREATE TABLE IF NOT EXISTS subtasks
-                             (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                              task_id INTEGER,
-                              text TEXT,
-                              completed INTEGER DEFAULT 0,
-                              FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE)''')
-                conn.commit()
-                logger.info("Database initialized successfully.")
-        except Exception as e:
-            logger.error(f"Failed to initialize database: {e}")
-
-    def add_task(self, user_id: int, text: str, category: str, deadline: Optional[str] = None) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('INSERT INTO tasks (user_id, task, category, deadline, completed, created_at) VALUES (?, ?, ?, ?, ?, ?)',
-                          (user_id, text, category, deadline if deadline is not None else '', 0, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-                conn.commit()
-                logger.info(f"Task '{text}' added for user {user_id} in category '{category}'.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while adding task: {e}")
-            return False
-
-    def add_category(self, user_id: int, category: str) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('INSERT OR IGNORE INTO categories (user_id, category_name) VALUES (?, ?)', (user_id, category))
-                conn.commit()
-                logger.info(f"Category '{category}' added for user {user_id}.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while adding category: {e}")
-            return False
-
-    def get_categories(self, user_id: int) -> List[str]:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('SELECT category_name FROM categories WHERE user_id = ?', (user_id,))
-                categories = [row[0] for row in c.fetchall()]
-                logger.info(f"Retrieved {len(categories)} categories for user {user_id}.")
-                return categories
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while getting categories: {e}")
-            return []
-
-    def get_tasks(self, user_id: Optional[int] = None, completed: int = 0, category: Optional[str] = None) -> List[Task]:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                query = 'SELECT id, user_id, task, category, deadline, completed, created_at FROM tasks WHERE completed = ?'
-                params = [completed]
-                if user_id is not None:
-                    query += ' AND user_id = ?'
-                    params.append(user_id)
-                if category is not None:
-                    query += ' AND category = ?'
-                    params.append(category)
-                c.execute(query, params)
-                rows = c.fetchall()
-                logger.info(f"Retrieved {len(rows)} tasks for user {user_id}.")
-                return [Task(*row) for row in rows]
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while getting tasks: {e}")
-            return []
-
-    def get_all_incomplete_tasks(self) -> List[Task]:
-        return self.get_tasks(completed=0)
-
-    def complete_task(self, task_id: int) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('UPDATE tasks SET completed = 1 WHERE id = ?', (task_id,))
-                conn.commit()
-                logger.info(f"Task {task_id} marked as completed.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while completing task: {e}")
-            return False
-
-    def delete_task(self, task_id: int) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-                conn.commit()
-                logger.info(f"Task {task_id} deleted.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while deleting task: {e}")
-            return False
-
-    def edit_task(self, task_id: int, text: Optional[str] = None, category: Optional[str] = None, deadline: Optional[str] = None) -> bool:
-        try:
-            updates = []
-            params = []
-            if text is not None:
-                updates.append('task = ?')
-                params.append(text)
-            if category is not None:
-                updates.append('category = ?')
-                params.append(category)
-            if deadline is not None:
-                updates.append('deadline = ?')
-                params.append(deadline)
-            if not updates:
-                logger.warning(f"No fields to update for task {task_id}.")
-                return False
-            params.append(task_id)
-            query = f'UPDATE tasks SET {", ".join(updates)} WHERE id = ?'
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute(query, params)
-                conn.commit()
-                logger.info(f"Task {task_id} updated.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while editing task {task_id}: {e}")
-            return False
-
-    def get_stats(self, user_id: int, days: int) -> List[Tuple[str, int, int]]:
-        try:
-            date_limit = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('SELECT category, completed, COUNT(*) FROM tasks WHERE user_id = ? AND created_at >= ? GROUP BY category, completed',
-                          (user_id, date_limit))
-                stats = c.fetchall()
-                logger.info(f"Stats for user {user_id} for last {days} days: {stats}")
-                return stats
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while getting stats: {e}")
-            return []
-
-    def export_to_csv(self, user_id: int) -> Optional[str]:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, task, category, deadline, completed, created_at FROM tasks WHERE user_id = ?', (user_id,))
-                rows = c.fetchall()
-                if not rows:
-                    logger.warning(f"No tasks to export for user {user_id}")
-                    return None
-                filename = f'tasks_{user_id}.csv'
-                with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-                    writer = csv.writer(csvfile)
-                    writer.writerow(['ID', 'Task', 'Category', 'Deadline', 'Completed', 'Created At'])
-                    writer.writerows(rows)
-                logger.info(f"Exported tasks for user {user_id} to {filename}")
-                return filename
-        except Exception as e:
-            logger.error(f"Failed to export tasks for user {user_id}: {e}")
-            return None
-
-    def add_subtask(self, task_id: int, text: str) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('INSERT INTO subtasks (task_id, text, completed) VALUES (?, ?, ?)', (task_id, text, 0))
-                conn.commit()
-                logger.info(f"Subtask '{text}' added to task {task_id}.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while adding subtask: {e}")
-            return False
-
-    def get_subtasks(self, task_id: int) -> List[Tuple[int, str, int]]:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, text, completed FROM subtasks WHERE task_id = ?', (task_id,))
-                return c.fetchall()
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while getting subtasks: {e}")
-            return []
-
-    def complete_subtask(self, subtask_id: int, completed: int = 1) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('UPDATE subtasks SET completed = ? WHERE id = ?', (completed, subtask_id))
-                conn.commit()
-                logger.info(f"Subtask {subtask_id} marked as {'completed' if completed else 'not completed'}.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while completing subtask: {e}")
-            return False
-
-    def delete_subtask(self, subtask_id: int) -> bool:
-        try:
-            with self.connect() as conn:
-                c = conn.cursor()
-                c.execute('DELETE FROM subtasks WHERE id = ?', (subtask_id,))
-                conn.commit()
-                logger.info(f"Subtask {subtask_id} deleted.")
-                return True
-        except sqlite3.Error as e:
-            logger.error(f"SQLite error while deleting subtask: {e}")
-            return False
\ No newline at end of file
+import sqlite3
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from cache import MISSING, UserCache
+from metrics import db_query_seconds, timed
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import json
+import re
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.path.join(os.path.dirname(__file__), 'tasks.db')
+# Deadlines used to be stored as text in this format; it is only needed now to
+# backfill the epoch columns of old databases.
+LEGACY_DEADLINE_FORMAT = '%d.%m.%Y %H:%M'
+BACKFILL_BATCH_SIZE = 5000
+EXPORT_CHUNK_SIZE = 1000
+SEARCH_MAX_TERMS = 8
+# Group commit: queued writes are committed together once the oldest has
+# waited WRITE_BATCH_DELAY seconds or WRITE_BATCH_SIZE writes are queued.
+WRITE_BATCH_DELAY = 0.002
+WRITE_BATCH_SIZE = 200
+# Reminder lead times a user can choose from, in seconds before the deadline.
+# Users who never chose get DEFAULT_REMINDER_LEADS.
+REMINDER_LEAD_OPTIONS = (300, 900, 3600, 10800, 86400)
+DEFAULT_REMINDER_LEADS = (900,)
+
+def parse_deadline(deadline: Optional[str]) -> Optional[int]:
+    if not deadline:
+        return None
+    try:
+        return int(datetime.strptime(deadline, LEGACY_DEADLINE_FORMAT).timestamp())
+    except ValueError:
+        logger.warning("Unparseable deadline '%s'", deadline)
+        return None
+
+class Task:
+    # deadline and created_at are UTC epoch seconds; formatting is up to the caller.
+    def __init__(self, id: int, user_id: int, text: str, category: str, deadline: Optional[int], completed: int, created_at: int):
+        self.id = id
+        self.user_id = user_id
+        self.text = text
+        self.category = category
+        self.deadline = deadline
+        self.completed = completed
+        self.created_at = created_at
+        self.subtasks: List[Tuple[int, str, int]] = []
+
+class Category:
+    def __init__(self, user_id: int, name: str):
+        self.user_id = user_id
+        self.name = name
+
+# Schema migrations, applied in order and tracked in PRAGMA user_version.
+# Databases created before versioning report version 0, so every step must be
+# safe to run against a schema that already has some of its changes.
+def migration_base_schema(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS tasks
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_id INTEGER,
+                  task TEXT,
+                  category TEXT,
+                  deadline TEXT,
+                  completed INTEGER,
+                  created_at TEXT)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON tasks (user_id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS categories
+                 (user_id INTEGER, category_name TEXT, UNIQUE(user_id, category_name))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS subtasks
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  task_id INTEGER,
+                  text TEXT,
+                  completed INTEGER DEFAULT 0,
+                  FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE)''')
+
+def migration_deadline_ts(c):
+    columns = [row[1] for row in c.execute('PRAGMA table_info(tasks)')]
+    if 'deadline_ts' not in columns:
+        c.execute('ALTER TABLE tasks ADD COLUMN deadline_ts INTEGER')
+        rows = c.execute("SELECT id, deadline FROM tasks WHERE deadline != ''").fetchall()
+        c.executemany('UPDATE tasks SET deadline_ts = ? WHERE id = ?',
+                      [(parse_deadline(deadline), task_id) for task_id, deadline in rows])
+        logger.info("Backfilled deadline_ts for %s tasks.", len(rows))
+    c.execute('CREATE INDEX IF NOT EXISTS idx_deadline_ts ON tasks (completed, deadline_ts)')
+
+def migration_reminders(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS reminders
+                 (task_id INTEGER,
+                  deadline_ts INTEGER,
+                  claimed_by TEXT,
+                  claimed_at INTEGER,
+                  sent_at INTEGER,
+                  PRIMARY KEY (task_id, deadline_ts))''')
+
+def migration_query_indexes(c):
+    # get_tasks filters on (user_id, completed[, category]) and pages by id;
+    # these make both shapes a range scan that already returns rows in id order.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_completed ON tasks (user_id, completed, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_completed_category ON tasks (user_id, completed, category, id)')
+    # Covering index for get_stats, which never has to touch the table rows.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at, category, completed)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_subtasks_task_id ON subtasks (task_id)')
+    # Every lookup by user_id is served by the composite indexes above.
+    c.execute('DROP INDEX IF EXISTS idx_user_id')
+
+def migration_epoch_columns(c):
+    columns = [row[1] for row in c.execute('PRAGMA table_info(tasks)')]
+    if 'created_ts' not in columns:
+        c.execute('ALTER TABLE tasks ADD COLUMN created_ts INTEGER')
+    # Backfilled in id ranges with a commit after each one, so other
+    # connections can keep writing while a large table is converted.
+    max_id = c.execute('SELECT MAX(id) FROM tasks').fetchone()[0] or 0
+    for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+        c.execute("UPDATE tasks SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER) "
+                  'WHERE id >= ? AND id < ? AND created_ts IS NULL', (start, start + BACKFILL_BATCH_SIZE))
+        c.connection.commit()
+    c.execute('DROP INDEX IF EXISTS idx_tasks_user_created')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_created_ts ON tasks (user_id, created_ts, category, completed)')
+
+# SQL shared by the daily_stats backfill and the consistency check.
+DAILY_STATS_FROM_TASKS = '''SELECT user_id, COALESCE(category, ''), COALESCE(created_ts, 0) / 86400,
+                                   COUNT(*), SUM(completed != 0)
+                            FROM tasks GROUP BY 1, 2, 3'''
+
+def migration_daily_stats(c):
+    # Per user/category/creation-day counters kept current by triggers, so
+    # get_stats reads O(days) rows no matter how many tasks a user has.
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_stats
+                 (user_id INTEGER NOT NULL,
+                  category TEXT NOT NULL,
+                  day INTEGER NOT NULL,
+                  total INTEGER NOT NULL DEFAULT 0,
+                  completed INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (user_id, day, category)) WITHOUT ROWID''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS daily_stats_insert AFTER INSERT ON tasks BEGIN
+                     INSERT INTO daily_stats (user_id, category, day, total, completed)
+                     VALUES (NEW.user_id, COALESCE(NEW.category, ''), COALESCE(NEW.created_ts, 0) / 86400, 1, NEW.completed != 0)
+                     ON CONFLICT (user_id, day, category) DO UPDATE SET total = total + 1, completed = completed + excluded.completed;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS daily_stats_delete AFTER DELETE ON tasks BEGIN
+                     UPDATE daily_stats SET total = total - 1, completed = completed - (OLD.completed != 0)
+                     WHERE user_id = OLD.user_id AND day = COALESCE(OLD.created_ts, 0) / 86400 AND category = COALESCE(OLD.category, '');
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS daily_stats_update AFTER UPDATE OF user_id, category, completed, created_ts ON tasks BEGIN
+                     UPDATE daily_stats SET total = total - 1, completed = completed - (OLD.completed != 0)
+                     WHERE user_id = OLD.user_id AND day = COALESCE(OLD.created_ts, 0) / 86400 AND category = COALESCE(OLD.category, '');
+                     INSERT INTO daily_stats (user_id, category, day, total, completed)
+                     VALUES (NEW.user_id, COALESCE(NEW.category, ''), COALESCE(NEW.created_ts, 0) / 86400, 1, NEW.completed != 0)
+                     ON CONFLICT (user_id, day, category) DO UPDATE SET total = total + 1, completed = completed + excluded.completed;
+                 END''')
+    c.execute('DELETE FROM daily_stats')
+    c.execute(f'INSERT INTO daily_stats (user_id, category, day, total, completed) {DAILY_STATS_FROM_TASKS}')
+    # get_stats no longer reads tasks by creation time.
+    c.execute('DROP INDEX IF EXISTS idx_tasks_user_created_ts')
+
+def migration_import_dedupe_index(c):
+    # Lets import_tasks look up an existing task by its text for every row.
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_task ON tasks (user_id, task)')
+
+# A word as both the index and search_query see it; punctuation, underscores
+# and anything else that is not a letter or digit separate words.
+SEARCH_WORD = re.compile(r'[^\W_]+')
+
+def search_body(user_id: int, text: Optional[str]) -> str:
+    # A text as 'u<user_id>x<word>' tokens. FTS5 keeps one doclist per token,
+    # so every user gets their own doclists and a prefix query only ever
+    # merges the terms of the user's own tasks; with a shared vocabulary a
+    # single prefix can span a large part of the whole index. Registered on
+    # every connection (see add_search_function) for the triggers below.
+    return ' '.join(f'u{user_id}x{word}' for word in SEARCH_WORD.findall(text or ''))
+
+def add_search_function(conn: sqlite3.Connection):
+    # Any connection that writes tasks or subtasks needs it, the FTS triggers
+    # call it.
+    conn.create_function('search_body', 2, search_body, deterministic=True)
+
+def create_search_triggers(c):
+    c.execute('''CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+                     INSERT INTO tasks_fts (rowid, body, task_id) VALUES (NEW.id * 2, search_body(NEW.user_id, NEW.task), NEW.id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF task, user_id ON tasks BEGIN
+                     UPDATE tasks_fts SET body = search_body(NEW.user_id, NEW.task) WHERE rowid = NEW.id * 2;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+                     DELETE FROM tasks_fts WHERE rowid = OLD.id * 2;
+                     DELETE FROM tasks_fts WHERE rowid IN (SELECT id * 2 + 1 FROM subtasks WHERE task_id = OLD.id);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS subtasks_fts_insert AFTER INSERT ON subtasks BEGIN
+                     INSERT INTO tasks_fts (rowid, body, task_id)
+                     SELECT NEW.id * 2 + 1, search_body(user_id, NEW.text), id FROM tasks WHERE id = NEW.task_id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS subtasks_fts_update AFTER UPDATE OF text ON subtasks BEGIN
+                     UPDATE tasks_fts SET body = (SELECT search_body(user_id, NEW.text) FROM tasks WHERE id = NEW.task_id)
+                     WHERE rowid = NEW.id * 2 + 1;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS subtasks_fts_delete AFTER DELETE ON subtasks BEGIN
+                     DELETE FROM tasks_fts WHERE rowid = OLD.id * 2 + 1;
+                 END''')
+
+def rebuild_search_index(c):
+    c.execute('DELETE FROM tasks_fts')
+    c.execute('INSERT INTO tasks_fts (rowid, body, task_id) SELECT id * 2, search_body(user_id, task), id FROM tasks')
+    c.execute('INSERT INTO tasks_fts (rowid, body, task_id) SELECT s.id * 2 + 1, search_body(t.user_id, s.text), t.id '
+              'FROM subtasks s JOIN tasks t ON t.id = s.task_id')
+
+def migration_search_index(c):
+    # One FTS5 row per task and per subtask, both pointing at the task. Rowids
+    # are id * 2 for tasks and id * 2 + 1 for subtasks.
+    c.execute('CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5 (body, task_id UNINDEXED)')
+    create_search_triggers(c)
+    rebuild_search_index(c)
+
+def migration_reminder_leads(c):
+    # Several reminders per task: the ledger is keyed by the lead time too.
+    # Reminders sent before this migration all had the old 15 minute lead.
+    columns = [row[1] for row in c.execute('PRAGMA table_info(reminders)')]
+    if 'lead' not in columns:
+        c.execute('ALTER TABLE reminders RENAME TO reminders_old')
+        c.execute('''CREATE TABLE reminders
+                     (task_id INTEGER,
+                      deadline_ts INTEGER,
+                      lead INTEGER NOT NULL,
+                      claimed_by TEXT,
+                      claimed_at INTEGER,
+                      sent_at INTEGER,
+                      PRIMARY KEY (task_id, deadline_ts, lead))''')
+        c.execute('INSERT INTO reminders (task_id, deadline_ts, lead, claimed_by, claimed_at, sent_at) '
+                  'SELECT task_id, deadline_ts, 900, claimed_by, claimed_at, sent_at FROM reminders_old')
+        c.execute('DROP TABLE reminders_old')
+    c.execute('''CREATE TABLE IF NOT EXISTS reminder_leads
+                 (user_id INTEGER NOT NULL,
+                  lead INTEGER NOT NULL,
+                  PRIMARY KEY (user_id, lead)) WITHOUT ROWID''')
+    # Tasks whose upcoming reminders changed, so a scheduler can re-arm them
+    # even when the change was made by another process. Rows without a
+    # task_id mean all tasks of the user (their lead times changed).
+    c.execute('''CREATE TABLE IF NOT EXISTS deadline_changes
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                  task_id INTEGER,
+                  user_id INTEGER,
+                  changed_at INTEGER)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_deadline_changes_changed_at ON deadline_changes (changed_at)')
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS deadline_changes_insert AFTER INSERT ON tasks
+                  WHEN NEW.deadline_ts > {now} BEGIN
+                      INSERT INTO deadline_changes (task_id, user_id, changed_at) VALUES (NEW.id, NEW.user_id, {now});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS deadline_changes_update AFTER UPDATE OF task, category, deadline_ts, completed ON tasks
+                  WHEN NEW.deadline_ts > {now} OR OLD.deadline_ts > {now} BEGIN
+                      INSERT INTO deadline_changes (task_id, user_id, changed_at) VALUES (NEW.id, NEW.user_id, {now});
+                  END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS deadline_changes_delete AFTER DELETE ON tasks
+                  WHEN OLD.deadline_ts > {now} BEGIN
+                      INSERT INTO deadline_changes (task_id, user_id, changed_at) VALUES (OLD.id, OLD.user_id, {now});
+                  END''')
+
+def migration_user_settings(c):
+    # agenda_day is the last day (local date as YYYYMMDD) a daily agenda was
+    # claimed for the user, so two schedulers never both send it.
+    c.execute('''CREATE TABLE IF NOT EXISTS user_settings
+                 (user_id INTEGER PRIMARY KEY,
+                  daily_agenda INTEGER NOT NULL DEFAULT 0,
+                  agenda_day INTEGER)''')
+
+def migration_search_words(c):
+    # The triggers used to split texts only on a fixed list of punctuation
+    # with nested replace() calls, so a word after any other character (quotes
+    # like «», #, _, brackets) lost its owner prefix and could not be found.
+    # They now split with search_body, the same way search_query does.
+    for trigger in ('tasks_fts_insert', 'tasks_fts_update', 'tasks_fts_delete',
+                    'subtasks_fts_insert', 'subtasks_fts_update', 'subtasks_fts_delete'):
+        c.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    create_search_triggers(c)
+    rebuild_search_index(c)
+
+def migration_fsm_states(c):
+    # Conversation state of fsm_storage.SQLiteStorage, which used to create
+    # the table itself.
+    c.execute('''CREATE TABLE IF NOT EXISTS fsm_states
+                 (key TEXT PRIMARY KEY,
+                  state TEXT,
+                  data TEXT,
+                  updated_at INTEGER)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)')
+
+# Unsent reminders for one lead time: tasks whose deadline minus :lead falls
+# in the window, if the owner chose that lead (or chose none and it is a
+# default one). "sent" is returned rather than filtered, so the scheduler
+# knows which earlier reminders of a task already went out.
+REMINDER_CANDIDATES = '''SELECT t.id, t.user_id, t.task, t.category, t.deadline_ts, t.completed, t.created_ts,
+                                EXISTS (SELECT 1 FROM reminders r WHERE r.task_id = t.id AND r.deadline_ts = t.deadline_ts
+                                        AND r.lead = :lead AND r.sent_at IS NOT NULL)
+                         FROM tasks t
+                         WHERE t.completed = 0 AND t.deadline_ts > :after AND t.deadline_ts <= :until + :lead
+                           AND (EXISTS (SELECT 1 FROM reminder_leads l WHERE l.user_id = t.user_id AND l.lead = :lead)
+                                OR (:is_default AND NOT EXISTS (SELECT 1 FROM reminder_leads l WHERE l.user_id = t.user_id)))'''
+
+def search_query(user_id: int, text: str) -> Optional[str]:
+    # Every word of the user's input becomes a quoted prefix term in the
+    # user's own token space, so nothing they type is read as FTS5 syntax.
+    words = SEARCH_WORD.findall(text)[:SEARCH_MAX_TERMS]
+    return ' AND '.join(f'"u{user_id}x{word}"*' for word in words) or None
+
+MIGRATIONS = [
+    migration_base_schema,
+    migration_deadline_ts,
+    migration_reminders,
+    migration_query_indexes,
+    migration_epoch_columns,
+    migration_daily_stats,
+    migration_import_dedupe_index,
+    migration_search_index,
+    migration_reminder_leads,
+    migration_user_settings,
+    migration_search_words,
+    migration_fsm_states,
+]
+
+def migrate(conn: sqlite3.Connection):
+    # Brings the schema up to date. The task manager and the FSM storage both
+    # call it on their connection, whichever opens the file first does the work.
+    add_search_function(conn)
+    c = conn.cursor()
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(c)
+        c.execute(f'PRAGMA user_version = {target}')
+        logger.info("Applied migration %s: %s", target, migration.__name__)
+    conn.commit()
+
+def db_call(method):
+    # Runs the wrapped method on the manager's DB thread and makes it awaitable,
+    # so a slow query never blocks the event loop. The time is measured on that
+    # thread, so it leaves out the wait behind other queries.
+    timed_method = timed(db_query_seconds, method.__name__)(method)
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(timed_method, self, *args, **kwargs))
+    return wrapper
+
+def user_cached(method):
+    # Serves per-user reads from self.cache; calls without a user_id bypass it.
+    # Cached values are shared between callers and must not be mutated.
+    @functools.wraps(method)
+    async def wrapper(self, user_id=None, *args, **kwargs):
+        if self.cache is None or user_id is None:
+            return await method(self, user_id, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        value = self.cache.get(user_id, key)
+        if value is MISSING:
+            token = self.cache.token(user_id)
+            value = await method(self, user_id, *args, **kwargs)
+            self.cache.set(user_id, key, value, token)
+        return value
+    return wrapper
+
+def invalidates_user(method):
+    # Drops the cached reads of the user a mutation belongs to and tells the
+    # write listeners about it.
+    signature = inspect.signature(method)
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            user_id = signature.bind(self, *args, **kwargs).arguments['user_id']
+            if self.cache is not None:
+                self.cache.invalidate(user_id)
+            for listener in self.write_listeners:
+                listener(user_id)
+    return wrapper
+
+def batched_write(failure):
+    # Queues the wrapped mutation for the next group commit and returns its
+    # result once that transaction is committed. The method runs on the DB
+    # thread inside the batch transaction, so it must not commit itself;
+    # failure is what the caller gets if its statements fail.
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            return await self.writes.submit(method.__name__, functools.partial(method, self, *args, **kwargs), failure)
+        return wrapper
+    return decorator
+
+class WriteQueue:
+    """Write-behind queue that commits the writes of many users at once.
+
+    Every commit of the WAL costs a sync of the disk, which caps how many
+    single-write transactions can be committed per second. Queued writes run
+    in one transaction on the DB thread instead, each under a savepoint so a
+    failing write is rolled back alone. A caller's await returns only after
+    the batch is committed, so its next read sees the write. While one batch
+    commits the next is collected, so under load batches grow on their own.
+    """
+
+    def __init__(self, manager: 'TaskManager', delay: float = WRITE_BATCH_DELAY, max_ops: int = WRITE_BATCH_SIZE):
+        self.manager = manager
+        self.delay = delay
+        self.max_ops = max_ops
+        self.pending = []
+        self.timer = None
+        self.committing = None
+        self.stats = {'writes': 0, 'batches': 0, 'failed_writes': 0, 'largest_batch': 0}
+
+    async def submit(self, name: str, call, failure):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((name, call, failure, future))
+        if len(self.pending) >= self.max_ops:
+            self.flush()
+        elif self.timer is None and self.committing is None:
+            self.timer = loop.call_later(self.delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        # A batch that is still committing flushes again when it is done.
+        if self.committing is not None or not self.pending:
+            return
+        batch, self.pending = self.pending[:self.max_ops], self.pending[self.max_ops:]
+        self.committing = asyncio.ensure_future(self.commit(batch))
+
+    async def commit(self, batch):
+        loop = asyncio.get_running_loop()
+        calls = [(name, call, failure) for name, call, failure, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.manager.executor, self.manager.run_write_batch, calls)
+        except Exception as e:
+            # The batch never ran, e.g. the manager was closed; its callers
+            # get the error instead of waiting forever.
+            logger.error("Could not run a batch of %s writes: %s", len(batch), e)
+            self.stats['failed_writes'] += len(batch)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.stats['writes'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            for (name, call, failure, future), (result, error) in zip(batch, results):
+                if error is not None or result is failure:
+                    self.stats['failed_writes'] += 1
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        finally:
+            self.committing = None
+            self.flush()
+
+class TaskManager:
+    def __init__(self, db_path=DB_PATH, cache: Optional[UserCache] = None,
+                 write_delay: float = WRITE_BATCH_DELAY, write_batch_size: int = WRITE_BATCH_SIZE):
+        self.db_path = db_path
+        self.cache = cache
+        # A single worker thread owns the long-lived connection, so every query
+        # is serialized on it and sqlite never sees concurrent use of one handle.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        self.conn = None
+        self.writes = WriteQueue(self, write_delay, write_batch_size)
+        # Called with the user_id after every committed mutation of a user's
+        # tasks; the scheduler uses it to re-arm reminders without waiting.
+        self.write_listeners: List[Callable[[int], None]] = []
+        self.executor.submit(self.init_db).result()
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            add_search_function(self.conn)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            # Commits are grouped (see WriteQueue), so a sync on every
+            # commit is affordable and an acknowledged write survives a crash.
+            self.conn.execute('PRAGMA synchronous=FULL')
+        return self.conn
+
+    def connect_readonly(self):
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=10)
+
+    def close(self):
+        def _close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        self.executor.submit(_close).result()
+        self.executor.shutdown(wait=True)
+
+    def run_write_batch(self, batch) -> List[Tuple[object, Optional[Exception]]]:
+        # Runs on the DB thread: one transaction for the whole batch. Returns
+        # (result, exception) per write; if the commit itself fails every
+        # write gets its failure value.
+        results = []
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for name, call, failure in batch:
+                start = time.perf_counter()
+                conn.execute('SAVEPOINT batched_write')
+                try:
+                    results.append((call(), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO batched_write')
+                    if isinstance(e, sqlite3.Error):
+                        logger.error("SQLite error in %s: %s", name, e)
+                        results.append((failure, None))
+                    else:
+                        results.append((None, e))
+                finally:
+                    conn.execute('RELEASE batched_write')
+                    db_query_seconds.observe(time.perf_counter() - start, name)
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error("Group commit of %s writes failed: %s", len(batch), e)
+            return [(failure, None) for _, _, failure in batch]
+        return results
+
+    def init_db(self):
+        try:
+            with self.connect() as conn:
+                migrate(conn)
+                logger.info("Database initialized successfully.")
+        except Exception as e:
+            logger.error("Failed to initialize database: %s", e)
+
+    @invalidates_user
+    @batched_write(failure=False)
+    def add_task(self, user_id: int, text: str, category: str, deadline: Optional[int] = None) -> bool:
+        c = self.connect().cursor()
+        c.execute('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+                  (user_id, text, category, deadline, 0, int(datetime.now().timestamp())))
+        logger.info("Task '%s' added for user %s in category '%s'.", text, user_id, category)
+        return True
+
+    @invalidates_user
+    @db_call
+    def add_tasks(self, user_id: int, texts: List[str], category: str, deadline: Optional[int] = None) -> int:
+        # All rows go in with one executemany and one commit; either every task
+        # is added or none is. Returns the number of tasks added.
+        try:
+            created_ts = int(datetime.now().timestamp())
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.executemany('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) VALUES (?, ?, ?, ?, ?, ?)',
+                              [(user_id, text, category, deadline, 0, created_ts) for text in texts])
+                conn.commit()
+                logger.info("%s tasks added for user %s in category '%s'.", len(texts), user_id, category)
+                return len(texts)
+        except sqlite3.Error as e:
+            logger.error("SQLite error while adding %s tasks: %s", len(texts), e)
+            return 0
+
+    @invalidates_user
+    @db_call
+    def import_tasks(self, user_id: int, rows: List[Tuple[str, str, Optional[int], int, int]]) -> Optional[int]:
+        # rows are (text, category, deadline_ts, completed, created_ts). A row is
+        # skipped when the user already has a task with the same text, category
+        # and deadline, including one inserted earlier in the same import.
+        # Returns the number of rows inserted, or None if the batch failed.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.executemany('INSERT INTO tasks (user_id, task, category, deadline_ts, completed, created_ts) '
+                              'SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM tasks '
+                              'WHERE user_id = ? AND task = ? AND category = ? AND deadline_ts IS ?)',
+                              [(user_id, text, category, deadline, completed, created_ts, user_id, text, category, deadline)
+                               for text, category, deadline, completed, created_ts in rows])
+                added = c.rowcount
+                c.executemany('INSERT OR IGNORE INTO categories (user_id, category_name) VALUES (?, ?)',
+                              [(user_id, category) for category in {row[1] for row in rows}])
+                conn.commit()
+                logger.info("Imported %s of %s tasks for user %s.", added, len(rows), user_id)
+                return added
+        except sqlite3.Error as e:
+            logger.error("SQLite error while importing %s tasks: %s", len(rows), e)
+            return None
+
+    @invalidates_user
+    @db_call
+    def add_category(self, user_id: int, category: str) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('INSERT OR IGNORE INTO categories (user_id, category_name) VALUES (?, ?)', (user_id, category))
+                conn.commit()
+                logger.info("Category '%s' added for user %s.", category, user_id)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while adding category: %s", e)
+            return False
+
+    @user_cached
+    @db_call
+    def get_categories(self, user_id: int) -> List[str]:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT category_name FROM categories WHERE user_id = ?', (user_id,))
+                categories = [row[0] for row in c.fetchall()]
+                logger.debug("Retrieved %s categories for user %s.", len(categories), user_id)
+                return categories
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting categories: %s", e)
+            return []
+
+    @user_cached
+    @db_call
+    def get_tasks(self, user_id: Optional[int] = None, completed: int = 0, category: Optional[str] = None,
+                  limit: Optional[int] = None, after_id: Optional[int] = None, before_id: Optional[int] = None) -> List[Task]:
+        # Keyset pagination: after_id/before_id are the ids at the edges of the
+        # current page, so a page turn costs the same regardless of its depth.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                query = 'SELECT id, user_id, task, category, deadline_ts, completed, created_ts FROM tasks WHERE completed = ?'
+                params = [completed]
+                if user_id is not None:
+                    query += ' AND user_id = ?'
+                    params.append(user_id)
+                if category is not None:
+                    query += ' AND category = ?'
+                    params.append(category)
+                if after_id is not None:
+                    query += ' AND id > ?'
+                    params.append(after_id)
+                if before_id is not None:
+                    query += ' AND id < ?'
+                    params.append(before_id)
+                query += ' ORDER BY id DESC' if before_id is not None else ' ORDER BY id'
+                if limit is not None:
+                    query += ' LIMIT ?'
+                    params.append(limit)
+                c.execute(query, params)
+                rows = c.fetchall()
+                if before_id is not None:
+                    rows.reverse()
+                logger.debug("Retrieved %s tasks for user %s.", len(rows), user_id)
+                return [Task(*row) for row in rows]
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting tasks: %s", e)
+            return []
+
+    @user_cached
+    @db_call
+    def count_tasks(self, user_id: int, completed: int = 0, category: Optional[str] = None) -> int:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                query = 'SELECT COUNT(*) FROM tasks WHERE user_id = ? AND completed = ?'
+                params = [user_id, completed]
+                if category is not None:
+                    query += ' AND category = ?'
+                    params.append(category)
+                c.execute(query, params)
+                return c.fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("SQLite error while counting tasks: %s", e)
+            return 0
+
+    @db_call
+    def search_tasks(self, user_id: int, text: str, limit: int = 10, offset: int = 0) -> List[Task]:
+        # Tasks whose text or subtasks match every word as a prefix, best bm25
+        # first; a task matched by several of its rows is ranked by the best.
+        # Not cached: inline mode searches on every keystroke, so nearly every
+        # query is new and caching them would only crowd out the list pages.
+        query = search_query(user_id, text)
+        if query is None:
+            return []
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                # bm25() cannot be aggregated directly, so the hits are
+                # materialized first and grouped by task afterwards.
+                c.execute('WITH hits AS MATERIALIZED (SELECT task_id, bm25(tasks_fts) AS score FROM tasks_fts '
+                          'WHERE tasks_fts MATCH ?) '
+                          'SELECT t.id, t.user_id, t.task, t.category, t.deadline_ts, t.completed, t.created_ts '
+                          'FROM (SELECT task_id, MIN(score) AS score FROM hits GROUP BY task_id) m '
+                          'JOIN tasks t ON t.id = m.task_id ORDER BY m.score, t.id LIMIT ? OFFSET ?',
+                          (query, limit, offset))
+                tasks = [Task(*row) for row in c.fetchall()]
+                logger.debug("Search '%s' for user %s returned %s tasks.", text, user_id, len(tasks))
+                return tasks
+        except sqlite3.Error as e:
+            logger.error("SQLite error while searching tasks: %s", e)
+            return []
+
+    @db_call
+    def get_task(self, task_id: int, user_id: int) -> Optional[Task]:
+        # Primary-key lookup that brings the task's subtasks along in the same
+        # round-trip; subtask columns are NULL when the task has none.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT t.id, t.user_id, t.task, t.category, t.deadline_ts, t.completed, t.created_ts, '
+                          's.id, s.text, s.completed FROM tasks t LEFT JOIN subtasks s ON s.task_id = t.id '
+                          'WHERE t.id = ? AND t.user_id = ? ORDER BY s.id',
+                          (task_id, user_id))
+                rows = c.fetchall()
+                if not rows:
+                    return None
+                task = Task(*rows[0][:7])
+                task.subtasks = [row[7:] for row in rows if row[7] is not None]
+                return task
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting task %s: %s", task_id, e)
+            return None
+
+    async def get_all_incomplete_tasks(self) -> List[Task]:
+        return await self.get_tasks(completed=0)
+
+    @db_call
+    def get_upcoming_reminders(self, start_ts: int, end_ts: int, now: int) -> Optional[List[Tuple[Task, int, bool]]]:
+        # (task, lead, sent) for reminders due in (start_ts, end_ts] of tasks
+        # whose deadline is still ahead. One range scan over idx_deadline_ts
+        # per lead option, so the cost depends on how many deadlines fall in
+        # the window, not on the size of the whole backlog. None if the read
+        # failed, so the scheduler reads the window again instead of skipping it.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                reminders = []
+                for lead in REMINDER_LEAD_OPTIONS:
+                    c.execute(REMINDER_CANDIDATES, {'lead': lead, 'after': max(now, start_ts + lead), 'until': end_ts,
+                                                    'is_default': lead in DEFAULT_REMINDER_LEADS})
+                    reminders.extend((Task(*row[:7]), lead, bool(row[7])) for row in c.fetchall())
+                return reminders
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting upcoming reminders: %s", e)
+            return None
+
+    @db_call
+    def get_task_reminders(self, task_ids: Iterable[int], user_ids: Iterable[int], now: int, end_ts: int) -> Optional[List[Tuple[Task, int, bool]]]:
+        # Like get_upcoming_reminders, for the given tasks and all tasks of the
+        # given users, with every reminder due up to end_ts including past ones.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                reminders = {}
+                for column, ids in (('t.id', list(task_ids)), ('t.user_id', list(user_ids))):
+                    if not ids:
+                        continue
+                    for lead in REMINDER_LEAD_OPTIONS:
+                        c.execute(f'{REMINDER_CANDIDATES} AND {column} IN (SELECT value FROM json_each(:ids))',
+                                  {'lead': lead, 'after': now, 'until': end_ts, 'is_default': lead in DEFAULT_REMINDER_LEADS,
+                                   'ids': json.dumps(ids)})
+                        for row in c.fetchall():
+                            reminders[row[0], lead] = (Task(*row[:7]), lead, bool(row[7]))
+                return list(reminders.values())
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting task reminders: %s", e)
+            return None
+
+    @db_call
+    def last_deadline_change(self) -> int:
+        try:
+            with self.connect() as conn:
+                return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM deadline_changes').fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error("SQLite error while reading deadline changes: %s", e)
+            return 0
+
+    @db_call
+    def get_deadline_changes(self, after_seq: int, limit: int = 1000) -> List[Tuple[int, Optional[int], int]]:
+        # (seq, task_id, user_id) in order; task_id is None for a change of
+        # the user's lead times.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT seq, task_id, user_id FROM deadline_changes WHERE seq > ? ORDER BY seq LIMIT ?', (after_seq, limit))
+                return c.fetchall()
+        except sqlite3.Error as e:
+            logger.error("SQLite error while reading deadline changes: %s", e)
+            return []
+
+    @db_call
+    def prune_deadline_changes(self, before_ts: int) -> int:
+        # Schedulers re-read the upcoming window from the tasks table often
+        # enough that old changes are of no use to anyone.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM deadline_changes WHERE changed_at < ?', (before_ts,))
+                conn.commit()
+                return c.rowcount
+        except sqlite3.Error as e:
+            logger.error("SQLite error while pruning deadline changes: %s", e)
+            return 0
+
+    @user_cached
+    @db_call
+    def get_reminder_leads(self, user_id: int) -> List[int]:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT lead FROM reminder_leads WHERE user_id = ? ORDER BY lead DESC', (user_id,))
+                return [row[0] for row in c.fetchall()] or sorted(DEFAULT_REMINDER_LEADS, reverse=True)
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting reminder leads: %s", e)
+            return sorted(DEFAULT_REMINDER_LEADS, reverse=True)
+
+    @invalidates_user
+    @db_call
+    def set_reminder_leads(self, user_id: int, leads: List[int]) -> bool:
+        leads = sorted(set(leads) & set(REMINDER_LEAD_OPTIONS))
+        if not leads:
+            logger.warning("No valid reminder leads for user %s.", user_id)
+            return False
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM reminder_leads WHERE user_id = ?', (user_id,))
+                c.executemany('INSERT INTO reminder_leads (user_id, lead) VALUES (?, ?)', [(user_id, lead) for lead in leads])
+                c.execute('INSERT INTO deadline_changes (task_id, user_id, changed_at) VALUES (NULL, ?, ?)',
+                          (user_id, int(datetime.now().timestamp())))
+                conn.commit()
+                logger.info("Reminder leads of user %s set to %s.", user_id, leads)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while setting reminder leads: %s", e)
+            return False
+
+    @user_cached
+    @db_call
+    def get_daily_agenda(self, user_id: int) -> bool:
+        try:
+            with self.connect() as conn:
+                row = conn.execute('SELECT daily_agenda FROM user_settings WHERE user_id = ?', (user_id,)).fetchone()
+                return bool(row and row[0])
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting agenda setting: %s", e)
+            return False
+
+    @invalidates_user
+    @db_call
+    def set_daily_agenda(self, user_id: int, enabled: bool) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('INSERT INTO user_settings (user_id, daily_agenda) VALUES (?, ?) '
+                          'ON CONFLICT (user_id) DO UPDATE SET daily_agenda = excluded.daily_agenda', (user_id, int(enabled)))
+                conn.commit()
+                logger.info("Daily agenda %s for user %s.", 'enabled' if enabled else 'disabled', user_id)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while setting agenda: %s", e)
+            return False
+
+    @db_call
+    def get_agenda(self, start_ts: int, end_ts: int) -> List[Task]:
+        # Open tasks due in the window of every user who asked for the daily
+        # agenda, in one query ordered by user, so the caller only groups rows.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT t.id, t.user_id, t.task, t.category, t.deadline_ts, t.completed, t.created_ts FROM tasks t '
+                          'WHERE t.completed = 0 AND t.deadline_ts >= ? AND t.deadline_ts < ? '
+                          'AND EXISTS (SELECT 1 FROM user_settings s WHERE s.user_id = t.user_id AND s.daily_agenda = 1) '
+                          'ORDER BY t.user_id, t.deadline_ts',
+                          (start_ts, end_ts))
+                return [Task(*row) for row in c.fetchall()]
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting agenda: %s", e)
+            return []
+
+    @db_call
+    def claim_agenda(self, user_ids: List[int], day: int) -> List[int]:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                claimed = []
+                for user_id in user_ids:
+                    c.execute('UPDATE user_settings SET agenda_day = ? WHERE user_id = ? AND agenda_day IS NOT ?', (day, user_id, day))
+                    if c.rowcount == 1:
+                        claimed.append(user_id)
+                conn.commit()
+                return claimed
+        except sqlite3.Error as e:
+            logger.error("SQLite error while claiming agendas: %s", e)
+            return []
+
+    @db_call
+    def release_agenda(self, user_id: int, day: int) -> bool:
+        # Undoes claim_agenda for a user whose agenda could not be sent.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('UPDATE user_settings SET agenda_day = NULL WHERE user_id = ? AND agenda_day = ?', (user_id, day))
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while releasing agenda: %s", e)
+            return False
+
+    @db_call
+    def claim_reminders(self, reminders: List[Tuple[Task, int]], owner: str, claim_timeout: int = 600) -> Optional[List[Tuple[Task, int]]]:
+        # A reminder is identified by (task_id, deadline_ts, lead), so moving a
+        # deadline arms fresh reminders. Only tasks that still have the deadline
+        # and are not completed are claimed. Claims that were never confirmed
+        # as sent expire after claim_timeout seconds, so a crashed scheduler's
+        # work is picked up. None if the claim failed and nothing was claimed.
+        now = int(datetime.now().timestamp())
+        claimed = []
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                for task, lead in reminders:
+                    c.execute('INSERT OR IGNORE INTO reminders (task_id, deadline_ts, lead, claimed_by, claimed_at) '
+                              'SELECT id, deadline_ts, ?, ?, ? FROM tasks WHERE id = ? AND deadline_ts = ? AND completed = 0',
+                              (lead, owner, now, task.id, task.deadline))
+                    if c.rowcount == 0:
+                        c.execute('UPDATE reminders SET claimed_by = ?, claimed_at = ? '
+                                  'WHERE task_id = ? AND deadline_ts = ? AND lead = ? AND sent_at IS NULL AND claimed_at < ? '
+                                  'AND EXISTS (SELECT 1 FROM tasks WHERE id = ? AND deadline_ts = ? AND completed = 0)',
+                                  (owner, now, task.id, task.deadline, lead, now - claim_timeout, task.id, task.deadline))
+                    if c.rowcount == 1:
+                        claimed.append((task, lead))
+                conn.commit()
+                return claimed
+        except sqlite3.Error as e:
+            logger.error("SQLite error while claiming reminders: %s", e)
+            return None
+
+    @db_call
+    def mark_reminder_sent(self, task_id: int, deadline_ts: int, lead: int, owner: str) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('UPDATE reminders SET sent_at = ? WHERE task_id = ? AND deadline_ts = ? AND lead = ? AND claimed_by = ?',
+                          (int(datetime.now().timestamp()), task_id, deadline_ts, lead, owner))
+                conn.commit()
+                return c.rowcount == 1
+        except sqlite3.Error as e:
+            logger.error("SQLite error while marking reminder sent: %s", e)
+            return False
+
+    @db_call
+    def release_reminder(self, task_id: int, deadline_ts: int, lead: int, owner: str) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM reminders WHERE task_id = ? AND deadline_ts = ? AND lead = ? AND claimed_by = ? AND sent_at IS NULL',
+                          (task_id, deadline_ts, lead, owner))
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while releasing reminder: %s", e)
+            return False
+
+    @invalidates_user
+    @batched_write(failure=False)
+    def complete_task(self, task_id: int, user_id: int) -> bool:
+        c = self.connect().cursor()
+        c.execute('UPDATE tasks SET completed = 1 WHERE id = ? AND user_id = ?', (task_id, user_id))
+        logger.info("Task %s marked as completed.", task_id)
+        return c.rowcount == 1
+
+    @invalidates_user
+    @db_call
+    def complete_tasks(self, user_id: int, task_ids: List[int]) -> int:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.executemany('UPDATE tasks SET completed = 1 WHERE id = ? AND user_id = ? AND completed = 0',
+                              [(task_id, user_id) for task_id in task_ids])
+                conn.commit()
+                logger.info("%s of %s tasks marked as completed for user %s.", c.rowcount, len(task_ids), user_id)
+                return c.rowcount
+        except sqlite3.Error as e:
+            logger.error("SQLite error while completing %s tasks: %s", len(task_ids), e)
+            return 0
+
+    @invalidates_user
+    @db_call
+    def complete_category(self, user_id: int, category: str) -> int:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('UPDATE tasks SET completed = 1 WHERE user_id = ? AND completed = 0 AND category = ?', (user_id, category))
+                conn.commit()
+                logger.info("%s tasks in category '%s' marked as completed for user %s.", c.rowcount, category, user_id)
+                return c.rowcount
+        except sqlite3.Error as e:
+            logger.error("SQLite error while completing category '%s': %s", category, e)
+            return 0
+
+    @invalidates_user
+    @db_call
+    def delete_task(self, task_id: int, user_id: int) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+                if c.rowcount == 0:
+                    return False
+                c.execute('DELETE FROM reminders WHERE task_id = ?', (task_id,))
+                conn.commit()
+                logger.info("Task %s deleted.", task_id)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while deleting task: %s", e)
+            return False
+
+    @invalidates_user
+    @db_call
+    def delete_tasks(self, user_id: int, task_ids: List[int]) -> int:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.executemany('DELETE FROM tasks WHERE id = ? AND user_id = ?', [(task_id, user_id) for task_id in task_ids])
+                deleted = c.rowcount
+                # Only reminders of tasks that are gone now, not of other users' ids.
+                c.executemany('DELETE FROM reminders WHERE task_id = ? AND NOT EXISTS (SELECT 1 FROM tasks WHERE id = ?)',
+                              [(task_id, task_id) for task_id in task_ids])
+                conn.commit()
+                logger.info("%s of %s tasks deleted for user %s.", deleted, len(task_ids), user_id)
+                return deleted
+        except sqlite3.Error as e:
+            logger.error("SQLite error while deleting %s tasks: %s", len(task_ids), e)
+            return 0
+
+    @invalidates_user
+    @batched_write(failure=False)
+    def edit_task(self, task_id: int, user_id: int, text: Optional[str] = None, category: Optional[str] = None, deadline: Optional[int] = None) -> bool:
+        updates = []
+        params = []
+        if text is not None:
+            updates.append('task = ?')
+            params.append(text)
+        if category is not None:
+            updates.append('category = ?')
+            params.append(category)
+        if deadline is not None:
+            updates.append('deadline_ts = ?')
+            params.append(deadline)
+        if not updates:
+            logger.warning("No fields to update for task %s.", task_id)
+            return False
+        params.extend([task_id, user_id])
+        query = f'UPDATE tasks SET {", ".join(updates)} WHERE id = ? AND user_id = ?'
+        c = self.connect().cursor()
+        c.execute(query, params)
+        logger.info("Task %s updated.", task_id)
+        return c.rowcount == 1
+
+    @db_call
+    def get_stats(self, user_id: int, days: int) -> List[Tuple[str, int, int]]:
+        # Reads the daily_stats rollup; the window is whole UTC days, counting
+        # the day that contains the start of the window.
+        try:
+            first_day = int((datetime.now() - timedelta(days=days)).timestamp()) // 86400
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT category, SUM(total), SUM(completed) FROM daily_stats WHERE user_id = ? AND day >= ? GROUP BY category',
+                          (user_id, first_day))
+                stats = []
+                for category, total, completed in c.fetchall():
+                    if completed:
+                        stats.append((category, 1, completed))
+                    if total - completed:
+                        stats.append((category, 0, total - completed))
+                logger.debug("Stats for user %s for last %s days: %s", user_id, days, stats)
+                return stats
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting stats: %s", e)
+            return []
+
+    @db_call
+    def rebuild_daily_stats(self) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM daily_stats')
+                c.execute(f'INSERT INTO daily_stats (user_id, category, day, total, completed) {DAILY_STATS_FROM_TASKS}')
+                conn.commit()
+                logger.info("Rebuilt daily_stats: %s rows.", c.rowcount)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while rebuilding daily stats: %s", e)
+            return False
+
+    @db_call
+    def check_daily_stats(self) -> List[Tuple]:
+        # Returns the (user_id, category, day, total, completed) rows on which
+        # the rollup and a fresh aggregation of the tasks table disagree.
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute(f'''SELECT 'tasks', * FROM ({DAILY_STATS_FROM_TASKS}
+                                  EXCEPT SELECT user_id, category, day, total, completed FROM daily_stats WHERE total != 0)
+                              UNION ALL
+                              SELECT 'daily_stats', * FROM (SELECT user_id, category, day, total, completed FROM daily_stats WHERE total != 0
+                                  EXCEPT {DAILY_STATS_FROM_TASKS})''')
+                return c.fetchall()
+        except sqlite3.Error as e:
+            logger.error("SQLite error while checking daily stats: %s", e)
+            return []
+
+    def iter_export_rows(self, user_id: int, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[list]:
+        # Streams the user's tasks in fetchmany chunks over a separate read-only
+        # connection, so a long export neither blocks the DB thread nor holds
+        # the whole history in memory. WAL keeps it from blocking writers.
+        conn = self.connect_readonly()
+        try:
+            c = conn.cursor()
+            # Timestamps are formatted by sqlite itself, which is about twice as
+            # fast as strftime in Python for exports of millions of rows.
+            c.execute("SELECT id, task, category, "
+                      "CASE WHEN deadline_ts THEN strftime('%d.%m.%Y %H:%M', deadline_ts, 'unixepoch', 'localtime') ELSE '' END, "
+                      "completed, COALESCE(strftime('%Y-%m-%d %H:%M:%S', created_ts, 'unixepoch', 'localtime'), '') "
+                      "FROM tasks WHERE user_id = ?", (user_id,))
+            while rows := c.fetchmany(chunk_size):
+                yield rows
+        finally:
+            conn.close()
+
+    # The task id comes from the conversation state, which a forged callback
+    # can set, so subtasks are only added to a task of the given user.
+    @invalidates_user
+    @batched_write(failure=False)
+    def add_subtask(self, task_id: int, user_id: int, text: str) -> bool:
+        c = self.connect().cursor()
+        c.execute('INSERT INTO subtasks (task_id, text, completed) SELECT ?, ?, 0 '
+                  'WHERE EXISTS (SELECT 1 FROM tasks WHERE id = ? AND user_id = ?)', (task_id, text, task_id, user_id))
+        if c.rowcount != 1:
+            logger.warning("Task %s not found for user %s.", task_id, user_id)
+            return False
+        logger.info("Subtask '%s' added to task %s.", text, task_id)
+        return True
+
+    @invalidates_user
+    @db_call
+    def add_subtasks(self, task_id: int, user_id: int, texts: List[str]) -> int:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.executemany('INSERT INTO subtasks (task_id, text, completed) SELECT ?, ?, 0 '
+                              'WHERE EXISTS (SELECT 1 FROM tasks WHERE id = ? AND user_id = ?)',
+                              [(task_id, text, task_id, user_id) for text in texts])
+                if c.rowcount == 0:
+                    logger.warning("Task %s not found for user %s.", task_id, user_id)
+                    return 0
+                conn.commit()
+                logger.info("%s subtasks added to task %s.", c.rowcount, task_id)
+                return c.rowcount
+        except sqlite3.Error as e:
+            logger.error("SQLite error while adding %s subtasks: %s", len(texts), e)
+            return 0
+
+    @db_call
+    def get_subtasks(self, task_id: int) -> List[Tuple[int, str, int]]:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('SELECT id, text, completed FROM subtasks WHERE task_id = ?', (task_id,))
+                return c.fetchall()
+        except sqlite3.Error as e:
+            logger.error("SQLite error while getting subtasks: %s", e)
+            return []
+
+    # Subtask ids come from callback data, so a subtask is only touched if it
+    # belongs to the given task and that task to the given user.
+    @invalidates_user
+    @batched_write(failure=False)
+    def complete_subtask(self, subtask_id: int, task_id: int, user_id: int, completed: int = 1) -> bool:
+        c = self.connect().cursor()
+        c.execute('UPDATE subtasks SET completed = ? WHERE id = ? AND task_id IN (SELECT id FROM tasks WHERE id = ? AND user_id = ?)',
+                  (completed, subtask_id, task_id, user_id))
+        if c.rowcount != 1:
+            logger.warning("Subtask %s of task %s not found for user %s.", subtask_id, task_id, user_id)
+            return False
+        logger.info("Subtask %s marked as %s.", subtask_id, 'completed' if completed else 'not completed')
+        return True
+
+    @invalidates_user
+    @db_call
+    def delete_subtask(self, subtask_id: int, task_id: int, user_id: int) -> bool:
+        try:
+            with self.connect() as conn:
+                c = conn.cursor()
+                c.execute('DELETE FROM subtasks WHERE id = ? AND task_id IN (SELECT id FROM tasks WHERE id = ? AND user_id = ?)',
+                          (subtask_id, task_id, user_id))
+                if c.rowcount != 1:
+                    logger.warning("Subtask %s of task %s not found for user %s.", subtask_id, task_id, user_id)
+                    return False
+                conn.commit()
+                logger.info("Subtask %s deleted.", subtask_id)
+                return True
+        except sqlite3.Error as e:
+            logger.error("SQLite error while deleting subtask: %s", e)
+            return False
+
+task_managers = {}
+
+def get_task_manager(db_path=DB_PATH) -> TaskManager:
+    # One manager per database file and process, shared by the handlers and
+    # the scheduler: one DB thread, one connection, one user cache, and the
+    # schema is checked only when the first one is created.
+    task_manager = task_managers.get(db_path)
+    if task_manager is None:
+        task_manager = task_managers[db_path] = TaskManager(db_path, cache=UserCache())
+    return task_manager
@@ -0,0 +1,105 @@
+from aiogram.types import InputFile
+from database import TaskManager
+from typing import Iterable, Iterator, Optional, Tuple
+from tempfile import SpooledTemporaryFile
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ['ID', 'Task', 'Category', 'Deadline', 'Completed', 'Created At']
+JSON_KEYS = ['id', 'task', 'category', 'deadline', 'completed', 'created_at']
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Exports stay in memory up to this size and spill to a temporary file beyond it.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+def encode_csv(chunks: Iterable[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def encode_jsonl(chunks: Iterable[list]) -> Iterator[str]:
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(JSON_KEYS, row)), ensure_ascii=False) + '\n' for row in rows)
+
+ENCODERS = {'csv': encode_csv, 'jsonl': encode_jsonl}
+
+class SpooledInputFile(InputFile):
+    """Uploads an already written spooled buffer in chunks.
+
+    Every read starts from the beginning, so a request retried after
+    RetryAfter uploads the whole file again; the sender closes it once the
+    send is over.
+    """
+
+    def __init__(self, file: SpooledTemporaryFile, filename: str):
+        super().__init__(filename=filename)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+def build_export(task_manager: TaskManager, user_id: int, fmt: str = 'csv', compress: bool = False) -> Optional[Tuple[SpooledTemporaryFile, int]]:
+    # Rows are fetched, encoded and written chunk by chunk, so memory use is
+    # bounded by the chunk size rather than by the user's history.
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    raw = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+    stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    count = 0
+
+    def counted(chunks):
+        nonlocal count
+        for rows in chunks:
+            count += len(rows)
+            yield rows
+
+    rows = task_manager.iter_export_rows(user_id)
+    try:
+        for text in ENCODERS[fmt](counted(rows)):
+            stream.write(text)
+        stream.flush()
+        stream.detach()
+    except Exception:
+        # A failure halfway must not leave the read connection or the
+        # temporary file open.
+        rows.close()
+        if compress:
+            raw.close()
+        spool.close()
+        raise
+    if compress:
+        raw.close()
+    if not count:
+        spool.close()
+        return None
+    return spool, count
+
+async def export_tasks(task_manager: TaskManager, user_id: int, fmt: str = 'csv', compress: bool = False) -> Optional[SpooledInputFile]:
+    try:
+        result = await asyncio.to_thread(build_export, task_manager, user_id, fmt, compress)
+        if result is None:
+            logger.warning("No tasks to export for user %s", user_id)
+            return None
+        spool, count = result
+        filename = f"tasks_{user_id}.{fmt}{'.gz' if compress else ''}"
+        logger.info("Exported %s tasks for user %s as %s", count, user_id, filename)
+        return SpooledInputFile(spool, filename)
+    except Exception as e:
+        logger.error("Failed to export tasks for user %s: %s", user_id, e)
+        return None
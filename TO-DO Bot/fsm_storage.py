@@ -0,0 +1,166 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from concurrent.futures import ThreadPoolExecutor
+from database import DB_PATH, migrate
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.5
+CONVERSATION_TTL = 24 * 60 * 60
+
+class FSMRecord:
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, updated_at: float = 0.0):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the bot's SQLite file.
+
+    Reads are served from an in-process copy of every active conversation;
+    writes only mark the record dirty and a background task flushes all
+    dirty records in one transaction every flush_interval seconds. States
+    untouched for longer than ttl are dropped as abandoned conversations.
+    With flush_interval=0 every write goes to the database immediately.
+    The in-process copy means a chat must be served by one process at a time;
+    after a restart its conversation is picked up again from the table.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, flush_interval: float = FLUSH_INTERVAL, ttl: float = CONVERSATION_TTL):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self.records: Dict[str, FSMRecord] = {}
+        self.dirty = set()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm')
+        self.conn = None
+        self.flusher = None
+        self.last_expiry = time.time()
+        self.executor.submit(self.init_db).result()
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        return self.conn
+
+    def init_db(self):
+        # fsm_states is created by the schema migrations in database.py.
+        migrate(self.connect())
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def load_record(self, key: str) -> FSMRecord:
+        row = self.connect().execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return FSMRecord()
+        return FSMRecord(row[0], json.loads(row[1]) if row[1] else {}, row[2])
+
+    def write_records(self, records: Dict[str, Optional[FSMRecord]]):
+        with self.connect() as conn:
+            conn.executemany('DELETE FROM fsm_states WHERE key = ?',
+                             [(key,) for key, record in records.items() if record is None])
+            conn.executemany('INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+                             [(key, record.state, json.dumps(record.data, ensure_ascii=False), int(record.updated_at))
+                              for key, record in records.items() if record is not None])
+
+    def expire_records(self, before: float) -> int:
+        with self.connect() as conn:
+            return conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (int(before),)).rowcount
+
+    async def get_record(self, key: StorageKey) -> FSMRecord:
+        built = self.key_builder.build(key)
+        record = self.records.get(built)
+        if record is None:
+            record = await self.run(self.load_record, built)
+            # A write for this key may have landed while the row was loading.
+            record = self.records.setdefault(built, record)
+        if record.updated_at and record.updated_at < time.time() - self.ttl:
+            record = self.records[built] = FSMRecord()
+        return record
+
+    async def touch(self, key: StorageKey, record: FSMRecord):
+        built = self.key_builder.build(key)
+        record.updated_at = time.time()
+        self.records[built] = record
+        self.dirty.add(built)
+        if not self.flush_interval:
+            await self.flush()
+        elif self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self.get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self.touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self.get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self.get_record(key)
+        record.data = data.copy()
+        await self.touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self.get_record(key)).data.copy()
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        batch = {}
+        for key in self.dirty:
+            record = self.records.get(key)
+            batch[key] = record if record is not None and (record.state is not None or record.data) else None
+        self.dirty = set()
+        try:
+            await self.run(self.write_records, batch)
+        except sqlite3.Error as e:
+            logger.error("SQLite error while flushing %s FSM records: %s", len(batch), e)
+            self.dirty.update(batch)
+            return
+        # Finished conversations need no in-process copy any more.
+        for key, record in batch.items():
+            if record is None and key not in self.dirty:
+                self.records.pop(key, None)
+
+    async def expire(self):
+        cutoff = time.time() - self.ttl
+        self.last_expiry = time.time()
+        for key in [key for key, record in self.records.items() if record.updated_at < cutoff and key not in self.dirty]:
+            del self.records[key]
+        removed = await self.run(self.expire_records, cutoff)
+        if removed:
+            logger.info("Expired %s abandoned FSM conversations.", removed)
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self.last_expiry > min(self.ttl, 60 * 60):
+                    await self.expire()
+            except Exception as e:
+                logger.error("Error in FSM flush loop: %s", e)
+
+    async def close(self) -> None:
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+
+        def _close():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        await self.run(_close)
+        self.executor.shutdown(wait=True)
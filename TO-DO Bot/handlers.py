@@ -1,455 +1,613 @@
-from aiogram import Router, types
-from aiogram.filters import CommandStart, StateFilter
-from aiogram.fsm.context import FSMContext
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from typing import Optional
-from database import TaskManager
-from states import AddTask, EditTask, SubtaskStates
-from task_calendar import create_calendar, create_time_picker
-from visualizer import generate_stats_plot
-import os
-import logging
-from datetime import datetime
-
-logger = logging.getLogger(__name__)
-
-router = Router()
-TASKS_PER_PAGE = 5
-task_manager = TaskManager()
-
-class KeyboardBuilder:
-    @staticmethod
-    def create_persistent_keyboard():
-        return ReplyKeyboardMarkup(keyboard=[
-            [KeyboardButton(text="Главное меню")]
-        ], resize_keyboard=True, one_time_keyboard=False)
-
-    @staticmethod
-    def create_main_menu():
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="Добавить задачу", callback_data="cmd_add"),
-                InlineKeyboardButton(text="Список задач", callback_data="cmd_list")
-            ],
-            [
-                InlineKeyboardButton(text="Завершить задачу", callback_data="cmd_done"),
-                InlineKeyboardButton(text="Редактировать", callback_data="cmd_edit")
-            ],
-            [
-                InlineKeyboardButton(text="Статистика", callback_data="cmd_stats"),
-                InlineKeyboardButton(text="Экспорт", callback_data="cmd_export")
-            ]
-        ])
-
-    @staticmethod
-    def create_category_keyboard(user_id, for_add=True):
-        categories = task_manager.get_categories(user_id) or ['Общее']
-        if 'Общее' not in categories:
-            task_manager.add_category(user_id, 'Общее')
-        keyboard = [[InlineKeyboardButton(text=cat, callback_data=f"cat_{cat}")] for cat in categories]
-        if for_add:
-            keyboard.append([InlineKeyboardButton(text="Новая категория", callback_data="new_category")])
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-    @staticmethod
-    def create_task_keyboard(tasks, page, action, category=None):
-        start_idx = page * TASKS_PER_PAGE
-        end_idx = start_idx + TASKS_PER_PAGE
-        paginated_tasks = tasks[start_idx:end_idx]
-        keyboard = [[InlineKeyboardButton(text=f"{task.text} ({task.category})", callback_data=f"{action}_{task.id}")] for task in paginated_tasks]
-        nav_row = []
-        if start_idx > 0:
-            nav_row.append(InlineKeyboardButton(text="⬅ Назад", callback_data=f"page_{action}_{page-1}_{category or ''}"))
-        if end_idx < len(tasks):
-            nav_row.append(InlineKeyboardButton(text="Далее ➡", callback_data=f"page_{action}_{page+1}_{category or ''}"))
-        if nav_row:
-            keyboard.append(nav_row)
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-    @staticmethod
-    def create_subtask_keyboard(subtasks, task_id):
-        keyboard = []
-        for id, text, completed in subtasks:
-            keyboard.append([InlineKeyboardButton(text=f"{text} {'(выполнено)' if completed else ''}", callback_data=f"sub_complete_{id}_{task_id}")])
-        keyboard.append([InlineKeyboardButton(text="Добавить подзадачу", callback_data=f"add_sub_{task_id}")])
-        if subtasks:
-            delete_keyboard = []
-            for id, text, _ in subtasks:
-                delete_keyboard.append(InlineKeyboardButton(text=f"Удалить {text}", callback_data=f"sub_delete_{id}_{task_id}"))
-                if len(delete_keyboard) == 2:
-                    keyboard.append(delete_keyboard)
-                    delete_keyboard = []
-            if delete_keyboard:
-                keyboard.append(delete_keyboard)
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
-
-    @staticmethod
-    def create_edit_field_keyboard(task_id):
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Название", callback_data=f"edit_field_text_{task_id}")],
-            [InlineKeyboardButton(text="Категория", callback_data=f"edit_field_category_{task_id}")],
-            [InlineKeyboardButton(text="Дедлайн", callback_data=f"edit_field_deadline_{task_id}")]
-        ])
-
-@router.message(CommandStart())
-async def start_command(message: types.Message):
-    # Single message with persistent keyboard, no "Меню готово."
-    await message.reply("Привет! Нажми 'Главное меню' ниже для действий.", reply_markup=KeyboardBuilder.create_persistent_keyboard())
-
-@router.message(lambda m: m.text == "Главное меню")
-async def show_main_menu(message: types.Message):
-    await message.reply("Выбери действие:", reply_markup=KeyboardBuilder.create_main_menu())
-
-@router.callback_query(lambda c: c.data.startswith("list_cat_") or c.data == "list_all_0")
-async def list_by_category(callback: types.CallbackQuery):
-    data = callback.data
-    parts = data.split("_")
-    category = parts[2] if len(parts) > 2 and parts[0] == "list" and parts[1] == "cat" else None
-    page = int(parts[-1])
-    tasks = task_manager.get_tasks(callback.from_user.id, completed=0, category=category)
-    if not tasks:
-        await callback.message.edit_text("Нет задач в этой категории.")
-        await callback.answer()
-        return
-    keyboard = KeyboardBuilder.create_task_keyboard(tasks, page, "view", category)
-    await callback.message.edit_text("Твои задачи:", reply_markup=keyboard)
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data == "cmd_list")
-async def cmd_list(callback: types.CallbackQuery):
-    # Handler for "Список задач" inline button
-    categories = task_manager.get_categories(callback.from_user.id)
-    keyboard = [[InlineKeyboardButton(text="Все задачи", callback_data="list_all_0")]]
-    for cat in categories:
-        keyboard.append([InlineKeyboardButton(text=cat, callback_data=f"list_cat_{cat}_0")])
-    await callback.message.edit_text("Выбери категорию:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data == "cmd_add")
-async def add_task_command(callback: types.CallbackQuery, state: FSMContext):
-    keyboard = KeyboardBuilder.create_category_keyboard(callback.from_user.id)
-    await callback.message.edit_text("Выбери категорию:", reply_markup=keyboard)
-    await state.set_state(AddTask.waiting_for_category)
-    await callback.answer()
-
-@router.callback_query(AddTask.waiting_for_category, lambda c: c.data.startswith("cat_"))
-async def process_category(callback: types.CallbackQuery, state: FSMContext):
-    category = callback.data.replace("cat_", "")
-    await state.update_data(category=category)
-    await callback.message.edit_text("Введи название задачи:")
-    await state.set_state(AddTask.waiting_for_task)
-    await callback.answer()
-
-@router.callback_query(AddTask.waiting_for_category, lambda c: c.data == "new_category")
-async def new_category(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("Введи название новой категории:")
-    await state.set_state(AddTask.waiting_for_new_category)
-    await callback.answer()
-
-@router.message(AddTask.waiting_for_new_category)
-async def process_new_category(message: types.Message, state: FSMContext):
-    category = message.text.strip()
-    if not category or len(category) > 50:
-        await message.reply("Категория не может быть пустой или слишком длинной.")
-        return
-    task_manager.add_category(message.from_user.id, category)
-    await state.update_data(category=category)
-    await message.reply("Категория добавлена. Введи название задачи:")
-    await state.set_state(AddTask.waiting_for_task)
-
-@router.message(AddTask.waiting_for_task)
-async def process_task_input(message: types.Message, state: FSMContext):
-    text = message.text.strip()
-    if not text or len(text) > 200:
-        await message.reply("Название не может быть пустым или слишком длинным.")
-        return
-    await state.update_data(text=text)
-    keyboard = create_calendar()
-    await message.reply("Выбери дату дедлайна:", reply_markup=keyboard)
-    await state.set_state(AddTask.waiting_for_deadline_date)
-
-@router.callback_query(AddTask.waiting_for_deadline_date, lambda c: c.data.startswith("day_") or c.data.startswith("prev_month_") or c.data.startswith("next_month_"))
-async def process_date(callback: types.CallbackQuery, state: FSMContext):
-    data = callback.data
-    if data.startswith("prev_month_") or data.startswith("next_month_"):
-        parts = data.split("_")
-        year = int(parts[2])
-        month = int(parts[3])
-        if data.startswith("prev_month_"):
-            month -= 1
-            if month == 0:
-                month = 12
-                year -= 1
-        else:
-            month += 1
-            if month == 13:
-                month = 1
-                year += 1
-        keyboard = create_calendar(year, month)
-        await callback.message.edit_reply_markup(reply_markup=keyboard)
-        await callback.answer()
-        return
-    if data == "skip_deadline":
-        await save_task(callback, state, None)
-        return
-    parts = data.split("_")
-    year, month, day = int(parts[1]), int(parts[2]), int(parts[3])
-    await state.update_data(date_str=f"{day:02d}.{month:02d}.{year}")
-    keyboard = create_time_picker()
-    await callback.message.edit_text("Выбери время дедлайна:", reply_markup=keyboard)
-    await state.set_state(AddTask.waiting_for_deadline_time)
-
-@router.callback_query(AddTask.waiting_for_deadline_time, lambda c: c.data.startswith("time_") or c.data == "skip_deadline")
-async def process_time(callback: types.CallbackQuery, state: FSMContext):
-    data = callback.data
-    if data == "skip_deadline":
-        await save_task(callback, state, None)
-        return
-    time_str = data.split("_")[1]
-    data = await state.get_data()
-    date_str = data.get("date_str")
-    deadline = f"{date_str} {time_str}" if date_str else None
-    await save_task(callback, state, deadline)
-
-async def save_task(callback: types.CallbackQuery, state: FSMContext, deadline: Optional[str]):
-    data = await state.get_data()
-    user_id = callback.from_user.id
-    text = data.get("text")
-    category = data.get("category")
-    if task_manager.add_task(user_id, text, category, deadline):
-        await callback.message.edit_text(f"Задача '{text}' добавлена в '{category}' с дедлайном {deadline or 'без'}.")
-    else:
-        await callback.message.edit_text("Ошибка добавления.")
-    await state.clear()
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data.startswith("view_"))
-async def view_task_callback(callback: types.CallbackQuery):
-    task_id = int(callback.data.split("_")[1])
-    task = next((t for t in task_manager.get_tasks(callback.from_user.id) if t.id == task_id), None)
-    if task:
-        subtasks = task_manager.get_subtasks(task_id)
-        keyboard = KeyboardBuilder.create_subtask_keyboard(subtasks, task_id)
-        text = f"Задача: {task.text}\nКатегория: {task.category}\nДедлайн: {task.deadline or 'Нет'}\nПодзадачи:"
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    else:
-        await callback.message.edit_text("Задача не найдена.")
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data.startswith("add_sub_"))
-async def add_subtask(callback: types.CallbackQuery, state: FSMContext):
-    task_id = int(callback.data.split("_")[2])
-    await state.update_data(task_id=task_id)
-    await callback.message.edit_text("Введи текст подзадачи:")
-    await state.set_state(SubtaskStates.waiting_for_subtask)
-    await callback.answer()
-
-@router.message(StateFilter(SubtaskStates.waiting_for_subtask))
-async def process_subtask_input(message: types.Message, state: FSMContext):
-    text = message.text.strip()
-    if not text or len(text) > 200:
-        await message.reply("Текст не может быть пустым или слишком длинным.")
-        return
-    data = await state.get_data()
-    task_id = data.get("task_id")
-    if task_manager.add_subtask(task_id, text):
-        await message.reply("Подзадача добавлена.")
-    else:
-        await message.reply("Ошибка добавления.")
-    await state.clear()
-
-@router.callback_query(lambda c: c.data.startswith("sub_complete_"))
-async def complete_subtask(callback: types.CallbackQuery):
-    parts = callback.data.split("_")
-    sub_id = int(parts[2])
-    task_id = int(parts[3])
-    task_manager.complete_subtask(sub_id)
-    subtasks = task_manager.get_subtasks(task_id)
-    keyboard = KeyboardBuilder.create_subtask_keyboard(subtasks, task_id)
-    await callback.message.edit_reply_markup(reply_markup=keyboard)
-    await callback.answer("Подзадача обновлена.")
-
-@router.callback_query(lambda c: c.data.startswith("sub_delete_"))
-async def delete_subtask(callback: types.CallbackQuery):
-    parts = callback.data.split("_")
-    sub_id = int(parts[2])
-    task_id = int(parts[3])
-    if task_manager.delete_subtask(sub_id):
-        subtasks = task_manager.get_subtasks(task_id)
-        keyboard = KeyboardBuilder.create_subtask_keyboard(subtasks, task_id)
-        await callback.message.edit_reply_markup(reply_markup=keyboard)
-        await callback.answer("Подзадача удалена.")
-    else:
-        await callback.answer("Ошибка удаления.")
-
-@router.callback_query(lambda c: c.data == "cmd_done")
-async def done_task_command(callback: types.CallbackQuery):
-    tasks = task_manager.get_tasks(callback.from_user.id, completed=0)
-    if not tasks:
-        await callback.message.edit_text("Нет активных задач.")
-        await callback.answer()
-        return
-    keyboard = KeyboardBuilder.create_task_keyboard(tasks, 0, "done")
-    await callback.message.edit_text("Выбери задачу для завершения:", reply_markup=keyboard)
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data.startswith("done_"))
-async def process_done_callback(callback: types.CallbackQuery):
-    task_id = int(callback.data.split("_")[1])
-    if task_manager.complete_task(task_id):
-        await callback.message.edit_text("Задача завершена!")
-    else:
-        await callback.message.edit_text("Ошибка.")
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data == "cmd_edit")
-async def edit_task_command(callback: types.CallbackQuery, state: FSMContext):
-    tasks = task_manager.get_tasks(callback.from_user.id, completed=0)
-    if not tasks:
-        await callback.message.edit_text("Нет активных задач.")
-        await callback.answer()
-        return
-    keyboard = KeyboardBuilder.create_task_keyboard(tasks, 0, "edit_select")
-    await callback.message.edit_text("Выбери задачу для редактирования:", reply_markup=keyboard)
-    await state.set_state(EditTask.waiting_for_task)
-    await callback.answer()
-
-@router.callback_query(EditTask.waiting_for_task, lambda c: c.data.startswith("edit_select_"))
-async def select_edit_task(callback: types.CallbackQuery, state: FSMContext):
-    task_id = int(callback.data.split("_")[2])
-    await state.update_data(task_id=task_id)
-    keyboard = KeyboardBuilder.create_edit_field_keyboard(task_id)
-    await callback.message.edit_text("Что редактировать?", reply_markup=keyboard)
-    await state.set_state(EditTask.waiting_for_field)
-    await callback.answer()
-
-@router.callback_query(EditTask.waiting_for_field, lambda c: c.data.startswith("edit_field_"))
-async def process_edit_field(callback: types.CallbackQuery, state: FSMContext):
-    field = callback.data.split("_")[2]
-    await state.update_data(field=field)
-    if field == "text":
-        await callback.message.edit_text("Введи новое название:")
-        await state.set_state(EditTask.waiting_for_new_value)
-    elif field == "category":
-        keyboard = KeyboardBuilder.create_category_keyboard(callback.from_user.id, for_add=False)
-        await callback.message.edit_text("Выбери новую категорию:", reply_markup=keyboard)
-        await state.set_state(EditTask.waiting_for_new_category)
-    elif field == "deadline":
-        keyboard = create_calendar()
-        await callback.message.edit_text("Выбери новую дату:", reply_markup=keyboard)
-        await state.set_state(EditTask.waiting_for_deadline_date)
-    await callback.answer()
-
-@router.message(EditTask.waiting_for_new_value)
-async def process_new_value(message: types.Message, state: FSMContext):
-    value = message.text.strip()
-    if not value or len(value) > 200:
-        await message.reply("Значение не может быть пустым или слишком длинным.")
-        return
-    data = await state.get_data()
-    task_id = data['task_id']
-    field = data['field']
-    edit_kwargs = {field: value}
-    if task_manager.edit_task(task_id, **edit_kwargs):
-        await message.reply("Задача обновлена!")
-    else:
-        await message.reply("Ошибка обновления.")
-    await state.clear()
-
-@router.callback_query(EditTask.waiting_for_new_category, lambda c: c.data.startswith("cat_"))
-async def process_new_category_edit(callback: types.CallbackQuery, state: FSMContext):
-    category = callback.data.replace("cat_", "")
-    data = await state.get_data()
-    task_id = data['task_id']
-    if task_manager.edit_task(task_id, category=category):
-        await callback.message.edit_text("Категория обновлена!")
-    else:
-        await callback.message.edit_text("Ошибка.")
-    await state.clear()
-    await callback.answer()
-
-@router.callback_query(EditTask.waiting_for_deadline_date, lambda c: c.data.startswith("day_") or c.data.startswith("prev_month_") or c.data.startswith("next_month_"))
-async def process_edit_date(callback: types.CallbackQuery, state: FSMContext):
-    data = callback.data
-    if data.startswith("prev_month_") or data.startswith("next_month_"):
-        parts = data.split("_")
-        year = int(parts[2])
-        month = int(parts[3])
-        if data.startswith("prev_month_"):
-            month -= 1
-            if month == 0:
-                month = 12
-                year -= 1
-        else:
-            month += 1
-            if month == 13:
-                month = 1
-                year += 1
-        keyboard = create_calendar(year, month)
-        await callback.message.edit_reply_markup(reply_markup=keyboard)
-        await callback.answer()
-        return
-    if data == "skip_deadline":
-        await save_edit_deadline(callback, state, None)
-        return
-    parts = data.split("_")
-    year, month, day = int(parts[1]), int(parts[2]), int(parts[3])
-    await state.update_data(date_str=f"{day:02d}.{month:02d}.{year}")
-    keyboard = create_time_picker()
-    await callback.message.edit_text("Выбери время:", reply_markup=keyboard)
-    await state.set_state(EditTask.waiting_for_deadline_time)
-
-@router.callback_query(EditTask.waiting_for_deadline_time, lambda c: c.data.startswith("time_") or c.data == "skip_deadline")
-async def process_edit_time(callback: types.CallbackQuery, state: FSMContext):
-    data = callback.data
-    if data == "skip_deadline":
-        await save_edit_deadline(callback, state, None)
-        return
-    time_str = data.split("_")[1]
-    data = await state.get_data()
-    date_str = data.get("date_str")
-    deadline = f"{date_str} {time_str}" if date_str else None
-    await save_edit_deadline(callback, state, deadline)
-
-async def save_edit_deadline(callback: types.CallbackQuery, state: FSMContext, deadline: Optional[str]):
-    data = await state.get_data()
-    task_id = data['task_id']
-    if task_manager.edit_task(task_id, deadline=deadline):
-        await callback.message.edit_text("Дедлайн обновлен!")
-    else:
-        await callback.message.edit_text("Ошибка обновления.")
-    await state.clear()
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data == "cmd_stats")
-async def stats_command(callback: types.CallbackQuery):
-    data = task_manager.get_stats(callback.from_user.id, 30)
-    plot_file = generate_stats_plot(data, callback.from_user.id)
-    if plot_file:
-        await callback.message.reply_photo(types.FSInputFile(plot_file))
-        os.remove(plot_file)
-    else:
-        await callback.message.edit_text("Нет данных для статистики.")
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data == "cmd_export")
-async def export_command(callback: types.CallbackQuery):
-    filename = task_manager.export_to_csv(callback.from_user.id)
-    if filename:
-        await callback.message.reply_document(types.FSInputFile(filename))
-        os.remove(filename)
-    else:
-        await callback.message.edit_text("Нет задач для экспорта.")
-    await callback.answer()
-
-@router.callback_query(lambda c: c.data.startswith("page_"))
-async def process_page_callback(callback: types.CallbackQuery):
-    parts = callback.data.split("_")
-    action = parts[1]
-    page = int(parts[2])
-    category = parts[3] if len(parts) > 3 else None
-    completed = 0 if action in ["view", "done", "edit_select"] else 0
-    tasks = task_manager.get_tasks(callback.from_user.id, completed=completed, category=category)
-    keyboard = KeyboardBuilder.create_task_keyboard(tasks, page, action, category)
-    await callback.message.edit_reply_markup(reply_markup=keyboard)
-    await callback.answer()
\ No newline at end of file
+from aiogram import Router, types
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.types import (InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent,
+                           ReplyKeyboardMarkup, KeyboardButton)
+from tempfile import SpooledTemporaryFile
+from typing import Optional
+from callbacks import (TASK_ACTIONS, AddSubtaskCallback, CallbackTable, CategoryCallback, CompleteCategoryCallback, DayCallback,
+                       DoneTaskCallback, EditFieldCallback, EditTaskCallback, ExportCallback, ListCallback, MonthCallback,
+                       PageCallback, ReminderLeadCallback, SearchPageCallback, SubtaskDeleteCallback, SubtaskDoneCallback,
+                       TimeCallback, ViewTaskCallback)
+from database import REMINDER_LEAD_OPTIONS, get_task_manager
+from export import EXPORT_FORMATS, SPOOL_MAX_SIZE, export_tasks
+from metrics import instrument_router, registry
+from reminders import AGENDA_HOUR, LEAD_LABELS
+from states import AddTask, EditTask, SubtaskStates
+from task_import import MAX_IMPORT_SIZE, import_tasks
+from task_calendar import create_calendar, create_time_picker, deadline_timestamp, format_deadline
+from visualizer import generate_stats_plot
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+instrument_router(router)
+# Every button press goes through this table; see the end of the module.
+callbacks = CallbackTable()
+TASKS_PER_PAGE = 5
+MAX_BATCH_TASKS = 50
+INLINE_RESULTS = 20
+MAX_SEARCH_LENGTH = 100
+task_manager = get_task_manager()
+registry.register_collector('bot_user_cache', lambda: task_manager.cache.stats)
+registry.register_collector('bot_writes', lambda: task_manager.writes.stats)
+
+class KeyboardBuilder:
+    @staticmethod
+    def create_persistent_keyboard():
+        return ReplyKeyboardMarkup(keyboard=[
+            [KeyboardButton(text="Главное меню")]
+        ], resize_keyboard=True, one_time_keyboard=False)
+
+    @staticmethod
+    def create_main_menu():
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [
+                InlineKeyboardButton(text="Добавить задачу", callback_data="cmd_add"),
+                InlineKeyboardButton(text="Список задач", callback_data="cmd_list")
+            ],
+            [
+                InlineKeyboardButton(text="Завершить задачу", callback_data="cmd_done"),
+                InlineKeyboardButton(text="Редактировать", callback_data="cmd_edit")
+            ],
+            [
+                InlineKeyboardButton(text="Статистика", callback_data="cmd_stats"),
+                InlineKeyboardButton(text="Экспорт", callback_data="cmd_export")
+            ]
+        ])
+
+    @staticmethod
+    async def create_category_keyboard(user_id, for_add=True):
+        categories = await task_manager.get_categories(user_id) or ['Общее']
+        if 'Общее' not in categories:
+            await task_manager.add_category(user_id, 'Общее')
+        keyboard = [[InlineKeyboardButton(text=cat, callback_data=CategoryCallback(name=cat).pack())] for cat in categories]
+        if for_add:
+            keyboard.append([InlineKeyboardButton(text="Новая категория", callback_data="new_category")])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    @staticmethod
+    def create_task_keyboard(tasks, action, category=None, has_prev=False, has_next=False):
+        factory = TASK_ACTIONS[action]
+        keyboard = [[InlineKeyboardButton(text=f"{task.text} ({task.category})", callback_data=factory(task_id=task.id).pack())] for task in tasks]
+        nav_row = []
+        if has_prev:
+            nav_row.append(InlineKeyboardButton(text="⬅ Назад", callback_data=PageCallback(direction="p", cursor=tasks[0].id, action=action, category=category).pack()))
+        if has_next:
+            nav_row.append(InlineKeyboardButton(text="Далее ➡", callback_data=PageCallback(direction="n", cursor=tasks[-1].id, action=action, category=category).pack()))
+        if nav_row:
+            keyboard.append(nav_row)
+        if action == "view" and category:
+            keyboard.append([InlineKeyboardButton(text="✅ Выполнить все", callback_data=CompleteCategoryCallback(category=category).pack())])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    @staticmethod
+    def create_search_keyboard(tasks, offset, has_next):
+        keyboard = [[InlineKeyboardButton(text=f"{'✅ ' if task.completed else ''}{task.text} ({task.category})", callback_data=ViewTaskCallback(task_id=task.id).pack())]
+                    for task in tasks]
+        nav_row = []
+        if offset > 0:
+            nav_row.append(InlineKeyboardButton(text="⬅ Назад", callback_data=SearchPageCallback(offset=max(0, offset - TASKS_PER_PAGE)).pack()))
+        if has_next:
+            nav_row.append(InlineKeyboardButton(text="Далее ➡", callback_data=SearchPageCallback(offset=offset + TASKS_PER_PAGE).pack()))
+        if nav_row:
+            keyboard.append(nav_row)
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    @staticmethod
+    def create_subtask_keyboard(subtasks, task_id):
+        keyboard = []
+        for id, text, completed in subtasks:
+            keyboard.append([InlineKeyboardButton(text=f"{text} {'(выполнено)' if completed else ''}", callback_data=SubtaskDoneCallback(subtask_id=id, task_id=task_id).pack())])
+        keyboard.append([InlineKeyboardButton(text="Добавить подзадачу", callback_data=AddSubtaskCallback(task_id=task_id).pack())])
+        if subtasks:
+            delete_keyboard = []
+            for id, text, _ in subtasks:
+                delete_keyboard.append(InlineKeyboardButton(text=f"Удалить {text}", callback_data=SubtaskDeleteCallback(subtask_id=id, task_id=task_id).pack()))
+                if len(delete_keyboard) == 2:
+                    keyboard.append(delete_keyboard)
+                    delete_keyboard = []
+            if delete_keyboard:
+                keyboard.append(delete_keyboard)
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    @staticmethod
+    def create_reminder_keyboard(leads, agenda):
+        keyboard = [[InlineKeyboardButton(text=f"{'✅' if lead in leads else '▫️'} за {LEAD_LABELS[lead]}", callback_data=ReminderLeadCallback(lead=lead).pack())]
+                    for lead in sorted(REMINDER_LEAD_OPTIONS, reverse=True)]
+        keyboard.append([InlineKeyboardButton(text=f"{'✅' if agenda else '▫️'} Сводка дедлайнов каждый день в {AGENDA_HOUR}:00",
+                                              callback_data="agenda_toggle")])
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    @staticmethod
+    def create_edit_field_keyboard(task_id):
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Название", callback_data=EditFieldCallback(field="text", task_id=task_id).pack())],
+            [InlineKeyboardButton(text="Категория", callback_data=EditFieldCallback(field="category", task_id=task_id).pack())],
+            [InlineKeyboardButton(text="Дедлайн", callback_data=EditFieldCallback(field="deadline", task_id=task_id).pack())]
+        ])
+
+def split_lines(text: str):
+    # One task (or subtask) per non-empty line, so a pasted list is added at once.
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+async def build_task_page(user_id, action, category=None, direction="n", cursor=0):
+    # Fetches one page plus a single look-ahead row, which tells whether there
+    # is a page further in the direction of travel without counting everything.
+    if direction == "p":
+        tasks = await task_manager.get_tasks(user_id, completed=0, category=category, limit=TASKS_PER_PAGE + 1, before_id=cursor)
+        has_prev = len(tasks) > TASKS_PER_PAGE
+        tasks = tasks[-TASKS_PER_PAGE:]
+        has_next = True
+    else:
+        tasks = await task_manager.get_tasks(user_id, completed=0, category=category, limit=TASKS_PER_PAGE + 1, after_id=cursor)
+        has_next = len(tasks) > TASKS_PER_PAGE
+        tasks = tasks[:TASKS_PER_PAGE]
+        has_prev = cursor > 0
+    if not tasks:
+        return None
+    return KeyboardBuilder.create_task_keyboard(tasks, action, category, has_prev, has_next)
+
+async def build_search_page(user_id, text, offset=0):
+    # Search results are ranked, so pages are addressed by offset; the query
+    # itself lives in the FSM data because it may not fit into callback data.
+    tasks = await task_manager.search_tasks(user_id, text, limit=TASKS_PER_PAGE + 1, offset=offset)
+    if not tasks:
+        return None
+    return KeyboardBuilder.create_search_keyboard(tasks[:TASKS_PER_PAGE], offset, len(tasks) > TASKS_PER_PAGE)
+
+@router.message(CommandStart())
+async def start_command(message: types.Message):
+    # Single message with persistent keyboard, no "Меню готово."
+    await message.reply("Привет! Нажми 'Главное меню' ниже для действий.", reply_markup=KeyboardBuilder.create_persistent_keyboard())
+
+@router.message(Command("search"))
+async def search_command(message: types.Message, command: CommandObject, state: FSMContext):
+    # Registered before the FSM steps, so /search works in the middle of a dialog too.
+    text = (command.args or "").strip()[:MAX_SEARCH_LENGTH]
+    if not text:
+        await message.reply("Использование: /search текст")
+        return
+    await state.update_data(search_query=text)
+    keyboard = await build_search_page(message.from_user.id, text)
+    if not keyboard:
+        await message.reply("Ничего не найдено.")
+        return
+    await message.reply(f"Результаты поиска «{text}»:", reply_markup=keyboard)
+
+@callbacks.register(SearchPageCallback)
+async def search_page_callback(callback: types.CallbackQuery, callback_data: SearchPageCallback, state: FSMContext):
+    text = (await state.get_data()).get("search_query")
+    keyboard = await build_search_page(callback.from_user.id, text, callback_data.offset) if text else None
+    if keyboard:
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
+
+@router.inline_query()
+async def inline_search(inline_query: types.InlineQuery):
+    offset = int(inline_query.offset or 0)
+    tasks = await task_manager.search_tasks(inline_query.from_user.id, inline_query.query[:MAX_SEARCH_LENGTH],
+                                            limit=INLINE_RESULTS + 1, offset=offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(task.id),
+            title=f"{'✅ ' if task.completed else ''}{task.text}",
+            description=f"{task.category}, дедлайн: {format_deadline(task.deadline) or 'нет'}",
+            input_message_content=InputTextMessageContent(message_text=f"📝 {task.text} ({task.category})")
+        )
+        for task in tasks[:INLINE_RESULTS]
+    ]
+    next_offset = str(offset + INLINE_RESULTS) if len(tasks) > INLINE_RESULTS else ""
+    await inline_query.answer(results, cache_time=5, is_personal=True, next_offset=next_offset)
+
+@router.message(Command("reminders"))
+async def reminders_command(message: types.Message):
+    user_id = message.from_user.id
+    leads = await task_manager.get_reminder_leads(user_id)
+    await message.reply("Когда напоминать о дедлайне? Можно выбрать несколько вариантов. "
+                        "Напоминания, которые наступают почти одновременно, приходят одним сообщением.",
+                        reply_markup=KeyboardBuilder.create_reminder_keyboard(leads, await task_manager.get_daily_agenda(user_id)))
+
+@callbacks.register(ReminderLeadCallback)
+async def toggle_reminder_lead(callback: types.CallbackQuery, callback_data: ReminderLeadCallback):
+    leads = set(await task_manager.get_reminder_leads(callback.from_user.id))
+    leads ^= {callback_data.lead}
+    if not leads:
+        await callback.answer("Нужно оставить хотя бы одно напоминание.")
+        return
+    if await task_manager.set_reminder_leads(callback.from_user.id, list(leads)):
+        agenda = await task_manager.get_daily_agenda(callback.from_user.id)
+        await callback.message.edit_reply_markup(reply_markup=KeyboardBuilder.create_reminder_keyboard(leads, agenda))
+        await callback.answer()
+    else:
+        await callback.answer("Ошибка при сохранении настроек.")
+
+@callbacks.register("agenda_toggle")
+async def toggle_agenda(callback: types.CallbackQuery):
+    user_id = callback.from_user.id
+    agenda = not await task_manager.get_daily_agenda(user_id)
+    if await task_manager.set_daily_agenda(user_id, agenda):
+        leads = await task_manager.get_reminder_leads(user_id)
+        await callback.message.edit_reply_markup(reply_markup=KeyboardBuilder.create_reminder_keyboard(leads, agenda))
+        await callback.answer("Сводка включена." if agenda else "Сводка выключена.")
+    else:
+        await callback.answer("Ошибка при сохранении настроек.")
+
+@router.message(lambda m: m.text == "Главное меню")
+async def show_main_menu(message: types.Message):
+    await message.reply("Выбери действие:", reply_markup=KeyboardBuilder.create_main_menu())
+
+@callbacks.register(ListCallback)
+async def list_by_category(callback: types.CallbackQuery, callback_data: ListCallback):
+    category = callback_data.category
+    keyboard = await build_task_page(callback.from_user.id, "view", category)
+    if not keyboard:
+        await callback.message.edit_text("Нет задач в этой категории.")
+        await callback.answer()
+        return
+    total = await task_manager.count_tasks(callback.from_user.id, completed=0, category=category)
+    await callback.message.edit_text(f"Твои задачи ({total}):", reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.register("cmd_list")
+async def cmd_list(callback: types.CallbackQuery):
+    # Handler for "Список задач" inline button
+    categories = await task_manager.get_categories(callback.from_user.id)
+    keyboard = [[InlineKeyboardButton(text="Все задачи", callback_data=ListCallback().pack())]]
+    for cat in categories:
+        keyboard.append([InlineKeyboardButton(text=cat, callback_data=ListCallback(category=cat).pack())])
+    await callback.message.edit_text("Выбери категорию:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    await callback.answer()
+
+@callbacks.register("cmd_add")
+async def add_task_command(callback: types.CallbackQuery, state: FSMContext):
+    keyboard = await KeyboardBuilder.create_category_keyboard(callback.from_user.id)
+    await callback.message.edit_text("Выбери категорию:", reply_markup=keyboard)
+    await state.set_state(AddTask.waiting_for_category)
+    await callback.answer()
+
+@callbacks.register(CategoryCallback, AddTask.waiting_for_category)
+async def process_category(callback: types.CallbackQuery, callback_data: CategoryCallback, state: FSMContext):
+    category = callback_data.name
+    await state.update_data(category=category)
+    await callback.message.edit_text("Введи название задачи:")
+    await state.set_state(AddTask.waiting_for_task)
+    await callback.answer()
+
+@callbacks.register("new_category", AddTask.waiting_for_category)
+async def new_category(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.edit_text("Введи название новой категории:")
+    await state.set_state(AddTask.waiting_for_new_category)
+    await callback.answer()
+
+@router.message(AddTask.waiting_for_new_category)
+async def process_new_category(message: types.Message, state: FSMContext):
+    category = message.text.strip()
+    if not category or len(category) > 50:
+        await message.reply("Категория не может быть пустой или слишком длинной.")
+        return
+    await task_manager.add_category(message.from_user.id, category)
+    await state.update_data(category=category)
+    await message.reply("Категория добавлена. Введи название задачи:")
+    await state.set_state(AddTask.waiting_for_task)
+
+@router.message(AddTask.waiting_for_task)
+async def process_task_input(message: types.Message, state: FSMContext):
+    texts = split_lines(message.text or "")
+    if not texts or any(len(text) > 200 for text in texts):
+        await message.reply("Название не может быть пустым или слишком длинным.")
+        return
+    if len(texts) > MAX_BATCH_TASKS:
+        await message.reply(f"Не больше {MAX_BATCH_TASKS} задач за раз.")
+        return
+    await state.update_data(texts=texts)
+    keyboard = create_calendar()
+    await message.reply("Выбери дату дедлайна:", reply_markup=keyboard)
+    await state.set_state(AddTask.waiting_for_deadline_date)
+
+@callbacks.register(MonthCallback, AddTask.waiting_for_deadline_date, EditTask.waiting_for_deadline_date)
+async def process_month(callback: types.CallbackQuery, callback_data: MonthCallback):
+    keyboard = create_calendar(callback_data.year, callback_data.month)
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.register(DayCallback, AddTask.waiting_for_deadline_date)
+async def process_date(callback: types.CallbackQuery, callback_data: DayCallback, state: FSMContext):
+    await state.update_data(date_str=f"{callback_data.day:02d}.{callback_data.month:02d}.{callback_data.year}")
+    keyboard = create_time_picker()
+    await callback.message.edit_text("Выбери время дедлайна:", reply_markup=keyboard)
+    await state.set_state(AddTask.waiting_for_deadline_time)
+
+@callbacks.register(TimeCallback, AddTask.waiting_for_deadline_time)
+async def process_time(callback: types.CallbackQuery, callback_data: TimeCallback, state: FSMContext):
+    date_str = (await state.get_data()).get("date_str")
+    deadline = deadline_timestamp(date_str, f"{callback_data.hour:02d}:{callback_data.minute:02d}") if date_str else None
+    await save_task(callback, state, deadline)
+
+@callbacks.register("skip_deadline", AddTask.waiting_for_deadline_date, AddTask.waiting_for_deadline_time)
+async def skip_deadline(callback: types.CallbackQuery, state: FSMContext):
+    await save_task(callback, state, None)
+
+async def save_task(callback: types.CallbackQuery, state: FSMContext, deadline: Optional[int]):
+    data = await state.get_data()
+    user_id = callback.from_user.id
+    # Conversations saved before multi-line input carry a single "text".
+    texts = data.get("texts") or [data.get("text")]
+    category = data.get("category")
+    if len(texts) > 1:
+        added = await task_manager.add_tasks(user_id, texts, category, deadline)
+        if added:
+            await callback.message.edit_text(f"Добавлено задач: {added} в '{category}' с дедлайном {format_deadline(deadline) or 'без'}.")
+        else:
+            await callback.message.edit_text("Ошибка добавления.")
+    elif await task_manager.add_task(user_id, texts[0], category, deadline):
+        await callback.message.edit_text(f"Задача '{texts[0]}' добавлена в '{category}' с дедлайном {format_deadline(deadline) or 'без'}.")
+    else:
+        await callback.message.edit_text("Ошибка добавления.")
+    await state.clear()
+    await callback.answer()
+
+@callbacks.register(ViewTaskCallback)
+async def view_task_callback(callback: types.CallbackQuery, callback_data: ViewTaskCallback):
+    task_id = callback_data.task_id
+    task = await task_manager.get_task(task_id, callback.from_user.id)
+    if task:
+        keyboard = KeyboardBuilder.create_subtask_keyboard(task.subtasks, task_id)
+        text = f"Задача: {task.text}\nКатегория: {task.category}\nДедлайн: {format_deadline(task.deadline) or 'Нет'}\nПодзадачи:"
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback.message.edit_text("Задача не найдена.")
+    await callback.answer()
+
+@callbacks.register(AddSubtaskCallback)
+async def add_subtask(callback: types.CallbackQuery, callback_data: AddSubtaskCallback, state: FSMContext):
+    await state.update_data(task_id=callback_data.task_id)
+    await callback.message.edit_text("Введи текст подзадачи:")
+    await state.set_state(SubtaskStates.waiting_for_subtask)
+    await callback.answer()
+
+@router.message(StateFilter(SubtaskStates.waiting_for_subtask))
+async def process_subtask_input(message: types.Message, state: FSMContext):
+    texts = split_lines(message.text or "")
+    if not texts or any(len(text) > 200 for text in texts):
+        await message.reply("Текст не может быть пустым или слишком длинным.")
+        return
+    if len(texts) > MAX_BATCH_TASKS:
+        await message.reply(f"Не больше {MAX_BATCH_TASKS} подзадач за раз.")
+        return
+    data = await state.get_data()
+    task_id = data.get("task_id")
+    if len(texts) > 1:
+        added = await task_manager.add_subtasks(task_id, message.from_user.id, texts)
+        await message.reply(f"Добавлено подзадач: {added}." if added else "Ошибка добавления.")
+    elif await task_manager.add_subtask(task_id, message.from_user.id, texts[0]):
+        await message.reply("Подзадача добавлена.")
+    else:
+        await message.reply("Ошибка добавления.")
+    await state.clear()
+
+@callbacks.register(SubtaskDoneCallback)
+async def complete_subtask(callback: types.CallbackQuery, callback_data: SubtaskDoneCallback):
+    sub_id = callback_data.subtask_id
+    task_id = callback_data.task_id
+    if not await task_manager.complete_subtask(sub_id, task_id, callback.from_user.id):
+        await callback.answer("Подзадача не найдена.")
+        return
+    task = await task_manager.get_task(task_id, callback.from_user.id)
+    if not task:
+        await callback.answer("Задача не найдена.")
+        return
+    keyboard = KeyboardBuilder.create_subtask_keyboard(task.subtasks, task_id)
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer("Подзадача обновлена.")
+
+@callbacks.register(SubtaskDeleteCallback)
+async def delete_subtask(callback: types.CallbackQuery, callback_data: SubtaskDeleteCallback):
+    sub_id = callback_data.subtask_id
+    task_id = callback_data.task_id
+    task = await task_manager.get_task(task_id, callback.from_user.id)
+    if task and await task_manager.delete_subtask(sub_id, task_id, callback.from_user.id):
+        keyboard = KeyboardBuilder.create_subtask_keyboard([sub for sub in task.subtasks if sub[0] != sub_id], task_id)
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
+        await callback.answer("Подзадача удалена.")
+    else:
+        await callback.answer("Ошибка удаления.")
+
+@callbacks.register("cmd_done")
+async def done_task_command(callback: types.CallbackQuery):
+    keyboard = await build_task_page(callback.from_user.id, "done")
+    if not keyboard:
+        await callback.message.edit_text("Нет активных задач.")
+        await callback.answer()
+        return
+    await callback.message.edit_text("Выбери задачу для завершения:", reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.register(DoneTaskCallback)
+async def process_done_callback(callback: types.CallbackQuery, callback_data: DoneTaskCallback):
+    if await task_manager.complete_task(callback_data.task_id, callback.from_user.id):
+        await callback.message.edit_text("Задача завершена!")
+    else:
+        await callback.message.edit_text("Ошибка.")
+    await callback.answer()
+
+@callbacks.register(CompleteCategoryCallback)
+async def process_complete_category(callback: types.CallbackQuery, callback_data: CompleteCategoryCallback):
+    category = callback_data.category
+    completed = await task_manager.complete_category(callback.from_user.id, category)
+    await callback.message.edit_text(f"Выполнено задач в '{category}': {completed}.")
+    await callback.answer()
+
+@callbacks.register("cmd_edit")
+async def edit_task_command(callback: types.CallbackQuery, state: FSMContext):
+    keyboard = await build_task_page(callback.from_user.id, "edit")
+    if not keyboard:
+        await callback.message.edit_text("Нет активных задач.")
+        await callback.answer()
+        return
+    await callback.message.edit_text("Выбери задачу для редактирования:", reply_markup=keyboard)
+    await state.set_state(EditTask.waiting_for_task)
+    await callback.answer()
+
+@callbacks.register(EditTaskCallback, EditTask.waiting_for_task)
+async def select_edit_task(callback: types.CallbackQuery, callback_data: EditTaskCallback, state: FSMContext):
+    task_id = callback_data.task_id
+    await state.update_data(task_id=task_id)
+    keyboard = KeyboardBuilder.create_edit_field_keyboard(task_id)
+    await callback.message.edit_text("Что редактировать?", reply_markup=keyboard)
+    await state.set_state(EditTask.waiting_for_field)
+    await callback.answer()
+
+@callbacks.register(EditFieldCallback, EditTask.waiting_for_field)
+async def process_edit_field(callback: types.CallbackQuery, callback_data: EditFieldCallback, state: FSMContext):
+    field = callback_data.field
+    await state.update_data(field=field)
+    if field == "text":
+        await callback.message.edit_text("Введи новое название:")
+        await state.set_state(EditTask.waiting_for_new_value)
+    elif field == "category":
+        keyboard = await KeyboardBuilder.create_category_keyboard(callback.from_user.id, for_add=False)
+        await callback.message.edit_text("Выбери новую категорию:", reply_markup=keyboard)
+        await state.set_state(EditTask.waiting_for_new_category)
+    elif field == "deadline":
+        keyboard = create_calendar()
+        await callback.message.edit_text("Выбери новую дату:", reply_markup=keyboard)
+        await state.set_state(EditTask.waiting_for_deadline_date)
+    await callback.answer()
+
+@router.message(EditTask.waiting_for_new_value)
+async def process_new_value(message: types.Message, state: FSMContext):
+    value = message.text.strip()
+    if not value or len(value) > 200:
+        await message.reply("Значение не может быть пустым или слишком длинным.")
+        return
+    data = await state.get_data()
+    task_id = data['task_id']
+    field = data['field']
+    edit_kwargs = {field: value}
+    if await task_manager.edit_task(task_id, message.from_user.id, **edit_kwargs):
+        await message.reply("Задача обновлена!")
+    else:
+        await message.reply("Ошибка обновления.")
+    await state.clear()
+
+@callbacks.register(CategoryCallback, EditTask.waiting_for_new_category)
+async def process_new_category_edit(callback: types.CallbackQuery, callback_data: CategoryCallback, state: FSMContext):
+    category = callback_data.name
+    data = await state.get_data()
+    task_id = data['task_id']
+    if await task_manager.edit_task(task_id, callback.from_user.id, category=category):
+        await callback.message.edit_text("Категория обновлена!")
+    else:
+        await callback.message.edit_text("Ошибка.")
+    await state.clear()
+    await callback.answer()
+
+@callbacks.register(DayCallback, EditTask.waiting_for_deadline_date)
+async def process_edit_date(callback: types.CallbackQuery, callback_data: DayCallback, state: FSMContext):
+    await state.update_data(date_str=f"{callback_data.day:02d}.{callback_data.month:02d}.{callback_data.year}")
+    keyboard = create_time_picker()
+    await callback.message.edit_text("Выбери время:", reply_markup=keyboard)
+    await state.set_state(EditTask.waiting_for_deadline_time)
+
+@callbacks.register(TimeCallback, EditTask.waiting_for_deadline_time)
+async def process_edit_time(callback: types.CallbackQuery, callback_data: TimeCallback, state: FSMContext):
+    date_str = (await state.get_data()).get("date_str")
+    deadline = deadline_timestamp(date_str, f"{callback_data.hour:02d}:{callback_data.minute:02d}") if date_str else None
+    await save_edit_deadline(callback, state, deadline)
+
+@callbacks.register("skip_deadline", EditTask.waiting_for_deadline_date, EditTask.waiting_for_deadline_time)
+async def skip_edit_deadline(callback: types.CallbackQuery, state: FSMContext):
+    await save_edit_deadline(callback, state, None)
+
+async def save_edit_deadline(callback: types.CallbackQuery, state: FSMContext, deadline: Optional[int]):
+    data = await state.get_data()
+    task_id = data['task_id']
+    if await task_manager.edit_task(task_id, callback.from_user.id, deadline=deadline):
+        await callback.message.edit_text("Дедлайн обновлен!")
+    else:
+        await callback.message.edit_text("Ошибка обновления.")
+    await state.clear()
+    await callback.answer()
+
+@callbacks.register("cmd_stats")
+async def stats_command(callback: types.CallbackQuery):
+    data = await task_manager.get_stats(callback.from_user.id, 30)
+    plot = await generate_stats_plot(data, callback.from_user.id)
+    if plot:
+        await callback.message.reply_photo(types.BufferedInputFile(plot, filename="stats.png"))
+    else:
+        await callback.message.edit_text("Нет данных для статистики.")
+    await callback.answer()
+
+@callbacks.register("cmd_export")
+async def export_command(callback: types.CallbackQuery):
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="CSV", callback_data=ExportCallback(fmt="csv", compressed=False).pack()),
+            InlineKeyboardButton(text="JSONL", callback_data=ExportCallback(fmt="jsonl", compressed=False).pack()),
+            InlineKeyboardButton(text="CSV (gzip)", callback_data=ExportCallback(fmt="csv", compressed=True).pack())
+        ]
+    ])
+    await callback.message.edit_text("Выбери формат экспорта:\n\nЧтобы импортировать задачи, пришли файл CSV, JSON или JSONL в том же формате.", reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.register(ExportCallback)
+async def export_format_callback(callback: types.CallbackQuery, callback_data: ExportCallback):
+    if callback_data.fmt not in EXPORT_FORMATS:
+        await callback.answer()
+        return
+    document = await export_tasks(task_manager, callback.from_user.id, callback_data.fmt, callback_data.compressed)
+    if document:
+        try:
+            await callback.message.reply_document(document)
+        finally:
+            document.close()
+    else:
+        await callback.message.edit_text("Нет задач для экспорта.")
+    await callback.answer()
+
+@router.message(lambda m: m.document is not None)
+async def import_document(message: types.Message):
+    document = message.document
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await message.reply(f"Файл слишком большой, максимум {MAX_IMPORT_SIZE // (1024 * 1024)} МБ.")
+        return
+    status = await message.reply("Импорт начат...")
+
+    async def report(stats):
+        await status.edit_text(f"Импорт: обработано {stats['rows']} строк, добавлено {stats['added']}.")
+
+    with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as file:
+        await message.bot.download(document, destination=file)
+        stats = await import_tasks(task_manager, message.from_user.id, file, report)
+    if stats['error'] and not stats['rows']:
+        await status.edit_text("Ошибка импорта: не удалось разобрать файл.")
+        return
+    if stats['error']:
+        await status.edit_text(f"Импорт прерван из-за ошибки: добавлено {stats['added']}, дубликатов {stats['duplicates']}, "
+                               f"пропущено некорректных строк {stats['invalid']}. Остаток файла не загружен.")
+        return
+    await status.edit_text(f"Импорт завершён: добавлено {stats['added']}, дубликатов {stats['duplicates']}, "
+                           f"пропущено некорректных строк {stats['invalid']}.")
+
+@callbacks.register(PageCallback)
+async def process_page_callback(callback: types.CallbackQuery, callback_data: PageCallback):
+    if callback_data.action not in TASK_ACTIONS:
+        await callback.answer()
+        return
+    keyboard = await build_task_page(callback.from_user.id, callback_data.action, callback_data.category,
+                                     callback_data.direction, callback_data.cursor)
+    if keyboard:
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
+
+@callbacks.register("ignore")
+async def ignore_callback(callback: types.CallbackQuery):
+    # Calendar headers, weekdays and past days.
+    await callback.answer()
+
+# Registered last, after every callbacks.register above has run.
+router.callback_query()(callbacks.dispatch)
\ No newline at end of file
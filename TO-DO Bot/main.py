@@ -1,23 +1,37 @@
-from aiogram import Bot, Dispatcher
-from handlers import router
-from scheduler import SchedulerManager
-import logging
-import asyncio
-
-logging.basicConfig(level=logging.INFO)
-
-API_TOKEN = 'YOUR TOKEN'
-
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
-
-async def main():
-    dp.include_router(router)
-    logging.info("Router registered successfully.")
-    scheduler_manager = SchedulerManager(bot)
-    scheduler_manager.start()
-    logging.info("Scheduler initialized.")
-    await dp.start_polling(bot)
-
-if __name__ == '__main__':
+from aiogram import Bot, Dispatcher
+from handlers import router
+from scheduler import SchedulerManager
+from outbound import OutboundQueue, RateLimitMiddleware
+from fsm_storage import SQLiteStorage
+from metrics import registry, start_metrics_server
+import logging
+import asyncio
+
+logging.basicConfig(level=logging.INFO)
+
+API_TOKEN = 'YOUR TOKEN'
+
+bot = Bot(token=API_TOKEN)
+rate_limiter = RateLimitMiddleware()
+bot.session.middleware(rate_limiter)
+registry.register_collector('bot_requests', lambda: rate_limiter.metrics)
+# Unfinished /add and /edit conversations survive restarts.
+dp = Dispatcher(storage=SQLiteStorage())
+
+async def main():
+    dp.include_router(router)
+    logging.info("Router registered successfully.")
+    outbound = OutboundQueue(bot)
+    outbound.start()
+    registry.register_collector('bot_outbound', lambda: outbound.metrics)
+    await start_metrics_server()
+    # Every write goes through this process, so the timer never has to poll
+    # for deadline changes.
+    scheduler_manager = SchedulerManager(bot, outbound, change_poll_interval=None)
+    scheduler_manager.start()
+    registry.register_collector('bot_reminders', lambda: scheduler_manager.metrics)
+    logging.info("Scheduler initialized.")
+    await dp.start_polling(bot)
+
+if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
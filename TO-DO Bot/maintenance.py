@@ -0,0 +1,33 @@
+from database import DB_PATH, TaskManager
+import argparse
+import asyncio
+import logging
+import sys
+
+logging.basicConfig(level=logging.INFO)
+
+async def rebuild_stats(task_manager: TaskManager) -> int:
+    return 0 if await task_manager.rebuild_daily_stats() else 1
+
+async def check_stats(task_manager: TaskManager) -> int:
+    mismatches = await task_manager.check_daily_stats()
+    for source, user_id, category, day, total, completed in mismatches:
+        print(f"{source}: user {user_id}, category '{category}', day {day}: total={total}, completed={completed}")
+    print(f"{len(mismatches)} mismatching rows")
+    return 1 if mismatches else 0
+
+COMMANDS = {'rebuild-stats': rebuild_stats, 'check-stats': check_stats}
+
+async def main(command: str, db_path: str) -> int:
+    task_manager = TaskManager(db_path)
+    try:
+        return await COMMANDS[command](task_manager)
+    finally:
+        task_manager.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Database maintenance for the TO-DO bot.')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.command, args.db)))
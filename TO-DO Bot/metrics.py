@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9100
+METRICS_PATH = '/metrics'
+# Seconds; from a cached read up to a slow plot render.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Histogram:
+    """Latency histogram per label set, rendered in the Prometheus text format.
+
+    observe() only bumps a bucket counter, so it is cheap enough for every
+    query; it may be called from the DB thread as well as the event loop.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], List] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # Bucket counts, then sum and count.
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self.series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {count}')
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        # Existing counters dicts (outbound, cache, worker pool) are exported
+        # as gauges under a prefix instead of being duplicated.
+        self.collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help, labels, buckets)
+        return self.histograms[name]
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, Any]]):
+        self.collectors[prefix] = collect
+
+    def render(self) -> str:
+        lines = []
+        for histogram in self.histograms.values():
+            lines.extend(histogram.render())
+        for prefix, collect in self.collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", prefix, e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+handler_seconds = registry.histogram('bot_handler_seconds', 'Time spent in router handlers.', ('event', 'handler', 'status'))
+db_query_seconds = registry.histogram('bot_db_query_seconds', 'TaskManager query time on the DB thread.', ('method',))
+operation_seconds = registry.histogram('bot_operation_seconds', 'Time of background and rendering operations.', ('operation',))
+
+def timed(histogram: Histogram, *labels: str):
+    # Times a coroutine function or a plain function into histogram.
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, *labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+class HandlerMetricsMiddleware:
+    """Inner router middleware timing every handler that matched an event.
+
+    aiogram accepts any callable with this signature, so the module needs
+    neither aiogram nor aiohttp at import time and database.py can use it.
+    """
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        callback = getattr(data.get('handler'), 'callback', None)
+        if getattr(callback, 'times_itself', False):
+            return await handler(event, data)
+        name = getattr(callback, '__name__', 'unknown')
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            result = await handler(event, data)
+            status = 'ok'
+            return result
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, self.event, name, status)
+
+def instrument_router(router, events: Tuple[str, ...] = ('message', 'callback_query', 'inline_query')):
+    for event in events:
+        getattr(router, event).middleware(HandlerMetricsMiddleware(event))
+
+async def handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+def add_metrics_route(app, path: str = METRICS_PATH):
+    app.router.add_get(path, handle_metrics)
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    # A separate local listener for polling mode and for webhook workers,
+    # which have no HTTP server of their own. Returns the runner, or None.
+    from aiohttp import web
+
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error("Failed to start metrics server on %s:%s: %s", host, port, e)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics served on http://%s:%s%s", host, port, METRICS_PATH)
+    return runner
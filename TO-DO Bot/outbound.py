@@ -0,0 +1,145 @@
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from typing import Dict, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per second
+# in a single chat; the per-chat bucket tolerates a short burst on top of that.
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+MAX_IN_FLIGHT = 20
+MAX_RETRIES = 3
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # Takes a token, possibly going into debt, and returns how long the
+        # caller has to wait before the token is actually available.
+        self.refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        # The next reservation will have to wait at least `seconds`.
+        self.refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_idle(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Throttles every Bot API call made through the session and retries on flood control."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST,
+                 max_in_flight: int = MAX_IN_FLIGHT, max_retries: int = MAX_RETRIES):
+        # No burst allowance on the global bucket: with a capacity of one
+        # second's worth, a full bucket plus its refill let about twice the
+        # limit through in the first second after startup or an idle spell.
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.max_retries = max_retries
+        self.metrics = {'requests': 0, 'retries': 0, 'failures': 0, 'throttled_seconds': 0.0, 'in_flight': 0}
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def throttle(self, chat_id: Optional[int]):
+        delay = self.chat_bucket(chat_id).reserve() if isinstance(chat_id, int) else 0.0
+        delay = max(delay, self.global_bucket.reserve())
+        if delay:
+            self.metrics['throttled_seconds'] += delay
+            await asyncio.sleep(delay)
+
+    async def __call__(self, make_request, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, 'chat_id', None)
+        attempt = 0
+        while True:
+            await self.throttle(chat_id)
+            async with self.semaphore:
+                self.metrics['requests'] += 1
+                self.metrics['in_flight'] += 1
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    if attempt >= self.max_retries:
+                        self.metrics['failures'] += 1
+                        raise
+                    attempt += 1
+                    self.metrics['retries'] += 1
+                    logger.warning("Flood control on %s, retrying in %ss", type(method).__name__, e.retry_after)
+                    if isinstance(chat_id, int):
+                        self.chat_bucket(chat_id).pause(e.retry_after)
+                    else:
+                        self.global_bucket.pause(e.retry_after)
+                except Exception:
+                    self.metrics['failures'] += 1
+                    raise
+                finally:
+                    self.metrics['in_flight'] -= 1
+
+class OutboundQueue:
+    """Bounded queue of outgoing Bot API calls served by a fixed pool of workers."""
+
+    def __init__(self, bot: Bot, workers: int = MAX_IN_FLIGHT, maxsize: int = 10000):
+        self.bot = bot
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.worker_tasks = []
+        self.metrics = {'queued': 0, 'sent': 0, 'failed': 0}
+
+    def start(self):
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        logger.info("Outbound queue started with %s workers.", self.workers)
+
+    async def stop(self):
+        await self.queue.join()
+        for worker in self.worker_tasks:
+            worker.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    async def submit(self, method: TelegramMethod) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((method, future))
+        self.metrics['queued'] += 1
+        return future
+
+    async def worker(self):
+        while True:
+            method, future = await self.queue.get()
+            try:
+                result = await self.bot(method)
+                self.metrics['sent'] += 1
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.metrics['failed'] += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
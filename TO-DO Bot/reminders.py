@@ -0,0 +1,127 @@
+from database import Task
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import heapq
+import itertools
+
+# Local hour of the daily agenda for users who turned it on.
+AGENDA_HOUR = 9
+# Lead time choices as shown in /reminders.
+LEAD_LABELS = {300: "5 минут", 900: "15 минут", 3600: "1 час", 10800: "3 часа", 86400: "1 день"}
+
+def plural(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+def format_duration(seconds: float) -> str:
+    # Rounded to whole minutes, at least one; "1 день 3 часа", "15 минут".
+    minutes = max(1, round(seconds / 60))
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if days:
+        parts.append(f"{days} {plural(days, 'день', 'дня', 'дней')}")
+    if hours:
+        parts.append(f"{hours} {plural(hours, 'час', 'часа', 'часов')}")
+    if minutes:
+        parts.append(f"{minutes} {plural(minutes, 'минуту', 'минуты', 'минут')}")
+    return ' '.join(parts)
+
+class ReminderTimer:
+    """Upcoming reminders in a heap ordered by the time they are due.
+
+    The scheduler sleeps until next_due() and pops what is due then, so a
+    reminder goes out at its exact time and nothing runs in between. Tasks
+    are armed with a version; re-arming a task bumps it, which turns the
+    entries already in the heap stale without searching for them.
+
+    A reminder whose time has already passed when its task is armed (the task
+    was added or moved close to its deadline, or the bot was down) is sent at
+    once, but only for the task's shortest lead that has passed: nobody wants
+    the "1 day" and "1 hour" reminders of a task due in 20 minutes.
+    """
+
+    def __init__(self):
+        # (due_at, task_id, lead, version, task)
+        self.heap: List[Tuple[int, int, int, int, Task]] = []
+        # task_id -> (version, user_id, deadline)
+        self.armed: Dict[int, Tuple[int, int, int]] = {}
+        self.versions = itertools.count(1)
+
+    def add(self, reminders: Iterable[Tuple[Task, int, bool]], now: float):
+        by_task: Dict[int, List[Tuple[Task, int, bool]]] = {}
+        for reminder in reminders:
+            by_task.setdefault(reminder[0].id, []).append(reminder)
+        for task_id, task_reminders in by_task.items():
+            task = task_reminders[0][0]
+            armed = self.armed.get(task_id)
+            if armed is None or armed[2] != task.deadline:
+                armed = self.armed[task_id] = (next(self.versions), task.user_id, task.deadline)
+            passed = [lead for _, lead, _ in task_reminders if task.deadline - lead <= now]
+            shortest_passed = min(passed, default=None)
+            for task, lead, sent in task_reminders:
+                due_at = task.deadline - lead
+                if sent or (due_at <= now and lead != shortest_passed):
+                    continue
+                heapq.heappush(self.heap, (max(due_at, int(now)), task_id, lead, armed[0], task))
+
+    def rearm(self, task_ids: Iterable[int], user_ids: Iterable[int], reminders: Iterable[Tuple[Task, int, bool]], now: float):
+        # Replaces whatever was armed for the tasks and users with reminders.
+        for task_id in task_ids:
+            self.armed.pop(task_id, None)
+        user_ids = set(user_ids)
+        if user_ids:
+            for task_id in [task_id for task_id, (_, user_id, _) in self.armed.items() if user_id in user_ids]:
+                del self.armed[task_id]
+        self.add(reminders, now)
+
+    def is_stale(self, entry) -> bool:
+        armed = self.armed.get(entry[1])
+        return armed is None or armed[0] != entry[3]
+
+    def next_due(self) -> Optional[int]:
+        while self.heap and self.is_stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def retry(self, task: Task, lead: int, at: float) -> bool:
+        # Puts back a reminder that was popped but could not be sent, due at
+        # at; False if its task was dropped or its deadline moved meanwhile.
+        armed = self.armed.get(task.id)
+        if armed is None or armed[2] != task.deadline:
+            return False
+        heapq.heappush(self.heap, (int(at), task.id, lead, armed[0], task))
+        return True
+
+    def pop_due(self, now: float) -> List[Tuple[Task, int]]:
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if not self.is_stale(entry):
+                due.append((entry[4], entry[2]))
+        return due
+
+    def pop_ahead(self, user_ids: Set[int], until: float) -> List[Tuple[Task, int]]:
+        # Reminders of the given users due up to until, taken out early so they
+        # can share a message with the ones that are due now.
+        taken, kept = [], []
+        while self.heap and self.heap[0][0] <= until:
+            entry = heapq.heappop(self.heap)
+            if not self.is_stale(entry):
+                (taken if entry[4].user_id in user_ids else kept).append(entry)
+        for entry in kept:
+            heapq.heappush(self.heap, entry)
+        return [(entry[4], entry[2]) for entry in taken]
+
+    def forget(self, now: float):
+        # Tasks past their deadline have nothing left to remind of.
+        for task_id in [task_id for task_id, (_, _, deadline) in self.armed.items() if deadline <= now]:
+            del self.armed[task_id]
+        if len(self.heap) > 2 * len(self.armed) + 1000:
+            self.heap = [entry for entry in self.heap if not self.is_stale(entry)]
+            heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
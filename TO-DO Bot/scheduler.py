@@ -1,31 +1,254 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from database import TaskManager
-from aiogram import Bot
-import logging
-from datetime import datetime, timedelta
-
-logger = logging.getLogger(__name__)
-
-class SchedulerManager:
-    def __init__(self, bot: Bot):
-        self.scheduler = AsyncIOScheduler()
-        self.bot = bot
-        self.task_manager = TaskManager()
-
-    async def check_deadlines(self):
-        try:
-            users = set(task.user_id for task in self.task_manager.get_all_incomplete_tasks())
-            for user_id in users:
-                tasks = [task for task in self.task_manager.get_tasks(user_id, completed=0) if task.deadline]
-                for task in tasks:
-                    deadline_time = datetime.strptime(task.deadline, '%d.%m.%Y %H:%M')
-                    if deadline_time <= datetime.now() + timedelta(minutes=15) and deadline_time > datetime.now():
-                        await self.bot.send_message(user_id, f'⏰ Уведомление: Задача "{task.text}" в категории "{task.category}" истекает через 15 минут! Дедлайн: {task.deadline}')
-                        logger.info(f"Sent deadline reminder for task {task.id} to user {user_id}")
-        except Exception as e:
-            logger.error(f"Error in check_deadlines: {e}")
-
-    def start(self):
-        self.scheduler.add_job(self.check_deadlines, 'interval', minutes=1, misfire_grace_time=30)
-        self.scheduler.start()
-        logger.info("Scheduler started.")
\ No newline at end of file
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from database import REMINDER_LEAD_OPTIONS, Task, TaskManager, get_task_manager
+from aiogram import Bot
+from aiogram.methods import SendMessage
+from metrics import operation_seconds, timed
+from outbound import OutboundQueue
+from reminders import AGENDA_HOUR, ReminderTimer, format_duration
+from task_calendar import format_deadline
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Reminders are read into the timer this many seconds ahead.
+REMINDER_HORIZON = 3600
+# How often deadline changes made by other processes (webhook workers) are
+# picked up; changes made through this process's TaskManager wake the timer
+# at once, so a single-process bot can pass change_poll_interval=None.
+CHANGE_POLL_INTERVAL = 5
+CHANGE_BATCH_SIZE = 1000
+# Reminders of a user due this many seconds after one that is due now are
+# sent early, in the same message; 0 sends one message per reminder.
+DIGEST_WINDOW = 60
+# A reminder whose message failed is retried after REMINDER_RETRY_DELAY
+# seconds, twice as long after every further failure up to
+# REMINDER_RETRY_MAX_DELAY, for as long as its deadline is ahead.
+REMINDER_RETRY_DELAY = 30
+REMINDER_RETRY_MAX_DELAY = 300
+# Users whose daily agenda failed to send get it again this many seconds
+# later, at most AGENDA_RETRIES times.
+AGENDA_RETRY_DELAY = 300
+AGENDA_RETRIES = 3
+# A failed read of reminders or deadline changes is tried again this soon.
+READ_RETRY_DELAY = 5
+MAX_MESSAGE_LENGTH = 4096
+
+def split_message(title: str, items: List[Tuple[object, str]]) -> List[Tuple[List[object], str]]:
+    # Packs (item, line) pairs under title into messages within Telegram's
+    # length limit; returns the items of each message with its text.
+    messages = []
+    chunk, text = [], title
+    for item, line in items:
+        if chunk and len(text) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+            messages.append((chunk, text))
+            chunk, text = [], title
+        chunk.append(item)
+        text = f'{text}\n{line}'[:MAX_MESSAGE_LENGTH]
+    if chunk:
+        messages.append((chunk, text))
+    return messages
+
+class SchedulerManager:
+    def __init__(self, bot: Bot, outbound: OutboundQueue, task_manager: Optional[TaskManager] = None,
+                 clock: Callable[[], float] = time.time, change_poll_interval: Optional[float] = CHANGE_POLL_INTERVAL,
+                 digest_window: float = DIGEST_WINDOW):
+        self.scheduler = AsyncIOScheduler()
+        self.bot = bot
+        self.outbound = outbound
+        self.task_manager = task_manager or get_task_manager()
+        self.clock = clock
+        self.change_poll_interval = change_poll_interval
+        self.digest_window = digest_window
+        # Identifies this scheduler in the reminders ledger, so several instances
+        # sharing one database never deliver the same reminder twice.
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.timer = ReminderTimer()
+        # Reminders due up to loaded_until are in the timer; None until the
+        # first check_deadlines.
+        self.loaded_until: Optional[int] = None
+        self.change_seq = 0
+        self.wakeup = asyncio.Event()
+        self.task_manager.write_listeners.append(lambda user_id: self.wakeup.set())
+        self.runner: Optional[asyncio.Task] = None
+        # (task_id, deadline, lead) -> failed sends so far, for the backoff.
+        self.failures: Dict[Tuple[int, int, int], int] = {}
+        # messages_saved is reminders delivered minus the messages it took to
+        # deliver them.
+        self.metrics = {'reminders': 0, 'reminder_messages': 0, 'agenda_tasks': 0, 'agenda_messages': 0, 'messages_saved': 0}
+
+    @timed(operation_seconds, 'check_deadlines')
+    async def check_deadlines(self, now: Optional[float] = None) -> float:
+        # One step of the reminder timer: picks up deadline changes, reads the
+        # next window when the loaded one runs out and sends what is due.
+        # Returns the time it has to run again.
+        now = self.clock() if now is None else now
+        try:
+            if self.loaded_until is None:
+                # Changes from here on are applied on top of the first window.
+                self.change_seq = await self.task_manager.last_deadline_change()
+                await self.load_window(int(now) - max(REMINDER_LEAD_OPTIONS), now)
+            else:
+                await self.apply_changes(now)
+                if now >= self.loaded_until:
+                    await self.load_window(self.loaded_until, now)
+            due = self.timer.pop_due(now)
+            if due and self.digest_window:
+                due += self.timer.pop_ahead({task.user_id for task, _ in due}, now + self.digest_window)
+            await self.send_reminders(due, now)
+        except Exception as e:
+            logger.error("Error in check_deadlines: %s", e)
+        wake = self.loaded_until if self.loaded_until and self.loaded_until > now else now + READ_RETRY_DELAY
+        if self.change_poll_interval is not None:
+            wake = min(wake, now + self.change_poll_interval)
+        next_due = self.timer.next_due()
+        return wake if next_due is None else min(wake, next_due)
+
+    async def load_window(self, start: int, now: float):
+        # On a failed read loaded_until stays where it is, so the same window
+        # is read again on the next step.
+        end = int(now) + REMINDER_HORIZON
+        reminders = await self.task_manager.get_upcoming_reminders(start, end, int(now))
+        if reminders is None:
+            return
+        self.timer.forget(now)
+        self.timer.add(reminders, now)
+        self.loaded_until = end
+        await self.task_manager.prune_deadline_changes(int(now) - REMINDER_HORIZON)
+
+    async def apply_changes(self, now: float):
+        while changes := await self.task_manager.get_deadline_changes(self.change_seq, CHANGE_BATCH_SIZE):
+            task_ids = {task_id for _, task_id, _ in changes if task_id is not None}
+            user_ids = {user_id for _, task_id, user_id in changes if task_id is None}
+            reminders = await self.task_manager.get_task_reminders(task_ids, user_ids, int(now), self.loaded_until)
+            if reminders is None:
+                # The tasks keep what is armed for them; the changes are
+                # applied again on the next step.
+                break
+            self.change_seq = changes[-1][0]
+            self.timer.rearm(task_ids, user_ids, reminders, now)
+            if len(changes) < CHANGE_BATCH_SIZE:
+                break
+
+    async def send_reminders(self, due: List[Tuple[Task, int]], now: float):
+        # One message per user with everything of theirs that is due, split
+        # only where Telegram's length limit requires it. A task listed with
+        # several leads at once gets one line.
+        if not due:
+            return
+        claimed = await self.task_manager.claim_reminders(due, self.instance_id)
+        if claimed is None:
+            # Nothing was claimed; the reminders were popped off the timer
+            # already, so they go back into it.
+            self.retry(due, now)
+            return
+        by_user: Dict[int, Dict[int, Tuple[Task, List[int]]]] = {}
+        for task, lead in claimed:
+            by_user.setdefault(task.user_id, {}).setdefault(task.id, (task, []))[1].append(lead)
+        pending = []
+        for user_id, tasks in by_user.items():
+            for chunk, text in self.format_reminders(sorted(tasks.values(), key=lambda item: item[0].deadline), now):
+                pending.append((chunk, await self.outbound.submit(SendMessage(chat_id=user_id, text=text))))
+        for chunk, future in pending:
+            reminders = [(task, lead) for task, leads in chunk for lead in leads]
+            try:
+                await future
+            except Exception as e:
+                logger.error("Failed to send %s reminders to user %s: %s", len(reminders), chunk[0][0].user_id, e)
+                for task, lead in reminders:
+                    await self.task_manager.release_reminder(task.id, task.deadline, lead, self.instance_id)
+                self.retry(reminders, now)
+                continue
+            for task, lead in reminders:
+                await self.task_manager.mark_reminder_sent(task.id, task.deadline, lead, self.instance_id)
+                self.failures.pop((task.id, task.deadline, lead), None)
+            self.metrics['reminders'] += len(reminders)
+            self.metrics['reminder_messages'] += 1
+            self.metrics['messages_saved'] += len(reminders) - 1
+            logger.info("Sent %s deadline reminders to user %s", len(reminders), chunk[0][0].user_id)
+
+    def retry(self, reminders: List[Tuple[Task, int]], now: float):
+        # The window these reminders are due in is already loaded and is never
+        # read again, so released reminders go back into the timer, with a
+        # backoff; a digest's reminders come due together again.
+        for task, lead in reminders:
+            key = (task.id, task.deadline, lead)
+            failures = self.failures[key] = self.failures.get(key, 0) + 1
+            at = now + min(REMINDER_RETRY_DELAY * 2 ** (failures - 1), REMINDER_RETRY_MAX_DELAY)
+            if at >= task.deadline:
+                logger.warning("Giving up on the reminder of task %s after %s failed sends.", task.id, failures)
+            elif self.timer.retry(task, lead, at):
+                continue
+            # Past the deadline, or the task was re-armed with its new state.
+            del self.failures[key]
+
+    @staticmethod
+    def format_reminders(tasks: List[Tuple[Task, List[int]]], now: float) -> List[Tuple[List[Tuple[Task, List[int]]], str]]:
+        if len(tasks) == 1:
+            task = tasks[0][0]
+            return [(tasks, f'⏰ Уведомление: Задача "{task.text}" в категории "{task.category}" истекает через '
+                            f'{format_duration(task.deadline - now)}! Дедлайн: {format_deadline(task.deadline)}')]
+        lines = [f'• "{task.text}" в категории "{task.category}": через {format_duration(task.deadline - now)}, '
+                 f'дедлайн {format_deadline(task.deadline)}' for task, _ in tasks]
+        return split_message('⏰ Скоро дедлайны:', list(zip(tasks, lines)))
+
+    @timed(operation_seconds, 'send_agenda')
+    async def send_agenda(self, attempt: int = 0):
+        # Today's and tomorrow morning's deadlines, one message per user. A
+        # retry only reaches the users whose claim was released.
+        now = datetime.now()
+        day = int(now.strftime('%Y%m%d'))
+        tasks_by_user: Dict[int, List[Task]] = {}
+        for task in await self.task_manager.get_agenda(int(now.timestamp()), int(now.timestamp()) + 86400):
+            tasks_by_user.setdefault(task.user_id, []).append(task)
+        pending = []
+        for user_id in await self.task_manager.claim_agenda(list(tasks_by_user), day):
+            lines = [f'• {format_deadline(task.deadline)}: "{task.text}" ({task.category})' for task in tasks_by_user[user_id]]
+            for chunk, text in split_message('📋 Дедлайны на ближайшие сутки:', list(zip(tasks_by_user[user_id], lines))):
+                pending.append((user_id, chunk, await self.outbound.submit(SendMessage(chat_id=user_id, text=text))))
+        failed = set()
+        for user_id, chunk, future in pending:
+            try:
+                await future
+            except Exception as e:
+                logger.error("Failed to send agenda to user %s: %s", user_id, e)
+                failed.add(user_id)
+                continue
+            self.metrics['agenda_tasks'] += len(chunk)
+            self.metrics['agenda_messages'] += 1
+        for user_id in failed:
+            await self.task_manager.release_agenda(user_id, day)
+        if failed and attempt < AGENDA_RETRIES:
+            self.scheduler.add_job(self.send_agenda, 'date', run_date=now + timedelta(seconds=AGENDA_RETRY_DELAY), args=[attempt + 1])
+        elif failed:
+            logger.warning("Giving up on the daily agenda of %s users.", len(failed))
+        logger.info("Sent daily agenda to %s users.", len({user_id for user_id, _, _ in pending} - failed))
+
+    async def run(self):
+        # Sleeps until the next reminder, the end of the loaded window or the
+        # next change poll, whichever comes first, or until a local write.
+        while True:
+            self.wakeup.clear()
+            wake = await self.check_deadlines()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(0.0, wake - self.clock()))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self.runner = asyncio.create_task(self.run())
+        self.scheduler.add_job(self.send_agenda, 'cron', hour=AGENDA_HOUR, misfire_grace_time=3600)
+        self.scheduler.start()
+        logger.info("Scheduler started.")
+
+    def stop(self):
+        if self.runner is not None:
+            self.runner.cancel()
+            self.runner = None
+        self.scheduler.shutdown(wait=False)
@@ -1,60 +1,106 @@
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime
-import calendar
-
-class Calendar:
-    @staticmethod
-    def create_calendar(year=None, month=None):
-        now = datetime.now()
-        year = year or now.year
-        month = month or now.month
-        if year < now.year or (year == now.year and month < now.month):
-            year, month = now.year, now.month
-        month_name = calendar.month_name[month]
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text=f"{month_name} {year}", callback_data="ignore"),
-            InlineKeyboardButton(text="⬅", callback_data=f"prev_month_{year}_{month}"),
-            InlineKeyboardButton(text="➡", callback_data=f"next_month_{year}_{month}")
-        ])
-        days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text=day, callback_data="ignore") for day in days])
-        cal = calendar.monthcalendar(year, month)
-        for week in cal:
-            row = []
-            for day in week:
-                if day == 0:
-                    row.append(InlineKeyboardButton(text=" ", callback_data="ignore"))
-                else:
-                    is_disabled = (year == now.year and month == now.month and day < now.day)
-                    callback_data = f"day_{year}_{month}_{day}" if not is_disabled else "ignore"
-                    row.append(InlineKeyboardButton(text=str(day), callback_data=callback_data))
-            keyboard.inline_keyboard.append(row)
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text="Пропустить", callback_data="skip_deadline")])
-        return keyboard
-
-    @staticmethod
-    def create_time_picker():
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        now = datetime.now()
-        current_hour = now.hour
-        current_minute = now.minute // 30 * 30
-        times = [f"{h:02d}:{m:02d}" for h in range(0, 24) for m in (0, 30)]
-        for i in range(0, len(times), 4):
-            row = []
-            for time in times[i:i+4]:
-                hour, minute = map(int, time.split(':'))
-                is_disabled = (hour < current_hour or (hour == current_hour and minute < current_minute))
-                callback_data = f"time_{time}" if not is_disabled else "ignore"
-                row.append(InlineKeyboardButton(text=time, callback_data=callback_data))
-            keyboard.inline_keyboard.append(row)
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text="Пропустить", callback_data="skip_deadline")])
-        return keyboard
-
-calendar_instance = Calendar()
-
-def create_calendar(year=None, month=None):
-    return calendar_instance.create_calendar(year, month)
-
-def create_time_picker():
-    return calendar_instance.create_time_picker()
\ No newline at end of file
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import DayCallback, MonthCallback, TimeCallback
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Optional
+import calendar
+
+DEADLINE_FORMAT = '%d.%m.%Y %H:%M'
+
+CALENDAR_CACHE_SIZE = 64
+WEEKDAY_ROW = [InlineKeyboardButton(text=day, callback_data="ignore") for day in ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]]
+SKIP_ROW = [InlineKeyboardButton(text="Пропустить", callback_data="skip_deadline")]
+BLANK_BUTTON = InlineKeyboardButton(text=" ", callback_data="ignore")
+TIMES = [(h, m) for h in range(0, 24) for m in (0, 30)]
+
+def build_calendar(year: int, month: int, today: date) -> InlineKeyboardMarkup:
+    month_name = calendar.month_name[month]
+    prev_year, prev_month = (year - 1, 12) if month == 1 else (year, month - 1)
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    keyboard.inline_keyboard.append([
+        InlineKeyboardButton(text=f"{month_name} {year}", callback_data="ignore"),
+        InlineKeyboardButton(text="⬅", callback_data=MonthCallback(year=prev_year, month=prev_month).pack()),
+        InlineKeyboardButton(text="➡", callback_data=MonthCallback(year=next_year, month=next_month).pack())
+    ])
+    keyboard.inline_keyboard.append(WEEKDAY_ROW)
+    cal = calendar.monthcalendar(year, month)
+    for week in cal:
+        row = []
+        for day in week:
+            if day == 0:
+                row.append(BLANK_BUTTON)
+            else:
+                is_disabled = (year == today.year and month == today.month and day < today.day)
+                callback_data = DayCallback(year=year, month=month, day=day).pack() if not is_disabled else "ignore"
+                row.append(InlineKeyboardButton(text=str(day), callback_data=callback_data))
+        keyboard.inline_keyboard.append(row)
+    keyboard.inline_keyboard.append(SKIP_ROW)
+    return keyboard
+
+def build_time_picker(slot: int) -> InlineKeyboardMarkup:
+    # slot is the index of the current half hour in TIMES; earlier ones are disabled.
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    for i in range(0, len(TIMES), 4):
+        row = []
+        for index, (hour, minute) in enumerate(TIMES[i:i+4], start=i):
+            callback_data = TimeCallback(hour=hour, minute=minute).pack() if index >= slot else "ignore"
+            row.append(InlineKeyboardButton(text=f"{hour:02d}:{minute:02d}", callback_data=callback_data))
+        keyboard.inline_keyboard.append(row)
+    keyboard.inline_keyboard.append(SKIP_ROW)
+    return keyboard
+
+class Calendar:
+    """Hands out prebuilt keyboards; they only change with the date and the half hour.
+
+    The markups are shared between users, so callers must not modify them.
+    """
+
+    def __init__(self, cache_size: int = CALENDAR_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.calendars: OrderedDict = OrderedDict()
+        self.today = None
+        self.time_picker = None
+        self.time_slot = None
+
+    def create_calendar(self, year=None, month=None):
+        now = datetime.now()
+        year = year or now.year
+        month = month or now.month
+        if year < now.year or (year == now.year and month < now.month):
+            year, month = now.year, now.month
+        today = now.date()
+        if today != self.today:
+            # Yesterday's keyboards disable the wrong days.
+            self.calendars.clear()
+            self.today = today
+        key = (year, month, today)
+        keyboard = self.calendars.get(key)
+        if keyboard is None:
+            keyboard = self.calendars[key] = build_calendar(year, month, today)
+            if len(self.calendars) > self.cache_size:
+                self.calendars.popitem(last=False)
+        return keyboard
+
+    def create_time_picker(self):
+        now = datetime.now()
+        slot = now.hour * 2 + now.minute // 30
+        if slot != self.time_slot:
+            self.time_picker = build_time_picker(slot)
+            self.time_slot = slot
+        return self.time_picker
+
+calendar_instance = Calendar()
+
+def create_calendar(year=None, month=None):
+    return calendar_instance.create_calendar(year, month)
+
+def create_time_picker():
+    return calendar_instance.create_time_picker()
+
+def deadline_timestamp(date_str: str, time_str: str) -> int:
+    # Picker values are in the bot's local time; storage uses UTC epoch seconds.
+    return int(datetime.strptime(f"{date_str} {time_str}", DEADLINE_FORMAT).timestamp())
+
+def format_deadline(timestamp: Optional[int]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).strftime(DEADLINE_FORMAT) if timestamp else None
\ No newline at end of file
@@ -0,0 +1,177 @@
+from database import TaskManager
+from datetime import datetime
+from export import EXPORT_COLUMNS, JSON_KEYS
+from task_calendar import DEADLINE_FORMAT
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import csv
+import functools
+import gzip
+import io
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram does not let bots download files larger than this.
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+IMPORT_BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 2.0
+# A single JSON record larger than this means the file is broken.
+MAX_RECORD_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+# Both the CSV header and the JSON keys written by export are accepted.
+COLUMN_KEYS = {**dict(zip(EXPORT_COLUMNS, JSON_KEYS)), **{key: key for key in JSON_KEYS}}
+
+@functools.lru_cache(maxsize=4096)
+def parse_export_deadline(value: str) -> int:
+    # strptime dominates the parse cost, and deadlines repeat a lot in practice.
+    return int(datetime.strptime(value, DEADLINE_FORMAT).timestamp())
+
+def parse_record(record: Any, now: int) -> Optional[Tuple[str, str, Optional[int], int, int]]:
+    # Turns one exported row into (text, category, deadline_ts, completed,
+    # created_ts), or None if it does not validate.
+    if not isinstance(record, dict):
+        return None
+    try:
+        text = str(record.get('task') or '').strip()
+        category = str(record.get('category') or '').strip() or 'Общее'
+        if not text or len(text) > 200 or len(category) > 50:
+            return None
+        deadline = record.get('deadline') or None
+        if deadline is not None:
+            deadline = parse_export_deadline(str(deadline).strip())
+        completed = record.get('completed') or 0
+        completed = 1 if str(completed).strip().lower() in ('1', 'true', 'yes') else 0
+        created_at = record.get('created_at') or None
+        # Export writes creation times as 'YYYY-MM-DD HH:MM:SS', which fromisoformat
+        # parses far faster than strptime.
+        created_ts = int(datetime.fromisoformat(str(created_at).strip()).timestamp()) if created_at else now
+        return text, category, deadline, completed, created_ts
+    except (TypeError, ValueError):
+        return None
+
+def iter_csv(stream) -> Iterator[Optional[Dict[str, Any]]]:
+    reader = csv.reader(stream)
+    header = next(reader, None)
+    if header is None:
+        return
+    keys = [COLUMN_KEYS.get(column.strip()) for column in header]
+    if 'task' not in keys:
+        raise ValueError(f"CSV header has no task column: {header}")
+    for row in reader:
+        if not row:
+            continue
+        yield dict(zip(keys, row)) if len(row) == len(keys) else None
+
+def iter_jsonl(stream) -> Iterator[Optional[Dict[str, Any]]]:
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def iter_json_array(stream) -> Iterator[Any]:
+    # Decodes the elements of a top-level array one at a time with raw_decode,
+    # reading further only when the buffered text ends inside an element.
+    decoder = json.JSONDecoder()
+    buffer = stream.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError("JSON file is not an array")
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("Buffer exhausted", buffer, pos)
+            record, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof or len(buffer) - pos > MAX_RECORD_SIZE:
+                raise ValueError(f"Malformed JSON near character {pos}")
+            chunk = stream.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+
+def iter_records(file: BinaryIO) -> Iterator[Optional[Dict[str, Any]]]:
+    # The format is sniffed instead of trusted from the file name: gzip by its
+    # magic bytes, then a JSON array, JSON lines or CSV by the first character.
+    file.seek(0)
+    raw = gzip.GzipFile(fileobj=file, mode='rb') if file.read(2) == b'\x1f\x8b' else file
+    file.seek(0)
+    stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    try:
+        first = stream.read(1024).lstrip()[:1]
+        stream.seek(0)
+        if first == '[':
+            yield from iter_json_array(stream)
+        elif first == '{':
+            yield from iter_jsonl(stream)
+        else:
+            yield from iter_csv(stream)
+    finally:
+        # The caller owns the file; only the wrappers around it are closed.
+        stream.detach()
+        if raw is not file:
+            raw.close()
+
+def iter_import_batches(file: BinaryIO, stats: Dict[str, int], batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[List[Tuple]]:
+    now = int(datetime.now().timestamp())
+    batch = []
+    for record in iter_records(file):
+        stats['rows'] += 1
+        row = parse_record(record, now)
+        if row is None:
+            stats['invalid'] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def import_tasks(task_manager: TaskManager, user_id: int, file: BinaryIO,
+                       progress: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None) -> Dict[str, int]:
+    # Parses on a worker thread and inserts batch by batch, so neither the file
+    # nor the event loop is held up; progress is reported every few seconds.
+    # Batches already inserted stay committed when a later one fails, so the
+    # stats are returned with 'error' set instead of being thrown away.
+    stats = {'rows': 0, 'added': 0, 'duplicates': 0, 'invalid': 0, 'error': 0}
+    batches = iter_import_batches(file, stats)
+    try:
+        last_report = time.monotonic()
+        while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+            added = await task_manager.import_tasks(user_id, batch)
+            if added is None:
+                stats['error'] = 1
+                break
+            stats['added'] += added
+            stats['duplicates'] += len(batch) - added
+            if progress is not None and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                try:
+                    await progress(stats)
+                except Exception as e:
+                    # A failed progress update must not abort the import.
+                    logger.warning("Failed to report import progress for user %s: %s", user_id, e)
+    except Exception as e:
+        logger.error("Failed to import tasks for user %s after %s rows: %s", user_id, stats['rows'], e)
+        stats['error'] = 1
+    finally:
+        # Closes the file wrappers even when the import stopped halfway.
+        await asyncio.to_thread(batches.close)
+    if stats['error']:
+        logger.warning("Import for user %s stopped early: %s", user_id, stats)
+    else:
+        logger.info("Imported tasks for user %s: %s", user_id, stats)
+    return stats
@@ -1,49 +1,102 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import os
-import logging
-
-logger = logging.getLogger(__name__)
-
-class StatsVisualizer:
-    @staticmethod
-    def generate_stats_plot(data, user_id):
-        try:
-            if not data:
-                logger.error(f"No data provided for user {user_id}")
-                return None
-            categories = {}
-            for category, completed, count in data:
-                if category not in categories:
-                    categories[category] = {'completed': 0, 'total': 0}
-                categories[category]['total'] += count
-                if completed:
-                    categories[category]['completed'] += count
-            if not categories:
-                logger.error(f"No valid stats data for user {user_id}")
-                return None
-            plt.figure(figsize=(8, 6))
-            cat_names = list(categories.keys())
-            progress = [categories[cat]['completed'] / categories[cat]['total'] * 100 for cat in cat_names]
-            plt.bar(cat_names, progress, color='skyblue')
-            plt.xlabel('Категории')
-            plt.ylabel('Процент выполнения (%)')
-            plt.title('Статистика выполнения задач')
-            plt.xticks(rotation=45)
-            plot_file = f'stats_{user_id}.png'
-            plt.savefig(plot_file, bbox_inches='tight')
-            plt.close()
-            if not os.path.exists(plot_file):
-                logger.error(f"Plot file {plot_file} was not created for user {user_id}")
-                return None
-            logger.info(f"Generated stats plot for user {user_id}: {plot_file}")
-            return plot_file
-        except Exception as e:
-            logger.error(f"Failed to generate stats plot for user {user_id}: {e}")
-            return None
-
-visualizer_instance = StatsVisualizer()
-
-def generate_stats_plot(data, user_id):
-    return visualizer_instance.generate_stats_plot(data, user_id)
\ No newline at end of file
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+from metrics import operation_seconds, timed
+import asyncio
+import io
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+RENDER_WORKERS = 2
+RENDER_CACHE_SIZE = 256
+
+def render_stats_plot(data: Tuple[Tuple[str, int, int], ...]) -> Optional[bytes]:
+    # Runs in a worker process. Uses its own Figure instead of pyplot's global
+    # state and returns the PNG bytes instead of writing a file. matplotlib is
+    # imported here, so only render workers ever load it, on the first plot.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    categories = {}
+    for category, completed, count in data:
+        if category not in categories:
+            categories[category] = {'completed': 0, 'total': 0}
+        categories[category]['total'] += count
+        if completed:
+            categories[category]['completed'] += count
+    if not categories:
+        return None
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    cat_names = list(categories.keys())
+    progress = [categories[cat]['completed'] / categories[cat]['total'] * 100 for cat in cat_names]
+    ax.bar(cat_names, progress, color='skyblue')
+    ax.set_xlabel('Категории')
+    ax.set_ylabel('Процент выполнения (%)')
+    ax.set_title('Статистика выполнения задач')
+    ax.tick_params(axis='x', labelrotation=45)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+class StatsVisualizer:
+    def __init__(self, workers: int = RENDER_WORKERS, cache_size: int = RENDER_CACHE_SIZE):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.executor = None
+        self.cache: OrderedDict = OrderedDict()
+        self.pending = {}
+
+    async def generate_stats_plot(self, data: List[Tuple[str, int, int]], user_id: int) -> Optional[bytes]:
+        try:
+            if not data:
+                logger.error("No data provided for user %s", user_id)
+                return None
+            # Users with identical stats get the same picture, so the sorted
+            # rows are a complete cache key.
+            key = tuple(sorted(tuple(row) for row in data))
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                logger.debug("Served cached stats plot for user %s", user_id)
+                return self.cache[key]
+            if self.executor is None:
+                # Forking would copy the DB and FSM executor threads' locks into
+                # the workers, so they are spawned like the webhook workers.
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            executor = self.executor
+            # Concurrent requests for the same stats share one render.
+            if key not in self.pending:
+                self.pending[key] = asyncio.get_running_loop().run_in_executor(executor, render_stats_plot, key)
+            try:
+                plot = await asyncio.shield(self.pending[key])
+            finally:
+                self.pending.pop(key, None)
+            if plot is None:
+                logger.error("No valid stats data for user %s", user_id)
+                return None
+            self.cache[key] = plot
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            logger.info("Generated stats plot for user %s: %s bytes", user_id, len(plot))
+            return plot
+        except BrokenProcessPool as e:
+            logger.error("Render pool crashed while plotting for user %s: %s", user_id, e)
+            # Other waiters on the same pool may have replaced it already.
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = None
+            return None
+        except Exception as e:
+            logger.error("Failed to generate stats plot for user %s: %s", user_id, e)
+            return None
+
+visualizer_instance = StatsVisualizer()
+
+@timed(operation_seconds, 'generate_stats_plot')
+async def generate_stats_plot(data, user_id):
+    return await visualizer_instance.generate_stats_plot(data, user_id)
@@ -0,0 +1,239 @@
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from fsm_storage import SQLiteStorage
+from metrics import METRICS_PORT, registry, start_metrics_server
+from outbound import GLOBAL_RATE, RateLimitMiddleware
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+
+logger = logging.getLogger(__name__)
+
+API_TOKEN = 'YOUR TOKEN'
+WEBHOOK_HOST = 'https://example.com'
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = 'change-me'
+LISTEN_HOST = '0.0.0.0'
+LISTEN_PORT = 8080
+WORKERS = 4
+WORKER_QUEUE_SIZE = 1000
+WORKER_CONCURRENCY = 64
+DRAIN_TIMEOUT = 30
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    # The chat an update belongs to; updates without one (inline queries and
+    # the like) are keyed by their sender, and failing that by update_id.
+    for event in update.values():
+        if isinstance(event, dict):
+            chat = event.get('chat') or (event.get('message') or {}).get('chat') or event.get('from')
+            if chat and 'id' in chat:
+                return chat['id']
+    return update.get('update_id', 0)
+
+class UpdateWorker:
+    """Feeds updates from one pool queue into a Dispatcher of its own.
+
+    Updates of different chats run concurrently, updates of the same chat
+    strictly one after another in arrival order.
+    """
+
+    def __init__(self, dp, bot, concurrency: int = WORKER_CONCURRENCY):
+        self.dp = dp
+        self.bot = bot
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tails: Dict[int, asyncio.Task] = {}
+        self.processed = 0
+
+    async def process(self, chat_id: int, update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self.dp.feed_raw_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            logger.error("Error processing update %s for chat %s: %s", update.get('update_id'), chat_id, e)
+        finally:
+            self.semaphore.release()
+            if self.tails.get(chat_id) is asyncio.current_task():
+                del self.tails[chat_id]
+
+    async def run(self, updates: multiprocessing.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            chat_id, update = item
+            await self.semaphore.acquire()
+            self.tails[chat_id] = asyncio.create_task(self.process(chat_id, update, self.tails.get(chat_id)))
+        # Drain: everything already taken off the queue is finished first.
+        await asyncio.gather(*self.tails.values(), return_exceptions=True)
+
+async def run_worker(index: int, updates: multiprocessing.Queue, token: str, global_rate: float, session=None, fsm_path: Optional[str] = None,
+                     metrics_port: Optional[int] = None):
+    # Imported here so the webhook process does not build a router and task
+    # manager it never uses.
+    from handlers import router
+
+    bot = Bot(token=token, session=session)
+    rate_limiter = RateLimitMiddleware(global_rate=global_rate)
+    bot.session.middleware(rate_limiter)
+    dp = Dispatcher(storage=SQLiteStorage(fsm_path) if fsm_path else SQLiteStorage())
+    dp.include_router(router)
+    worker = UpdateWorker(dp, bot)
+    registry.register_collector('bot_requests', lambda: rate_limiter.metrics)
+    registry.register_collector('bot_worker', lambda: {'processed': worker.processed, 'in_progress': len(worker.tails)})
+    # Handler and query metrics live in the worker, so each one serves its own.
+    metrics_runner = await start_metrics_server(port=metrics_port) if metrics_port else None
+    logger.info("Update worker %s started.", index)
+    try:
+        await worker.run(updates)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await dp.storage.close()
+        await bot.session.close()
+        logger.info("Update worker %s stopped after %s updates.", index, worker.processed)
+
+def worker_main(index: int, updates: multiprocessing.Queue, token: str, global_rate: float, session_factory=None, fsm_path: Optional[str] = None,
+                metrics_port: Optional[int] = None):
+    # Shutdown is driven by the parent through the queue, not by Ctrl+C.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    session = session_factory() if session_factory is not None else None
+    asyncio.run(run_worker(index, updates, token, global_rate, session, fsm_path, metrics_port))
+
+class WorkerPool:
+    """N update processes, each owning a bounded queue and a fixed set of chats.
+
+    A chat is always hashed to the same process, which keeps its updates in
+    order and its FSM state and user cache in a single place.
+    """
+
+    def __init__(self, token: str, workers: int = WORKERS, queue_size: int = WORKER_QUEUE_SIZE, global_rate: float = GLOBAL_RATE,
+                 session_factory=None, fsm_path: Optional[str] = None, metrics_port: Optional[int] = METRICS_PORT):
+        self.token = token
+        self.workers = workers
+        # Every process talks to Telegram on its own, so they split the global
+        # limit; the parent sends reminders and gets a share as well.
+        self.worker_rate = global_rate / (workers + 1)
+        self.queue_size = queue_size
+        self.session_factory = session_factory
+        self.fsm_path = fsm_path
+        # Worker i serves /metrics on metrics_port + 1 + i; None turns it off.
+        self.metrics_port = metrics_port
+        # Workers import aiogram, matplotlib and open their own databases, so
+        # they start fresh instead of forking the parent's threads.
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = []
+        self.processes = []
+        self.metrics = {'accepted': 0, 'rejected': 0}
+
+    def start(self):
+        for index in range(self.workers):
+            updates = self.context.Queue(maxsize=self.queue_size)
+            process = self.context.Process(target=worker_main, name=f'update-worker-{index}',
+                                           args=(index, updates, self.token, self.worker_rate, self.session_factory, self.fsm_path,
+                                                 self.metrics_port + 1 + index if self.metrics_port else None))
+            process.start()
+            self.queues.append(updates)
+            self.processes.append(process)
+        logger.info("Started %s update workers.", self.workers)
+
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        chat_id = update_chat_id(update)
+        try:
+            self.queues[hash(chat_id) % self.workers].put_nowait((chat_id, update))
+        except queue.Full:
+            self.metrics['rejected'] += 1
+            return False
+        self.metrics['accepted'] += 1
+        return True
+
+    def drain(self, timeout: float = DRAIN_TIMEOUT):
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.error("%s did not drain within %ss, terminating.", process.name, timeout)
+                process.terminate()
+                process.join()
+        self.queues = []
+        self.processes = []
+        logger.info("Update workers drained: %s", self.metrics)
+
+async def handle_update(request: web.Request) -> web.Response:
+    if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != request.app['secret']:
+        return web.Response(status=401)
+    try:
+        update = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not request.app['pool'].dispatch(update):
+        # Telegram redelivers the update later, which is the backpressure.
+        return web.Response(status=503)
+    return web.Response()
+
+def create_app(pool: WorkerPool, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH) -> web.Application:
+    app = web.Application()
+    app['pool'] = pool
+    app['secret'] = secret
+    app.router.add_post(path, handle_update)
+
+    async def on_startup(app):
+        pool.start()
+
+    async def on_cleanup(app):
+        # The server has stopped accepting updates by now; let the workers
+        # finish what is queued.
+        await asyncio.get_running_loop().run_in_executor(None, pool.drain)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    from outbound import OutboundQueue
+    from scheduler import SchedulerManager
+
+    logging.basicConfig(level=logging.INFO)
+    pool = WorkerPool(API_TOKEN)
+    app = create_app(pool)
+    # Not main.bot: importing main builds the polling dispatcher and router,
+    # and its limiter would use the whole global rate on top of the workers'.
+    bot = Bot(token=API_TOKEN)
+    rate_limiter = RateLimitMiddleware(global_rate=pool.worker_rate)
+    bot.session.middleware(rate_limiter)
+    registry.register_collector('bot_requests', lambda: rate_limiter.metrics)
+    registry.register_collector('bot_webhook', lambda: pool.metrics)
+
+    async def on_startup(app):
+        await bot.set_webhook(WEBHOOK_HOST + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        # Reminders are sent from this process only, however many workers run.
+        outbound = OutboundQueue(bot)
+        outbound.start()
+        app['outbound'] = outbound
+        registry.register_collector('bot_outbound', lambda: outbound.metrics)
+        app['metrics'] = await start_metrics_server()
+        app['scheduler'] = SchedulerManager(bot, outbound)
+        app['scheduler'].start()
+        registry.register_collector('bot_reminders', lambda: app['scheduler'].metrics)
+        logging.info("Webhook set to %s.", WEBHOOK_HOST + WEBHOOK_PATH)
+
+    async def on_cleanup(app):
+        app['scheduler'].stop()
+        await app['outbound'].stop()
+        if app['metrics'] is not None:
+            await app['metrics'].cleanup()
+        await bot.session.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=LISTEN_HOST, port=LISTEN_PORT)
+
+if __name__ == '__main__':
+    main()